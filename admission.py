@@ -0,0 +1,200 @@
+"""
+Admission control for export endpoints
+
+Every export launches a browser that needs hundreds of MB, so the number of
+scrapes in flight is capped. Requests beyond the cap wait in a bounded queue;
+when the queue is full, the wait times out, or the process tree uses too much
+memory, the request is shed with 503 + Retry-After. Each API key is also
+limited by a token bucket (429 + Retry-After).
+
+Configuration (environment variables):
+    EXPORT_MAX_CONCURRENCY         scrapes running at once (default: 2)
+    EXPORT_MAX_QUEUE               requests allowed to wait for a slot (default: 4)
+    EXPORT_QUEUE_TIMEOUT_SECONDS   max time spent waiting for a slot (default: 30)
+    EXPORT_MAX_RSS_MB              shed new exports above this process-tree RSS, 0 = off (default: 0)
+    EXPORT_RATE_LIMIT_PER_MINUTE   sustained exports per API key, 0 = off (default: 6)
+    EXPORT_RATE_LIMIT_BURST        bucket size per API key (default: 3)
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+
+from process_utils import process_tree_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def _shed(status_code: int, detail: str, retry_after: float) -> HTTPException:
+    """Build an HTTPException carrying a Retry-After header (whole seconds, at least 1)"""
+    return HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class AdmissionController:
+    """Concurrency cap with a bounded, time-limited wait queue and memory-aware shedding"""
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 4,
+                 queue_timeout: float = 30.0, max_rss_mb: int = 0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.shed_count = 0
+        # Moving average of how long a slot is held, used for Retry-After hints
+        self._avg_hold_seconds = 60.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("EXPORT_MAX_CONCURRENCY", 2)),
+            max_queue=int(os.getenv("EXPORT_MAX_QUEUE", 4)),
+            queue_timeout=float(os.getenv("EXPORT_QUEUE_TIMEOUT_SECONDS", 30)),
+            max_rss_mb=int(os.getenv("EXPORT_MAX_RSS_MB", 0)),
+        )
+
+    def _retry_after(self) -> float:
+        """Estimate when a slot is likely to free up"""
+        backlog = self.waiting + 1
+        return self._avg_hold_seconds * backlog / self.max_concurrent
+
+    def _check_memory(self):
+        if not self.max_rss_bytes:
+            return
+        rss = process_tree_rss_bytes()
+        if rss > self.max_rss_bytes:
+            self.shed_count += 1
+            logger.warning(f"Shedding export: process tree RSS {rss // (1024 * 1024)} MB "
+                           f"exceeds {self.max_rss_bytes // (1024 * 1024)} MB")
+            raise _shed(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is low on memory, please retry later",
+                self._retry_after()
+            )
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold an export slot for the duration of the block"""
+        acquired_at = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    async def acquire(self) -> float:
+        """
+        Wait for an export slot or raise 503.
+
+        Returns the acquisition time, to be passed to release(). Prefer slot()
+        unless the slot must outlive the handler (e.g. a streaming response).
+        """
+        self._check_memory()
+
+        if self.active + self.waiting >= self.max_concurrent + self.max_queue:
+            self.shed_count += 1
+            logger.warning(f"Shedding export: {self.active} running, {self.waiting} queued")
+            raise _shed(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Too many exports in progress, please retry later",
+                self._retry_after()
+            )
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed_count += 1
+            logger.warning(f"Shedding export: no slot freed within {self.queue_timeout}s")
+            raise _shed(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                f"No export slot available within {self.queue_timeout:g} seconds, please retry later",
+                self._retry_after()
+            )
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        return time.monotonic()
+
+    def release(self, acquired_at: float):
+        """Give back a slot taken with acquire()"""
+        self.active -= 1
+        self._semaphore.release()
+        held = time.monotonic() - acquired_at
+        self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * held
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "shed": self.shed_count,
+        }
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> Optional[float]:
+        """Take a token. Returns None on success, else the seconds until one is available."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-key token buckets"""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.per_minute = per_minute
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls(
+            per_minute=float(os.getenv("EXPORT_RATE_LIMIT_PER_MINUTE", 6)),
+            burst=int(os.getenv("EXPORT_RATE_LIMIT_BURST", 3)),
+        )
+
+    def check(self, key: str):
+        """Consume a token for `key`, raising 429 when the bucket is empty"""
+        if self.per_minute <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.per_minute / 60, self.burst)
+        wait_seconds = bucket.try_acquire()
+        if wait_seconds is not None:
+            logger.warning(f"Rate limit exceeded for API key {key[:8]}...")
+            raise _shed(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "Rate limit exceeded for this API key",
+                wait_seconds
+            )
@@ -0,0 +1,224 @@
+"""
+Debug artifacts (screenshots, HTML snapshots, HAR and Playwright traces)
+
+Artifacts are stored per export job under ARTIFACTS_DIR/<job_id>/ instead of
+fixed file names in the working directory, so concurrent exports do not
+overwrite each other's files. Capture levels:
+
+    off     - nothing
+    errors  - screenshot + HTML when something goes wrong (default)
+    all     - also the happy-path checkpoints (login page, history page, ...)
+
+The level defaults to DEBUG_ARTIFACTS and can be raised per request. Captures
+run as background tasks so the export does not wait for them; they are
+awaited (bounded by ARTIFACTS_FLUSH_TIMEOUT_SECONDS) before the browser
+context is closed. Old jobs are pruned by age (ARTIFACTS_MAX_AGE_HOURS) and
+total size (ARTIFACTS_MAX_TOTAL_MB).
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from fastapi import Query
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("off", "errors", "all")
+
+# Job ids and file names served over HTTP must match these
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+FILE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Written by Playwright when the browser context closes
+HAR_FILE_NAME = "network.har"
+
+
+class ArtifactStore:
+    """Directory of per-job artifact folders with age and size limits"""
+
+    def __init__(self, root: str, max_total_mb: int = 200, max_age_hours: float = 72,
+                 default_level: str = "errors", flush_timeout: float = 10):
+        self.root = root
+        self.max_total_bytes = max_total_mb * 1024 * 1024
+        self.max_age_seconds = max_age_hours * 3600
+        self.default_level = default_level if default_level in LEVELS else "errors"
+        self.flush_timeout = flush_timeout
+
+    @classmethod
+    def from_env(cls) -> "ArtifactStore":
+        return cls(
+            os.getenv("ARTIFACTS_DIR", "artifacts"),
+            max_total_mb=int(os.getenv("ARTIFACTS_MAX_TOTAL_MB", 200)),
+            max_age_hours=float(os.getenv("ARTIFACTS_MAX_AGE_HOURS", 72)),
+            default_level=os.getenv("DEBUG_ARTIFACTS", "errors").lower(),
+            flush_timeout=float(os.getenv("ARTIFACTS_FLUSH_TIMEOUT_SECONDS", 10)),
+        )
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def new_job(self, level: Optional[str] = None, trace: bool = False) -> "ArtifactRecorder":
+        return ArtifactRecorder(self, uuid.uuid4().hex, level or self.default_level, trace)
+
+    def _job_info(self, job_id: str) -> Optional[Dict]:
+        path = self.job_dir(job_id)
+        try:
+            entries = list(os.scandir(path))
+            created = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        files = [{"name": entry.name, "bytes": entry.stat().st_size}
+                 for entry in sorted(entries, key=lambda e: e.name) if entry.is_file()]
+        return {
+            "job_id": job_id,
+            "created_at": created,
+            "bytes": sum(f["bytes"] for f in files),
+            "files": files,
+        }
+
+    def list_jobs(self) -> List[Dict]:
+        """Stored jobs, newest first"""
+        if not os.path.isdir(self.root):
+            return []
+        jobs = [self._job_info(name) for name in os.listdir(self.root) if JOB_ID_PATTERN.match(name)]
+        return sorted(filter(None, jobs), key=lambda job: -job["created_at"])
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        return self._job_info(job_id)
+
+    def file_path(self, job_id: str, name: str) -> Optional[str]:
+        """Path of a stored artifact, None if the names are invalid or the file does not exist"""
+        if not JOB_ID_PATTERN.match(job_id) or not FILE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.job_dir(job_id), name)
+        return path if os.path.isfile(path) else None
+
+    def prune(self) -> List[str]:
+        """Delete jobs older than the age limit, then the oldest ones until under the size limit"""
+        removed = []
+        now = time.time()
+        jobs = self.list_jobs()
+        total = sum(job["bytes"] for job in jobs)
+        # Oldest first
+        for job in reversed(jobs):
+            too_old = self.max_age_seconds and now - job["created_at"] > self.max_age_seconds
+            too_big = self.max_total_bytes and total > self.max_total_bytes
+            if not (too_old or too_big):
+                continue
+            shutil.rmtree(self.job_dir(job["job_id"]), ignore_errors=True)
+            total -= job["bytes"]
+            removed.append(job["job_id"])
+        if removed:
+            logger.info(f"Pruned {len(removed)} artifact job(s)")
+        return removed
+
+
+class ArtifactRecorder:
+    """Captures artifacts for one export job"""
+
+    def __init__(self, store: ArtifactStore, job_id: str, level: str, trace: bool = False):
+        self.store = store
+        self.job_id = job_id
+        self.level = level if level in LEVELS else store.default_level
+        self.trace = trace
+        self.captured: List[str] = []
+        self._pending: List[asyncio.Task] = []
+        self._tracing_started = False
+        self._sequence = itertools.count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return self.level != "off"
+
+    @property
+    def directory(self) -> str:
+        return self.store.job_dir(self.job_id)
+
+    def context_options(self) -> Dict:
+        """Extra browser context options (HAR recording when tracing is requested)"""
+        if not self.trace:
+            return {}
+        os.makedirs(self.directory, exist_ok=True)
+        return {"record_har_path": os.path.join(self.directory, HAR_FILE_NAME), "record_har_content": "omit"}
+
+    async def start_tracing(self, context):
+        """Start a Playwright trace (screenshots and DOM snapshots) if requested"""
+        if self.trace:
+            await context.tracing.start(screenshots=True, snapshots=True)
+            self._tracing_started = True
+
+    def capture(self, page, name: str, error: bool = False):
+        """Schedule a screenshot and HTML snapshot of `page` without waiting for it"""
+        if page is None or self.level == "off" or (self.level == "errors" and not error):
+            return
+        prefix = f"{next(self._sequence):02d}-{name}"
+        self._pending.append(asyncio.create_task(self._capture(page, prefix)))
+
+    async def _capture(self, page, prefix: str):
+        with span("artifacts.capture", artifact=prefix):
+            try:
+                screenshot = await page.screenshot(type="jpeg", quality=70)
+                html = await page.content()
+            except Exception as e:
+                logger.warning(f"Could not capture artifact {prefix}: {str(e)}")
+                return
+            await asyncio.to_thread(self._write, f"{prefix}.jpg", screenshot)
+            await asyncio.to_thread(self._write, f"{prefix}.html", html.encode("utf-8"))
+            logger.info(f"Saved debug artifacts {prefix} for job {self.job_id}")
+
+    def _write(self, name: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(data)
+        self.captured.append(name)
+
+    async def add_file(self, name: str, data: bytes):
+        """Store an extra file (e.g. a profile) with this job's artifacts"""
+        await asyncio.to_thread(self._write, name, data)
+
+    async def flush(self, context=None):
+        """Wait for pending captures and stop the trace; call before closing the context"""
+        if self._pending:
+            _, pending = await asyncio.wait(self._pending, timeout=self.store.flush_timeout)
+            for task in pending:
+                task.cancel()
+            self._pending = []
+        if self._tracing_started and context is not None:
+            try:
+                await asyncio.wait_for(context.tracing.stop(path=os.path.join(self.directory, "trace.zip")),
+                                       timeout=self.store.flush_timeout)
+                self.captured.append("trace.zip")
+            except Exception as e:
+                logger.warning(f"Could not save Playwright trace for job {self.job_id}: {str(e)}")
+            self._tracing_started = False
+
+    async def finish(self):
+        """Record the HAR written when the context closed, then prune old jobs; call after closing the context"""
+        if (self.trace and HAR_FILE_NAME not in self.captured
+                and os.path.isfile(os.path.join(self.directory, HAR_FILE_NAME))):
+            self.captured.append(HAR_FILE_NAME)
+        if self.captured or self.trace:
+            await asyncio.to_thread(self.store.prune)
+
+
+artifact_store = ArtifactStore.from_env()
+
+
+def artifact_recorder(
+    debug_artifacts: Optional[str] = Query(None, pattern="^(off|errors|all)$",
+                                           description="Debug artifact level for this export (default: DEBUG_ARTIFACTS)"),
+    trace: bool = Query(False, description="Also record a Playwright trace and a HAR file"),
+) -> ArtifactRecorder:
+    """FastAPI dependency creating this request's artifact recorder"""
+    return artifact_store.new_job(debug_artifacts, trace)
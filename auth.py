@@ -0,0 +1,85 @@
+"""
+API key authentication with scopes
+
+Presented keys are hashed once and compared against every configured hash
+with hmac.compare_digest. Successful lookups are kept in a small LRU cache
+keyed by the hash, which is cleared whenever settings are reloaded.
+"""
+
+import hmac
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Security, status
+from fastapi.security import APIKeyHeader
+
+from settings import ApiKey, get_settings, hash_api_key, on_reload
+
+logger = logging.getLogger(__name__)
+
+API_KEY_NAME = "X-API-Key"
+api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
+
+_CACHE_SIZE = 128
+_verified_keys: "OrderedDict[str, ApiKey]" = OrderedDict()
+
+
+@on_reload
+def _clear_cache(_settings=None):
+    _verified_keys.clear()
+
+
+def _lookup(presented_hash: str) -> Optional[ApiKey]:
+    """Constant-time match of a hash against every configured key"""
+    match = None
+    for key in get_settings().api_keys:
+        # No early exit: every configured key is compared
+        if hmac.compare_digest(presented_hash, key.key_hash):
+            match = key
+    return match
+
+
+async def verify_api_key(api_key: str = Security(api_key_header)) -> ApiKey:
+    """Verify the API key from the request header"""
+    presented_hash = hash_api_key(api_key)
+
+    cached = _verified_keys.get(presented_hash)
+    if cached is not None:
+        _verified_keys.move_to_end(presented_hash)
+        return cached
+
+    if not get_settings().api_keys:
+        logger.error("No API key configured in environment variables")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="API authentication not properly configured"
+        )
+
+    key = _lookup(presented_hash)
+    if key is None:
+        logger.warning(f"Invalid API key attempt: {api_key[:8]}...")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid API key"
+        )
+
+    _verified_keys[presented_hash] = key
+    if len(_verified_keys) > _CACHE_SIZE:
+        _verified_keys.popitem(last=False)
+    return key
+
+
+def require_scope(scope: str):
+    """Dependency factory: authenticate and require `scope` (admin keys pass every check)"""
+
+    async def dependency(api_key: ApiKey = Depends(verify_api_key)) -> ApiKey:
+        if not api_key.has_scope(scope):
+            logger.warning(f"API key '{api_key.key_id}' lacks scope '{scope}'")
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"API key is not allowed to use this endpoint (requires '{scope}' scope)"
+            )
+        return api_key
+
+    return dependency
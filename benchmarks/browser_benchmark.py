@@ -0,0 +1,152 @@
+"""
+Compare browser engines and launch profiles on the export workload
+
+Runs the end-to-end export benchmark (benchmarks.export_benchmark, against
+the local fake services) once per browser profile, each in a fresh process
+configured through the BROWSER_* variables, and reports launch time, peak
+RSS of the process tree and export time side by side.
+
+Profiles are written engine/headless/launch, optionally followed by
+:renderers=N (BROWSER_RENDERER_PROCESS_LIMIT) and :heap=MB
+(BROWSER_JS_HEAP_MB). Engines that are not installed
+(`playwright install firefox webkit`) are reported as failed.
+
+Usage:
+    python -m benchmarks.browser_benchmark
+    python -m benchmarks.browser_benchmark --profiles chromium/shell/minimal:renderers=1:heap=256,firefox/shell/minimal --runs 8 --concurrency 2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+DEFAULT_PROFILES = ",".join([
+    "chromium/shell/desktop",
+    "chromium/shell/minimal",
+    "chromium/shell/minimal:renderers=1:heap=256",
+    "chromium/new/desktop",
+    "firefox/shell/minimal",
+    "webkit/shell/minimal",
+])
+
+PROFILE_OPTIONS = {"renderers": "BROWSER_RENDERER_PROCESS_LIMIT", "heap": "BROWSER_JS_HEAP_MB"}
+
+
+def profile_environment(spec: str) -> Dict[str, str]:
+    """BROWSER_* variables of a profile spec"""
+    base, *options = spec.split(":")
+    parts = base.split("/")
+    if len(parts) != 3:
+        raise ValueError(f"Profile '{spec}' is not engine/headless/launch")
+    env = {
+        "BROWSER_ENGINE": parts[0],
+        "BROWSER_HEADLESS": parts[1],
+        "BROWSER_LAUNCH_PROFILE": parts[2],
+        "BROWSER_RENDERER_PROCESS_LIMIT": "0",
+        "BROWSER_JS_HEAP_MB": "0",
+    }
+    for option in options:
+        name, _, value = option.partition("=")
+        if name not in PROFILE_OPTIONS or not value.isdigit():
+            raise ValueError(f"Unknown profile option '{option}' (expected renderers=N or heap=MB)")
+        env[PROFILE_OPTIONS[name]] = value
+    return env
+
+
+def run_profile(spec: str, args, passthrough: List[str]) -> Dict:
+    """Run the export benchmark with one profile in a fresh process"""
+    env = dict(os.environ, **profile_environment(spec))
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, "report.json")
+        command = [sys.executable, "-m", "benchmarks.export_benchmark", "--concurrency", str(args.concurrency),
+                   "--runs", str(args.runs), "--json", json_path, *passthrough]
+        print(f"▶ {spec}", flush=True)
+        try:
+            completed = subprocess.run(command, env=env, timeout=args.timeout, text=True,
+                                       stdout=None if args.verbose else subprocess.DEVNULL,
+                                       stderr=None if args.verbose else subprocess.PIPE)
+        except subprocess.TimeoutExpired:
+            return {"profile": spec, "error": f"timed out after {args.timeout:g}s"}
+        if not os.path.exists(json_path):
+            last_line = (completed.stderr or "").strip().splitlines()[-1:] or [f"exit code {completed.returncode}"]
+            return {"profile": spec, "error": last_line[0][:160]}
+        with open(json_path) as f:
+            report = json.load(f)
+
+    level = report["levels"][0]
+    total = level["stages"].get("export.total", {})
+    browser = report.get("browser", {})
+    return {
+        "profile": spec,
+        "version": browser.get("version"),
+        "successes": level["successes"],
+        "runs": level["runs"],
+        "launch_seconds": browser.get("last_launch_seconds"),
+        "peak_rss_mb": level["peak_rss_mb"],
+        "export_p50_ms": total.get("p50_ms"),
+        "export_p95_ms": total.get("p95_ms"),
+        "throughput_per_minute": level["throughput_per_minute"],
+        "errors": level["errors"][:3],
+        "locks": report.get("locks"),
+    }
+
+
+def _format(value: Optional[float], digits: int = 0) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_comparison(results: List[Dict]):
+    print("=" * 110)
+    print(f"{'profile':<46}{'ok':>7}{'launch s':>10}{'peak RSS MB':>13}{'p50 ms':>10}{'p95 ms':>10}{'exports/min':>13}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['profile']:<46}  ❌ {result['error']}")
+            continue
+        print(f"{result['profile']:<46}{result['successes']:>3}/{result['runs']:<3}"
+              f"{_format(result['launch_seconds'], 2):>10}{_format(result['peak_rss_mb']):>13}"
+              f"{_format(result['export_p50_ms']):>10}{_format(result['export_p95_ms']):>10}"
+              f"{_format(result['throughput_per_minute'], 1):>13}")
+        for error in result["errors"][:1]:
+            print(f"  ❌ {' '.join(error.split())[:100]}")
+    print("=" * 110)
+    notes = {result["locks"] for result in results if result.get("locks")}
+    for note in notes:
+        print(note)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare browser profiles on the export benchmark",
+                                     epilog="Other options (--csv-rows, --no-2fa, ...) are passed to benchmarks.export_benchmark")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES, help="Comma-separated profiles (engine/headless/launch[:renderers=N][:heap=MB])")
+    parser.add_argument("--concurrency", type=int, default=1, help="Exports in flight per profile")
+    parser.add_argument("--runs", type=int, default=4, help="Exports per profile")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed per profile")
+    parser.add_argument("--json", dest="json_path", help="Write the comparison to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show each run's full report")
+    args, passthrough = parser.parse_known_args(argv)
+    args.profiles = [spec.strip() for spec in args.profiles.split(",") if spec.strip()]
+    for spec in args.profiles:
+        try:
+            profile_environment(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    return args, passthrough
+
+
+def main(argv=None) -> int:
+    args, passthrough = parse_args(argv)
+    results = [run_profile(spec, args, passthrough) for spec in args.profiles]
+    print_comparison(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Report written to {args.json_path}")
+    return 0 if any("error" not in result and result["successes"] == result["runs"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
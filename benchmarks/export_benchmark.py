@@ -0,0 +1,246 @@
+"""
+End-to-end export benchmark against local fake Linxo, Gmail and n8n services
+
+Drives export_linxo_csv (real Playwright, real Gmail client, real webhook
+post) at several concurrency levels and reports per-stage p50/p95/p99,
+peak RSS of the process tree (including Chromium) and throughput.
+
+Usage:
+    python -m benchmarks.export_benchmark --concurrency 1,2,4 --runs 8
+    python -m benchmarks.export_benchmark --csv-rows 50000 --csv-latency-ms 1000 --json bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+from benchmarks.fake_services import FakeServiceConfig, FakeServices
+from process_utils import process_tree_rss_bytes
+
+
+# Every run logs in as the same fake Linxo account and exports the same scope: the
+# single-flight scrape lock and the per-scope delivery lock would run them one at a
+# time, and each level would measure lock waits instead of concurrent exports
+LOCKS_NOTE = "Single-flight scrape and delivery locks bypassed: all runs share one fake Linxo account"
+
+
+@asynccontextmanager
+async def _unlocked(*args, **kwargs):
+    yield
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class RssSampler(threading.Thread):
+    """Sample process-tree RSS in the background and keep the peak"""
+
+    def __init__(self, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak_bytes = max(self.peak_bytes, process_tree_rss_bytes())
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join(timeout=2)
+        return self.peak_bytes
+
+
+async def _run_once(export, record_stages) -> Dict:
+    """Run one export and return its stage durations"""
+    with record_stages() as stages:
+        start = time.perf_counter()
+        try:
+            response = await export()
+            ok = getattr(response, "status_code", 200) == 200
+            error = None if ok else bytes(response.body[:200]).decode("utf-8", "replace")
+        except Exception as e:
+            ok = False
+            error = str(getattr(e, "detail", e))[:200]
+        total = time.perf_counter() - start
+
+    durations = defaultdict(float)
+    for name, seconds in stages:
+        durations[name] += seconds
+    durations["export.total"] = total
+    return {"ok": ok, "error": error, "stages": dict(durations)}
+
+
+async def run_level(export, record_stages, concurrency: int, runs: int) -> Dict:
+    """Run `runs` exports with at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded():
+        async with semaphore:
+            return await _run_once(export, record_stages)
+
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bounded() for _ in range(runs)))
+    wall_seconds = time.perf_counter() - start
+    peak_rss = sampler.stop()
+
+    stage_samples = defaultdict(list)
+    for result in results:
+        if not result["ok"]:
+            continue
+        for name, seconds in result["stages"].items():
+            stage_samples[name].append(seconds)
+
+    successes = sum(1 for result in results if result["ok"])
+    return {
+        "concurrency": concurrency,
+        "runs": runs,
+        "successes": successes,
+        "errors": [result["error"] for result in results if not result["ok"]],
+        "wall_seconds": wall_seconds,
+        "throughput_per_minute": successes / wall_seconds * 60 if wall_seconds else 0.0,
+        "peak_rss_mb": peak_rss / (1024 * 1024),
+        "stages": {
+            name: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+            for name, samples in sorted(stage_samples.items())
+        },
+    }
+
+
+async def run_levels(export, record_stages, levels: List[int], runs: int, fakes, report: Dict):
+    """Run every concurrency level on one event loop (the shared browser is bound to it)"""
+    from browser_pool import browser_pool
+    from gmail_quota import gmail_quota
+
+    try:
+        for concurrency in levels:
+            level = await run_level(export, record_stages, concurrency, runs)
+            level["webhook_deliveries"] = fakes.state.webhook_deliveries
+            level["gmail_quota"] = gmail_quota.stats()
+            report["levels"].append(level)
+            print_report(level)
+        report["browser"] = browser_pool.stats()
+    finally:
+        await browser_pool.stop()
+
+
+def print_report(level: Dict):
+    print("=" * 80)
+    print(f"Concurrency {level['concurrency']}: {level['successes']}/{level['runs']} ok, "
+          f"{level['throughput_per_minute']:.1f} exports/min, "
+          f"peak RSS {level['peak_rss_mb']:.0f} MB, wall {level['wall_seconds']:.1f}s")
+    print("=" * 80)
+    print(f"{'stage':<40}{'n':>5}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for name, stats in level["stages"].items():
+        print(f"{name:<40}{stats['count']:>5}{stats['p50_ms']:>11.1f}{stats['p95_ms']:>11.1f}{stats['p99_ms']:>11.1f}")
+    for error in level["errors"][:5]:
+        print(f"  ❌ {error}")
+    print()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark export_linxo_csv against local fake services")
+    parser.add_argument("--concurrency", default="1,2,4", help="Comma-separated concurrency levels")
+    parser.add_argument("--runs", type=int, default=4, help="Exports per concurrency level")
+    parser.add_argument("--csv-rows", type=int, default=1000)
+    parser.add_argument("--csv-latency-ms", type=int, default=300)
+    parser.add_argument("--page-latency-ms", type=int, default=50)
+    parser.add_argument("--login-latency-ms", type=int, default=200)
+    parser.add_argument("--gmail-latency-ms", type=int, default=80)
+    parser.add_argument("--gmail-rate-limit-every", type=int, default=0,
+                        help="Answer one Gmail call in N with 429 (0 = never)")
+    parser.add_argument("--webhook-latency-ms", type=int, default=50)
+    parser.add_argument("--no-2fa", action="store_true", help="Skip the verification code step")
+    parser.add_argument("--single-use-codes", action="store_true", help="Reject 2FA codes that were already used")
+    parser.add_argument("--base-port", type=int, default=18080)
+    parser.add_argument("--json", dest="json_path", help="Write the full report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    config = FakeServiceConfig(
+        csv_rows=args.csv_rows,
+        require_2fa=not args.no_2fa,
+        page_latency_ms=args.page_latency_ms,
+        login_latency_ms=args.login_latency_ms,
+        csv_latency_ms=args.csv_latency_ms,
+        gmail_latency_ms=args.gmail_latency_ms,
+        gmail_rate_limit_every=args.gmail_rate_limit_every,
+        webhook_latency_ms=args.webhook_latency_ms,
+        single_use_codes=args.single_use_codes,
+    )
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    with FakeServices(config, base_port=args.base_port) as fakes:
+        os.environ.update(fakes.environment())
+        os.environ["API_KEY"] = "benchmark"
+        # No state shared with earlier runs (delivery hashes, result cache)
+        os.environ["STATE_BACKEND"] = "memory"
+
+        # Import after the environment points at the fakes; run in a scratch
+        # directory because the exporter writes its CSV and state files to cwd
+        sys.path.insert(0, os.getcwd())
+        import main as api
+        from main import export_linxo_csv
+        from artifacts import artifact_store
+        from export_filters import ExportFilters
+        from export_formats import ExportFormat
+        from run_history import RunRecorder
+        from settings import ApiKey
+        from tracing import record_stages
+
+        # Called directly, so the parameters FastAPI would resolve are passed explicitly;
+        # force=True keeps unchanged-data detection from skipping the webhook stage
+        def export():
+            return export_linxo_csv(filters=ExportFilters(), output=ExportFormat(), force=True,
+                                    artifacts=artifact_store.new_job("off"), run=RunRecorder("export-csv"),
+                                    api_key=ApiKey("benchmark", "", frozenset({"export"})))
+
+        api.linxo_scrape_lock = _unlocked
+        api.delivery_outbox.lock = _unlocked
+        print(LOCKS_NOTE)
+        print()
+
+        report = {"config": vars(config), "locks": LOCKS_NOTE, "levels": []}
+        with tempfile.TemporaryDirectory() as workdir:
+            previous_cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                asyncio.run(run_levels(export, record_stages, levels, args.runs, fakes, report))
+            finally:
+                os.chdir(previous_cwd)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json_path}")
+
+    return 0 if all(level["successes"] == level["runs"] for level in report["levels"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
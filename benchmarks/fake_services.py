@@ -0,0 +1,348 @@
+"""
+Local stand-ins for the external services used by an export
+
+- Fake Linxo: login page (email -> password -> optional 2FA), secured pages
+  and a UTF-16 CSV download endpoint with configurable size and latency
+- Fake Gmail API: the subset of gmail/v1 used by gmail_helper
+- Fake n8n: a webhook receiver that counts deliveries
+
+Each service runs its own uvicorn server in a background thread so that
+the benchmarked export does not share an event loop with them.
+"""
+
+import asyncio
+import base64
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse
+
+CSV_HEADER = ["Date", "Libellé", "Catégorie", "Montant", "Notes", "N° de chèque", "Labels", "Nom du compte"]
+CATEGORIES = ["Alimentation", "Transport", "Logement", "Loisirs", "Santé", "Salaire", "Restaurants"]
+ACCOUNTS = ["Compte courant", "Livret A", "Carte Visa"]
+
+
+@dataclass
+class FakeServiceConfig:
+    """Knobs for the fake services"""
+    csv_rows: int = 1000
+    require_2fa: bool = True
+    page_latency_ms: int = 50
+    login_latency_ms: int = 200
+    csv_latency_ms: int = 300
+    gmail_latency_ms: int = 80
+    webhook_latency_ms: int = 50
+    # Real Linxo codes are single-use; enable to surface wrong-code races between concurrent exports
+    single_use_codes: bool = False
+    # Answer one Gmail call in N with 429 (0 = never), to exercise the quota backoff
+    gmail_rate_limit_every: int = 0
+
+
+@dataclass
+class FakeServiceState:
+    """State shared by the three fake services"""
+    config: FakeServiceConfig
+    issued_codes: set = field(default_factory=set)
+    inbox: List[Dict] = field(default_factory=list)
+    webhook_deliveries: int = 0
+    webhook_bytes: int = 0
+    gmail_calls: int = 0
+    csv_cache: Optional[bytes] = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def generate_csv(rows: int, seed: int = 42) -> bytes:
+    """Build a Linxo-like tab-separated UTF-16 LE CSV"""
+    rng = random.Random(seed)
+    lines = ["\t".join(CSV_HEADER)]
+    for i in range(rows):
+        day = 1 + (i % 28)
+        month = 1 + (i // 28) % 12
+        amount = rng.uniform(-250, 80) if rng.random() > 0.05 else rng.uniform(1500, 3000)
+        lines.append("\t".join([
+            f"{day:02d}/{month:02d}/2024",
+            f"CB MARCHAND {i:06d}",
+            rng.choice(CATEGORIES),
+            f"{amount:.2f}".replace(".", ","),
+            "",
+            "",
+            "",
+            rng.choice(ACCOUNTS),
+        ]))
+    return ("\ufeff" + "\r\n".join(lines) + "\r\n").encode("utf-16-le")
+
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Linxo - Connexion</title></head>
+<body>
+<form id="login" onsubmit="return false">
+  <input name="username" type="email" data-cy="email-input" placeholder="email">
+  <div id="password-step" style="display:none">
+    <input name="password" type="password" data-cy="password-input">
+  </div>
+  <div id="code-step" style="display:none">
+    <input type="text" maxlength="1"><input type="text" maxlength="1"><input type="text" maxlength="1">
+    <input type="text" maxlength="1"><input type="text" maxlength="1"><input type="text" maxlength="1">
+    <button type="button" id="validate">Valider</button>
+    <div id="code-error" style="display:none" class="error-message">Code invalide</div>
+  </div>
+  <button type="submit" data-cy="submit-button" id="submit">Continuer</button>
+</form>
+<script>
+let step = "email";
+document.getElementById("submit").addEventListener("click", async () => {
+  if (step === "email") {
+    step = "password";
+    document.getElementById("password-step").style.display = "block";
+    return;
+  }
+  if (step === "password") {
+    const response = await fetch("/api/login", {method: "POST"});
+    const result = await response.json();
+    if (result.require_2fa) {
+      step = "code";
+      document.getElementById("submit").style.display = "none";
+      document.getElementById("code-step").style.display = "block";
+    } else {
+      window.location.href = "/secured/overview.page";
+    }
+  }
+});
+document.getElementById("validate").addEventListener("click", async () => {
+  const code = Array.from(document.querySelectorAll('#code-step input')).map(i => i.value).join("");
+  const response = await fetch("/api/verify?code=" + encodeURIComponent(code), {method: "POST"});
+  if (response.ok) {
+    window.location.href = "/secured/overview.page";
+  } else {
+    document.getElementById("code-error").style.display = "block";
+  }
+});
+</script>
+</body></html>
+"""
+
+SECURED_PAGE = """<!DOCTYPE html>
+<html><head><title>Linxo - {title}</title></head>
+<body>
+<h1>{title}</h1>
+<button type="button" onclick="window.location.href='/secured/export.csv'">CSV</button>
+</body></html>
+"""
+
+
+def create_linxo_app(state: FakeServiceState) -> FastAPI:
+    """Fake Linxo web site"""
+    app = FastAPI()
+
+    async def page_latency():
+        await asyncio.sleep(state.config.page_latency_ms / 1000)
+
+    @app.get("/auth.page", response_class=HTMLResponse)
+    async def auth_page():
+        await page_latency()
+        return LOGIN_PAGE
+
+    @app.post("/api/login")
+    async def login():
+        await asyncio.sleep(state.config.login_latency_ms / 1000)
+        if not state.config.require_2fa:
+            return {"require_2fa": False}
+
+        code = f"{random.randint(0, 999999):06d}"
+        body = f"{code} est votre code de vérification Linxo."
+        with state.lock:
+            state.issued_codes.add(code)
+            state.inbox.insert(0, {
+                "id": f"msg{len(state.inbox):06d}",
+                "internalDate": str(int(time.time() * 1000)),
+                "subject": "Votre code de vérification",
+                "body": body,
+            })
+        return {"require_2fa": True}
+
+    @app.post("/api/verify")
+    async def verify(code: str):
+        await asyncio.sleep(state.config.login_latency_ms / 1000)
+        with state.lock:
+            if code not in state.issued_codes:
+                return JSONResponse(status_code=400, content={"error": "invalid code"})
+            if state.config.single_use_codes:
+                state.issued_codes.discard(code)
+        return {"ok": True}
+
+    @app.get("/secured/{name}.page", response_class=HTMLResponse)
+    async def secured_page(name: str):
+        await page_latency()
+        return SECURED_PAGE.format(title=name)
+
+    @app.get("/secured/export.csv")
+    async def export_csv():
+        await asyncio.sleep(state.config.csv_latency_ms / 1000)
+        if state.csv_cache is None:
+            state.csv_cache = generate_csv(state.config.csv_rows)
+        return Response(
+            content=state.csv_cache,
+            media_type="text/csv; charset=utf-16le",
+            headers={"Content-Disposition": 'attachment; filename="linxo_export.csv"'}
+        )
+
+    return app
+
+
+def create_gmail_app(state: FakeServiceState) -> FastAPI:
+    """Fake Gmail API (users.getProfile, users.messages.list/get)"""
+    app = FastAPI()
+
+    async def gmail_latency():
+        await asyncio.sleep(state.config.gmail_latency_ms / 1000)
+
+    @app.middleware("http")
+    async def rate_limit(request: Request, call_next):
+        every = state.config.gmail_rate_limit_every
+        with state.lock:
+            state.gmail_calls += 1
+            limited = every and state.gmail_calls % every == 0
+        if limited:
+            return JSONResponse(status_code=429, headers={"Retry-After": "1"}, content={"error": {
+                "code": 429, "message": "User-rate limit exceeded",
+                "errors": [{"reason": "userRateLimitExceeded", "domain": "usageLimits"}]}})
+        return await call_next(request)
+
+    @app.get("/gmail/v1/users/{user_id}/profile")
+    async def get_profile(user_id: str):
+        await gmail_latency()
+        return {"emailAddress": "benchmark@example.com", "messagesTotal": len(state.inbox)}
+
+    @app.get("/gmail/v1/users/{user_id}/messages")
+    async def list_messages(user_id: str, maxResults: int = 10):
+        await gmail_latency()
+        with state.lock:
+            messages = [{"id": m["id"], "threadId": m["id"]} for m in state.inbox[:maxResults]]
+        return {"messages": messages, "resultSizeEstimate": len(messages)} if messages else {"resultSizeEstimate": 0}
+
+    @app.get("/gmail/v1/users/{user_id}/messages/{message_id}")
+    async def get_message(user_id: str, message_id: str):
+        await gmail_latency()
+        with state.lock:
+            message = next((m for m in state.inbox if m["id"] == message_id), None)
+        if message is None:
+            return JSONResponse(status_code=404, content={"error": {"code": 404, "message": "Not Found"}})
+        return {
+            "id": message["id"],
+            "threadId": message["id"],
+            "internalDate": message["internalDate"],
+            "payload": {
+                "mimeType": "text/plain",
+                "headers": [
+                    {"name": "From", "value": "Linxo <no-reply@linxo.com>"},
+                    {"name": "Subject", "value": message["subject"]},
+                    {"name": "Date", "value": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())},
+                ],
+                "body": {"data": base64.urlsafe_b64encode(message["body"].encode("utf-8")).decode("ascii")},
+            },
+        }
+
+    return app
+
+
+def create_n8n_app(state: FakeServiceState) -> FastAPI:
+    """Fake n8n webhook receiver"""
+    app = FastAPI()
+
+    @app.post("/webhook/benchmark")
+    async def receive(request: Request):
+        body = await request.body()
+        await asyncio.sleep(state.config.webhook_latency_ms / 1000)
+        with state.lock:
+            state.webhook_deliveries += 1
+            state.webhook_bytes += len(body)
+        return {"received": len(body)}
+
+    return app
+
+
+class _ServerThread(threading.Thread):
+    """Run a uvicorn server in a daemon thread"""
+
+    def __init__(self, app: FastAPI, host: str, port: int):
+        super().__init__(daemon=True)
+        # Keep-alive longer than the 5 s Gmail poll interval, like Google's servers;
+        # uvicorn's 5 s default races the client's connection reuse
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning",
+                                                   timeout_keep_alive=75))
+
+    def run(self):
+        self.server.run()
+
+    def wait_started(self, timeout: float = 10.0):
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Fake service did not start in time")
+            time.sleep(0.02)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.join(timeout=5)
+
+
+class FakeServices:
+    """
+    Start the fake Linxo, Gmail and n8n services on local ports.
+
+    Usage:
+        with FakeServices(FakeServiceConfig(csv_rows=5000)) as fakes:
+            os.environ.update(fakes.environment())
+    """
+
+    def __init__(self, config: Optional[FakeServiceConfig] = None, host: str = "127.0.0.1", base_port: int = 18080):
+        self.state = FakeServiceState(config=config or FakeServiceConfig())
+        self.host = host
+        self.ports = {"linxo": base_port, "gmail": base_port + 1, "n8n": base_port + 2}
+        self._threads = [
+            _ServerThread(create_linxo_app(self.state), host, self.ports["linxo"]),
+            _ServerThread(create_gmail_app(self.state), host, self.ports["gmail"]),
+            _ServerThread(create_n8n_app(self.state), host, self.ports["n8n"]),
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        for thread in self._threads:
+            thread.wait_started()
+        return self
+
+    def stop(self):
+        for thread in self._threads:
+            thread.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def url(self, service: str) -> str:
+        return f"http://{self.host}:{self.ports[service]}"
+
+    def environment(self) -> Dict[str, str]:
+        """Environment variables that point the exporter at the fakes"""
+        fake_token = (
+            '{"token": "fake-access-token", "refresh_token": "fake-refresh-token", '
+            '"token_uri": "https://oauth2.googleapis.com/token", "client_id": "fake", '
+            '"client_secret": "fake", "scopes": ["https://www.googleapis.com/auth/gmail.readonly"], '
+            '"expiry": "2099-01-01T00:00:00Z"}'
+        )
+        return {
+            "LINXO_BASE_URL": self.url("linxo"),
+            "LINXO_EMAIL": "benchmark@example.com",
+            "LINXO_PASSWORD": "benchmark",
+            "GMAIL_API_ENDPOINT": self.url("gmail") + "/",
+            "GMAIL_TOKEN_JSON": fake_token,
+            "N8N_WEBHOOK_URL": self.url("n8n") + "/webhook/benchmark",
+        }
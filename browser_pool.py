@@ -0,0 +1,269 @@
+"""
+Shared Playwright browser
+
+Launching Chromium is the slowest part of a cold export, so a single browser
+is started once (pre-warmed at startup) and every export gets its own
+isolated context on it. The browser is relaunched transparently if it
+disconnects, and can be killed outright (see browser_supervisor) when it
+hangs.
+
+The engine and launch profile are configurable (BrowserProfile.from_env):
+
+    BROWSER_ENGINE            chromium (default), firefox or webkit
+    BROWSER_HEADLESS          shell (default): Chromium's lightweight headless
+                              shell; new: the full browser's headless mode;
+                              off: a visible window, for debugging
+    BROWSER_LAUNCH_PROFILE    desktop (default): 1920x1080 window and a fixed
+                              desktop user agent; minimal: trimmed Chromium
+                              flags, 1280x800 viewport and the engine's own
+                              user agent (without the "Headless" marker)
+    BROWSER_RENDERER_PROCESS_LIMIT   share renderer processes between
+                              contexts (Chromium, 0 = no limit)
+    BROWSER_JS_HEAP_MB        cap V8's old-generation heap per renderer
+                              (Chromium, 0 = default)
+    BROWSER_EXTRA_ARGS        extra launch flags, space separated
+
+benchmarks/browser_benchmark.py compares profiles on the export workload.
+"""
+
+import asyncio
+import logging
+import os
+import shlex
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from process_utils import child_pids, descendant_pids, kill_process_tree
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("chromium", "firefox", "webkit")
+HEADLESS_MODES = ("shell", "new", "off")
+LAUNCH_PROFILES = ("desktop", "minimal")
+
+LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-infobars',
+    '--window-size=1920,1080'
+]
+
+# Chromium features a form login and one download do not need
+MINIMAL_LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-dev-shm-usage',
+    '--disable-extensions',
+    '--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication',
+    '--disable-sync',
+    '--metrics-recording-only',
+    '--mute-audio',
+    '--no-first-run',
+]
+
+CONTEXT_OPTIONS = {
+    'viewport': {'width': 1920, 'height': 1080},
+    'user_agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.81 Safari/537.36',
+    'java_script_enabled': True,
+}
+
+MINIMAL_CONTEXT_OPTIONS = {
+    'viewport': {'width': 1280, 'height': 800},
+    'java_script_enabled': True,
+}
+
+
+@dataclass(frozen=True)
+class BrowserProfile:
+    """Which browser to launch and how"""
+    engine: str = "chromium"
+    headless: str = "shell"
+    launch: str = "desktop"
+    renderer_process_limit: int = 0
+    js_heap_mb: int = 0
+    extra_args: Tuple[str, ...] = field(default=())
+
+    def __post_init__(self):
+        for name, value, allowed in (("BROWSER_ENGINE", self.engine, ENGINES),
+                                     ("BROWSER_HEADLESS", self.headless, HEADLESS_MODES),
+                                     ("BROWSER_LAUNCH_PROFILE", self.launch, LAUNCH_PROFILES)):
+            if value not in allowed:
+                raise ValueError(f"{name} must be one of {', '.join(allowed)}, got '{value}'")
+
+    @classmethod
+    def from_env(cls) -> "BrowserProfile":
+        return cls(
+            engine=os.getenv("BROWSER_ENGINE", "chromium").lower(),
+            headless=os.getenv("BROWSER_HEADLESS", "shell").lower(),
+            launch=os.getenv("BROWSER_LAUNCH_PROFILE", "desktop").lower(),
+            renderer_process_limit=int(os.getenv("BROWSER_RENDERER_PROCESS_LIMIT", 0)),
+            js_heap_mb=int(os.getenv("BROWSER_JS_HEAP_MB", 0)),
+            extra_args=tuple(shlex.split(os.getenv("BROWSER_EXTRA_ARGS", ""))),
+        )
+
+    @property
+    def name(self) -> str:
+        return f"{self.engine}/{self.headless}/{self.launch}"
+
+    def launch_options(self) -> Dict:
+        """Keyword arguments of browser_type.launch()"""
+        args = []
+        if self.engine == "chromium":
+            args.extend(MINIMAL_LAUNCH_ARGS if self.launch == "minimal" else LAUNCH_ARGS)
+            if self.headless == "new":
+                # Playwright starts Chromium with --headless=old (the headless shell); the last flag wins
+                args.append('--headless=new')
+            if self.renderer_process_limit:
+                args.append(f'--renderer-process-limit={self.renderer_process_limit}')
+            if self.js_heap_mb:
+                args.append(f'--js-flags=--max-old-space-size={self.js_heap_mb}')
+        args.extend(self.extra_args)
+        return {"headless": self.headless != "off", "args": args}
+
+    def context_options(self, browser_version: Optional[str] = None) -> Dict:
+        """Default options of every context"""
+        if self.launch == "minimal":
+            options = dict(MINIMAL_CONTEXT_OPTIONS)
+            if self.engine == "chromium" and browser_version:
+                # Headless Chromium announces itself as "HeadlessChrome"; keep its real version otherwise
+                options['user_agent'] = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                                         f'Chrome/{browser_version} Safari/537.36')
+            return options
+        if self.engine != "chromium":
+            # A Chrome user agent on another engine is easier to spot than the engine's own
+            return {k: v for k, v in CONTEXT_OPTIONS.items() if k != 'user_agent'}
+        return dict(CONTEXT_OPTIONS)
+
+
+class BrowserPool:
+    """One long-lived browser handing out fresh contexts"""
+
+    def __init__(self, profile: Optional[BrowserProfile] = None):
+        self.profile = profile or BrowserProfile()
+        self._playwright = None
+        self._browser = None
+        self._lock = asyncio.Lock()
+        self.launch_count = 0
+        self.restart_count = 0
+        self.kill_count = 0
+        self.contexts_created = 0
+        self.contexts_since_launch = 0
+        self.last_launch_seconds: Optional[float] = None
+        self.browser_version: Optional[str] = None
+        self._context_options: Dict = {}
+        # Playwright driver subprocess(es); Chromium runs underneath them
+        self.driver_pids: List[int] = []
+
+    @property
+    def is_running(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    @property
+    def crashed(self) -> bool:
+        """A browser was launched but has disconnected without stop()"""
+        return self._browser is not None and not self._browser.is_connected()
+
+    async def start(self):
+        """Start Playwright and launch the browser if it is not running"""
+        async with self._lock:
+            if self.is_running:
+                return
+            if self.launch_count:
+                # The browser crashed, was killed or was recycled
+                self.restart_count += 1
+            # Imported lazily: Playwright is heavy and only needed once a browser is launched
+            from playwright.async_api import async_playwright
+
+            start_time = time.perf_counter()
+            with span("playwright.launch", browser=self.profile.engine, profile=self.profile.name):
+                if self._playwright is None:
+                    logger.info("Initializing Playwright...")
+                    children_before = set(child_pids(os.getpid()))
+                    self._playwright = await async_playwright().start()
+                    self.driver_pids = [pid for pid in child_pids(os.getpid()) if pid not in children_before]
+                logger.info(f"Launching browser ({self.profile.name})...")
+                # Set BROWSER_HEADLESS=off to see the browser (for debugging)
+                browser_type = getattr(self._playwright, self.profile.engine)
+                self._browser = await browser_type.launch(**self.profile.launch_options())
+            self.browser_version = self._browser.version
+            self._context_options = self.profile.context_options(self.browser_version)
+            self.launch_count += 1
+            self.contexts_since_launch = 0
+            self.last_launch_seconds = time.perf_counter() - start_time
+            logger.info(f"Browser {self.profile.engine} {self.browser_version} launched in {self.last_launch_seconds:.2f}s")
+
+    async def new_page(self, **context_options):
+        """Create an isolated context and page on the shared browser"""
+        await self.start()
+        with span("playwright.new_context"):
+            logger.info("Creating new context...")
+            context = await self._browser.new_context(**{**self._context_options, **context_options})
+            self.contexts_created += 1
+            self.contexts_since_launch += 1
+            logger.info("Creating new page...")
+            page = await context.new_page()
+        return context, page
+
+    async def warm_up(self):
+        """Launch the browser and open/close one context so the first export starts hot"""
+        context, _ = await self.new_page()
+        await context.close()
+
+    async def stop(self):
+        """Close the browser and stop Playwright"""
+        async with self._lock:
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    logger.error(f"Error closing browser: {str(e)}")
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+            self.driver_pids = []
+
+    def browser_pids(self) -> List[int]:
+        """Live Playwright driver and browser process ids"""
+        pids = []
+        for driver_pid in self.driver_pids:
+            pids.append(driver_pid)
+            pids.extend(descendant_pids(driver_pid))
+        return pids
+
+    def kill(self):
+        """
+        SIGKILL the Playwright driver and every Chromium process under it.
+
+        Used when the browser no longer answers, so nothing is awaited on
+        it; the next start() launches a fresh driver and browser.
+        """
+        # No lock: a hung launch holds it
+        killed = []
+        for driver_pid in self.driver_pids:
+            killed.extend(kill_process_tree(driver_pid))
+        logger.warning(f"Killed browser process tree: {killed}")
+        self.kill_count += 1
+        self._browser = None
+        self._playwright = None
+        self.driver_pids = []
+
+    def stats(self):
+        return {
+            "profile": self.profile.name,
+            "version": self.browser_version,
+            "running": self.is_running,
+            "launch_count": self.launch_count,
+            "restart_count": self.restart_count,
+            "kill_count": self.kill_count,
+            "contexts_created": self.contexts_created,
+            "contexts_since_launch": self.contexts_since_launch,
+            "last_launch_seconds": self.last_launch_seconds,
+            "pids": self.browser_pids(),
+        }
+
+
+browser_pool = BrowserPool(BrowserProfile.from_env())
@@ -0,0 +1,215 @@
+"""
+Browser supervisor
+
+Wraps the shared browser (browser_pool) so a hung or crashed Chromium cannot
+leak processes or block an export forever:
+
+- every export runs in a BrowserSession with a hard deadline
+  (EXPORT_DEADLINE_SECONDS); when it passes, the session's context is
+  closed, which makes pending Playwright calls fail immediately
+- closing a context is bounded (BROWSER_CLOSE_TIMEOUT_SECONDS); if Chromium
+  does not answer, the whole driver/Chromium process tree is SIGKILLed and
+  relaunched on next use
+- a watchdog (BROWSER_WATCHDOG_INTERVAL_SECONDS) reaps zombie children,
+  relaunches a crashed browser, and recycles the browser when idle after
+  BROWSER_RECYCLE_AFTER_CONTEXTS contexts or above BROWSER_MAX_RSS_MB, so
+  memory stays bounded over long uptimes
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from browser_pool import BrowserPool, browser_pool
+from process_utils import child_pids, process_tree_rss_bytes, read_rss_bytes, reap_zombie_children
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserSession:
+    """One export's context and page, with its deadline"""
+
+    def __init__(self, session_id: int, context, page, deadline_seconds: float):
+        self.session_id = session_id
+        self.context = context
+        self.page = page
+        self.started_at = time.monotonic()
+        self.deadline_at = self.started_at + deadline_seconds
+        self.expired = False
+        self.closed = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def describe(self):
+        now = time.monotonic()
+        return {
+            "id": self.session_id,
+            "age_seconds": round(now - self.started_at, 1),
+            "deadline_in_seconds": round(self.deadline_at - now, 1),
+            "expired": self.expired,
+        }
+
+
+class BrowserSupervisor:
+    """Hands out deadline-bound browser sessions and keeps the browser healthy"""
+
+    def __init__(self, pool: BrowserPool, export_deadline: float = 300, close_timeout: float = 10,
+                 launch_timeout: float = 60, watchdog_interval: float = 15,
+                 recycle_after_contexts: int = 100, max_browser_rss_mb: int = 0):
+        self.pool = pool
+        self.export_deadline = export_deadline
+        self.close_timeout = close_timeout
+        self.launch_timeout = launch_timeout
+        self.watchdog_interval = watchdog_interval
+        self.recycle_after_contexts = recycle_after_contexts
+        self.max_browser_rss_mb = max_browser_rss_mb
+        self.sessions: Dict[int, BrowserSession] = {}
+        self._ids = itertools.count(1)
+        self._watchdog: Optional[asyncio.Task] = None
+        self._keep_warm = False
+        self._opening = 0
+        self.deadline_exceeded = 0
+        self.forced_kills = 0
+        self.crashes = 0
+        self.recycles = 0
+        self.zombies_reaped = 0
+
+    @classmethod
+    def from_env(cls, pool: BrowserPool) -> "BrowserSupervisor":
+        return cls(
+            pool,
+            export_deadline=float(os.getenv("EXPORT_DEADLINE_SECONDS", 300)),
+            close_timeout=float(os.getenv("BROWSER_CLOSE_TIMEOUT_SECONDS", 10)),
+            launch_timeout=float(os.getenv("BROWSER_LAUNCH_TIMEOUT_SECONDS", 60)),
+            watchdog_interval=float(os.getenv("BROWSER_WATCHDOG_INTERVAL_SECONDS", 15)),
+            recycle_after_contexts=int(os.getenv("BROWSER_RECYCLE_AFTER_CONTEXTS", 100)),
+            max_browser_rss_mb=int(os.getenv("BROWSER_MAX_RSS_MB", 0)),
+        )
+
+    async def open(self, deadline: Optional[float] = None, context_options: Optional[Dict] = None) -> BrowserSession:
+        """Create a context and page that are force-closed after `deadline` seconds"""
+        self._opening += 1
+        try:
+            context, page = await asyncio.wait_for(self.pool.new_page(**(context_options or {})),
+                                                   timeout=self.launch_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Browser did not start a context within {self.launch_timeout:g}s, killing it")
+            self._force_kill()
+            raise
+        finally:
+            self._opening -= 1
+        session = BrowserSession(next(self._ids), context, page, deadline or self.export_deadline)
+        self.sessions[session.session_id] = session
+        session._timer = asyncio.get_running_loop().call_later(
+            session.deadline_at - time.monotonic(),
+            lambda: asyncio.ensure_future(self._expire(session))
+        )
+        return session
+
+    async def close(self, session: Optional[BrowserSession]):
+        """Close a session's context; safe to call more than once"""
+        if session is None or session.closed:
+            return
+        session.closed = True
+        if session._timer is not None:
+            session._timer.cancel()
+        self.sessions.pop(session.session_id, None)
+        try:
+            await asyncio.wait_for(session.context.close(), timeout=self.close_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Closing browser context {session.session_id} timed out, killing the browser")
+            self._force_kill()
+        except Exception as e:
+            # Already closed, or the browser is gone
+            logger.debug(f"Closing browser context {session.session_id}: {str(e)}")
+
+    async def _expire(self, session: BrowserSession):
+        if session.closed:
+            return
+        session.expired = True
+        self.deadline_exceeded += 1
+        logger.error(f"Export session {session.session_id} exceeded its deadline, closing its browser context")
+        with span("browser.deadline_exceeded", session_id=session.session_id):
+            await self.close(session)
+
+    def _force_kill(self):
+        self.forced_kills += 1
+        self.pool.kill()
+        # Sessions on the killed browser are gone with it
+        for session in list(self.sessions.values()):
+            session.closed = True
+            if session._timer is not None:
+                session._timer.cancel()
+        self.sessions.clear()
+
+    async def check(self):
+        """One watchdog pass: reap zombies, relaunch after a crash, recycle when idle"""
+        reaped = reap_zombie_children(exclude=self.pool.driver_pids)
+        if reaped:
+            self.zombies_reaped += len(reaped)
+            logger.info(f"Reaped zombie processes: {reaped}")
+
+        if self.pool.crashed:
+            self.crashes += 1
+            logger.error("Browser disconnected unexpectedly, killing what is left of it")
+            self._force_kill()
+
+        if self.sessions or self._opening:
+            return
+
+        browser_rss_mb = sum(read_rss_bytes(pid) for pid in self.pool.browser_pids()) / (1024 * 1024)
+        too_many_contexts = self.recycle_after_contexts and self.pool.contexts_since_launch >= self.recycle_after_contexts
+        too_much_memory = self.max_browser_rss_mb and browser_rss_mb > self.max_browser_rss_mb
+        if self.pool.is_running and (too_many_contexts or too_much_memory):
+            logger.info(f"Recycling idle browser ({self.pool.contexts_since_launch} contexts, {browser_rss_mb:.0f} MB)")
+            self.recycles += 1
+            await self.pool.stop()
+
+        if self._keep_warm and not self.pool.is_running:
+            await asyncio.wait_for(self.pool.start(), timeout=self.launch_timeout)
+
+    async def _run_watchdog(self):
+        while True:
+            await asyncio.sleep(self.watchdog_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Browser watchdog error: {str(e)}", exc_info=True)
+
+    def start_watchdog(self, keep_warm: bool = False):
+        """Start the periodic watchdog (keep_warm relaunches the browser when it is down)"""
+        self._keep_warm = keep_warm
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._run_watchdog())
+
+    async def stop(self):
+        """Stop the watchdog and close open sessions"""
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            try:
+                await self._watchdog
+            except asyncio.CancelledError:
+                pass
+            self._watchdog = None
+        for session in list(self.sessions.values()):
+            await self.close(session)
+
+    def stats(self):
+        return {
+            "browser": self.pool.stats(),
+            "active_sessions": [session.describe() for session in self.sessions.values()],
+            "deadline_exceeded": self.deadline_exceeded,
+            "forced_kills": self.forced_kills,
+            "crashes": self.crashes,
+            "recycles": self.recycles,
+            "zombies_reaped": self.zombies_reaped,
+            "child_pids": child_pids(os.getpid()),
+            "process_tree_rss_mb": round(process_tree_rss_bytes() / (1024 * 1024), 1),
+            "export_deadline_seconds": self.export_deadline,
+        }
+
+
+browser_supervisor = BrowserSupervisor.from_env(browser_pool)
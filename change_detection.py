@@ -0,0 +1,117 @@
+"""
+Content-hash change detection for exports
+
+Most scheduled exports return exactly the transactions of the previous run.
+A stable hash is computed over the normalized transactions (header names
+without BOM, trimmed values, order-independent), overall and per account,
+and compared with the hashes recorded after the last successful delivery.
+When nothing changed the webhook send and the local file write are skipped.
+
+Hashes are kept per filter scope (a January-only export is not compared with
+a full export) in the shared state backend, so every worker sees them.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from state_backend import StateBackend
+from transactions import parse_csv, resolve_columns
+
+logger = logging.getLogger(__name__)
+
+ALL_ACCOUNTS = "*"
+
+
+@dataclass(frozen=True)
+class ContentHashes:
+    overall: str
+    accounts: Dict[str, str] = field(default_factory=dict)
+    row_count: int = 0
+
+
+def _normalized_lines(header: List[str], rows: List[Dict[str, str]]) -> List[str]:
+    names = [name.lstrip("\ufeff").strip() for name in header]
+    return sorted(
+        json.dumps([[clean, (row.get(name) or "").strip()] for clean, name in zip(names, header)],
+                   ensure_ascii=False, separators=(",", ":"))
+        for row in rows
+    )
+
+
+def _digest(lines: List[str]) -> str:
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def content_hashes(csv_text: str) -> ContentHashes:
+    """Hash decoded CSV text, overall and per account (by the account name column)"""
+    header, rows, _ = parse_csv(csv_text)
+    account_column = resolve_columns(header)["account"] if header else None
+
+    by_account: Dict[str, List[Dict[str, str]]] = {}
+    for row in rows:
+        account = (row.get(account_column) or "").strip() if account_column else ALL_ACCOUNTS
+        by_account.setdefault(account, []).append(row)
+
+    return ContentHashes(
+        overall=_digest(_normalized_lines(header, rows)),
+        accounts={account: _digest(_normalized_lines(header, account_rows))
+                  for account, account_rows in by_account.items()},
+        row_count=len(rows),
+    )
+
+
+class DeliveryState:
+    """Last delivered content hashes, kept in the shared state backend"""
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(scope: str) -> str:
+        return f"delivery:{scope}"
+
+    async def last(self, scope: str) -> Optional[dict]:
+        return await self.backend.get_json(self._key(scope))
+
+    async def changed_accounts(self, scope: str, hashes: ContentHashes) -> Optional[List[str]]:
+        """Accounts whose hash differs from the last delivery (None if never delivered)"""
+        previous = await self.last(scope)
+        if previous is None:
+            return None
+        previous_accounts = previous.get("accounts", {})
+        accounts = set(previous_accounts) | set(hashes.accounts)
+        return sorted(a for a in accounts if previous_accounts.get(a) != hashes.accounts.get(a))
+
+    async def is_changed(self, scope: str, hashes: ContentHashes) -> bool:
+        previous = await self.last(scope)
+        return previous is None or previous.get("hash") != hashes.overall
+
+    async def record(self, scope: str, hashes: ContentHashes, produced_at: Optional[float] = None) -> bool:
+        """
+        Remember a successful delivery, unless a newer export was already recorded
+
+        Call under the scope's delivery lock. produced_at is when the delivered
+        CSV was scraped (default: now); a retried older CSV does not overwrite
+        the hash of a newer one. Returns whether the delivery was recorded.
+        """
+        produced_at = produced_at or time.time()
+        previous = await self.last(scope)
+        if previous is not None and previous.get("produced_at", 0) > produced_at:
+            logger.info(f"Not recording delivery of '{scope}': a newer export was already delivered")
+            return False
+        await self.backend.set_json(self._key(scope), {
+            "hash": hashes.overall,
+            "accounts": hashes.accounts,
+            "rows": hashes.row_count,
+            "produced_at": produced_at,
+            "delivered_at": time.time(),
+        })
+        return True
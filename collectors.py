@@ -0,0 +1,108 @@
+"""
+Secured Linxo pages collected alongside the transaction CSV
+
+After one login, GET /collect opens these pages in their own tabs of the same
+browser context, concurrently with the CSV download, so a complete snapshot
+(transactions, accounts and balances, budgets) costs one login and about the
+time of the slowest page.
+
+Each section is a table page scraped like the history pages
+(history_extractor.EXTRACT_ROWS_JS: {column header: cell text}). Paths and
+row selectors can be overridden if the Linxo markup changes:
+
+    accounts   LINXO_ACCOUNTS_PATH (secured/accounts.page),
+               LINXO_ACCOUNTS_ROW_SELECTOR
+    budget     LINXO_BUDGET_PATH (secured/budget.page),
+               LINXO_BUDGET_ROW_SELECTOR
+
+Amount columns (balance, budgeted, spent, ...) are parsed into numbers next
+to the text Linxo shows.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from history_extractor import DEFAULT_ROW_SELECTOR, EXTRACT_ROWS_JS
+from tracing import span
+from transactions import parse_amount
+
+logger = logging.getLogger(__name__)
+
+# "transactions" is the CSV download on the history page
+SECTIONS = ("transactions", "accounts", "budget")
+
+# Column headers holding amounts, and the key of their parsed value
+AMOUNT_COLUMNS = {
+    "balance": re.compile(r"^(solde|balance)", re.IGNORECASE),
+    "budgeted": re.compile(r"^(budget|prévu|prevu|planned)", re.IGNORECASE),
+    "spent": re.compile(r"^(dépensé|depense|spent|réalisé|realise)", re.IGNORECASE),
+    "remaining": re.compile(r"^(reste|restant|remaining|left)", re.IGNORECASE),
+}
+
+
+@dataclass(frozen=True)
+class PageSection:
+    name: str
+    path: str
+    row_selector: str
+
+    @classmethod
+    def from_env(cls, name: str, default_path: str) -> "PageSection":
+        prefix = f"LINXO_{name.upper()}"
+        return cls(
+            name,
+            os.getenv(f"{prefix}_PATH", default_path).lstrip("/"),
+            os.getenv(f"{prefix}_ROW_SELECTOR", DEFAULT_ROW_SELECTOR),
+        )
+
+
+PAGE_SECTIONS = {
+    "accounts": PageSection.from_env("accounts", "secured/accounts.page"),
+    "budget": PageSection.from_env("budget", "secured/budget.page"),
+}
+
+
+def parse_sections(value: str) -> Tuple[str, ...]:
+    """Comma-separated section names, in SECTIONS order; raises ValueError on unknown names"""
+    names = {name.strip().lower() for name in value.split(",") if name.strip()}
+    unknown = names - set(SECTIONS)
+    if unknown:
+        raise ValueError(f"Unknown section(s): {', '.join(sorted(unknown))} (expected {', '.join(SECTIONS)})")
+    return tuple(name for name in SECTIONS if name in names)
+
+
+def with_amounts(record: Dict[str, str]) -> Dict:
+    """Add parsed amounts (balance, budgeted, ...) next to the scraped text"""
+    result = dict(record)
+    for key, pattern in AMOUNT_COLUMNS.items():
+        column = next((name for name in record if pattern.match(name)), None)
+        if column is not None and key not in record:
+            amount = parse_amount(record[column])
+            result[key] = float(amount) if amount is not None else None
+    return result
+
+
+async def scrape_section(context, base_url: str, section: PageSection, artifacts) -> List[Dict]:
+    """Open a section's page in a new tab and return its rows"""
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    with span("linxo.collect_page", section=section.name) as page_span:
+        # The tab stays open until the context is closed, after pending artifact captures
+        page = await context.new_page()
+        await page.goto(f"{base_url}/{section.path}", timeout=30000)
+        await page.wait_for_load_state("networkidle", timeout=10000)
+        artifacts.capture(page, f"{section.name}_page")
+        try:
+            await page.wait_for_selector(section.row_selector, timeout=5000)
+        except PlaywrightTimeoutError:
+            logger.warning(f"No rows matching '{section.row_selector}' on the {section.name} page")
+            artifacts.capture(page, f"{section.name}_rows_not_found", error=True)
+            page_span.set_attribute("rows", 0)
+            return []
+        rows = await page.eval_on_selector_all(section.row_selector, EXTRACT_ROWS_JS)
+        page_span.set_attribute("rows", len(rows))
+        logger.info(f"Collected {len(rows)} {section.name} rows")
+        return [with_amounts(row) for row in rows]
@@ -0,0 +1,231 @@
+"""
+Batch export from the command line, without the web server
+
+    python -m export_cli --from 2024-01-01 --to 2024-01-31 --format csv --output january.csv
+    python -m export_cli --account "Compte courant" --account "Livret A" --format ndjson
+
+Runs the same engine as /export-csv (same .env configuration, no API key)
+and writes the transactions to a file or stdout. Logs go to stderr. A run
+logs in to Linxo once: with several --account options the transactions of
+all accounts are downloaded by one scrape, and each account is filtered
+out of it locally, in the order given.
+
+The scrape holds the Linxo account's single-flight lock in the shared state
+backend (STATE_BACKEND), so it never logs in alongside the server; it waits
+up to EXPORT_LOCK_WAIT_SECONDS for a running export, then exits with 6.
+
+Exit codes:
+    0  success
+    1  unexpected failure
+    2  invalid arguments
+    3  configuration problem (missing Linxo credentials)
+    4  Linxo login or 2FA verification failed
+    5  timed out (page, 2FA email or export deadline)
+    6  a required service is unavailable (Gmail, rate limits, Linxo page changes)
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+from dataclasses import replace
+from datetime import date
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CONFIG = 3
+EXIT_AUTH = 4
+EXIT_TIMEOUT = 5
+EXIT_UNAVAILABLE = 6
+
+logger = logging.getLogger("export_cli")
+
+
+class ExportFailed(Exception):
+    def __init__(self, exit_code: int, message: str):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+def exit_code_for_status(status_code: int) -> int:
+    """Map the engine's HTTP status codes to exit codes"""
+    if status_code in (401, 403):
+        return EXIT_AUTH
+    if status_code == 504:
+        return EXIT_TIMEOUT
+    if status_code in (429, 503):
+        return EXIT_UNAVAILABLE
+    return EXIT_FAILED
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m export_cli", description="Export Linxo transactions without the web server",
+                                     epilog="Exit codes: 0 ok, 1 failed, 2 usage, 3 configuration, 4 login/2FA, 5 timeout, 6 service unavailable")
+    parser.add_argument("--account", action="append", dest="accounts", metavar="ACCOUNT",
+                        help="Account id or name (repeat for several accounts; default: all accounts)")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="First transaction date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="Last transaction date (YYYY-MM-DD)")
+    parser.add_argument("--category", help="Category name")
+    parser.add_argument("--exclude-duplicates", action="store_true", help="Drop transactions Linxo flags as duplicates")
+    parser.add_argument("--format", choices=["csv", "ndjson", "parquet"], default="csv")
+    parser.add_argument("--compress", choices=["identity", "gzip", "zstd"], default="identity")
+    parser.add_argument("-o", "--output", default="-", help="Output file, or - for stdout (default)")
+    parser.add_argument("--webhook", action="store_true", help="Also send the CSV to N8N_WEBHOOK_URL")
+    parser.add_argument("--debug-artifacts", choices=["off", "errors", "all"], help="Debug artifact level (default: DEBUG_ARTIFACTS)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log progress (INFO) to stderr")
+    args = parser.parse_args(argv)
+    if args.date_from and args.date_to and args.date_from > args.date_to:
+        parser.error("--from must be on or before --to")
+    return args
+
+
+async def scrape(settings, filters, gmail_available: bool, debug_artifacts: Optional[str]) -> bytes:
+    """Log in and download the CSV once; returns the raw CSV bytes"""
+    from fastapi import HTTPException
+    from fastapi.responses import JSONResponse
+
+    from artifacts import artifact_store
+    from export_engine import scrape_linxo_csv
+
+    artifacts = artifact_store.new_job(debug_artifacts)
+    try:
+        result = await scrape_linxo_csv(settings, filters, gmail_available, artifacts)
+    except HTTPException as e:
+        raise ExportFailed(exit_code_for_status(e.status_code), str(e.detail)) from e
+    if isinstance(result, JSONResponse):
+        content = json.loads(result.body)
+        raise ExportFailed(exit_code_for_status(result.status_code), content.get("error") or content.get("message"))
+    logger.info(f"Downloaded {len(result)} bytes (job {artifacts.job_id})")
+    return result
+
+
+def filter_export(csv_content: bytes, filters) -> str:
+    """Apply one filter set locally; returns the filtered CSV as text"""
+    from fastapi import HTTPException
+
+    from export_engine import apply_filters
+    from transactions import decode_csv
+
+    try:
+        csv_content, filter_report = apply_filters(csv_content, filters)
+    except HTTPException as e:
+        raise ExportFailed(exit_code_for_status(e.status_code), str(e.detail)) from e
+    csv_text, _ = decode_csv(csv_content)
+    logger.info(f"Exported {filters.account_id or 'all accounts'}: {filter_report}")
+    return csv_text
+
+
+def combine(csv_texts: List[str]) -> str:
+    """Concatenate the rows of several filtered exports with the same columns"""
+    from transactions import parse_csv, serialize_csv
+
+    if len(csv_texts) == 1:
+        return csv_texts[0]
+    header, rows, delimiter = parse_csv(csv_texts[0])
+    for text in csv_texts[1:]:
+        other_header, other_rows, _ = parse_csv(text)
+        if other_header != header:
+            raise ExportFailed(EXIT_FAILED, "Exports of different accounts have different columns")
+        rows.extend(other_rows)
+    return serialize_csv(header, rows, delimiter)
+
+
+def write_output(chunks, output: str):
+    """Write to stdout, or atomically to a file"""
+    if output == "-":
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+        return
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".export-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+async def run(args) -> int:
+    from browser_pool import browser_pool
+    from browser_supervisor import browser_supervisor
+    from export_engine import check_gmail_available, linxo_scrape_lock, send_csv_to_webhook
+    from export_filters import ExportFilters
+    from export_formats import ExportFormat
+    from settings import get_settings
+    from state_backend import LockNotAcquired, close_state_backend
+
+    settings = get_settings()
+    if not settings.has_linxo_credentials:
+        logger.error("Missing Linxo credentials (LINXO_EMAIL / LINXO_PASSWORD)")
+        return EXIT_CONFIG
+    if args.webhook and not settings.n8n_webhook_url:
+        logger.error("--webhook needs N8N_WEBHOOK_URL")
+        return EXIT_CONFIG
+
+    try:
+        gmail_available = await check_gmail_available()
+        filter_sets = [ExportFilters(args.date_from, args.date_to, account, args.category, args.exclude_duplicates)
+                       for account in (args.accounts or [None])]
+        # A single account can be narrowed down by Linxo; several are all downloaded at once
+        scrape_filters = filter_sets[0] if len(filter_sets) == 1 else replace(filter_sets[0], account_id=None)
+        try:
+            async with linxo_scrape_lock(settings.linxo_email):
+                csv_content = await scrape(settings, scrape_filters, gmail_available, args.debug_artifacts)
+        except LockNotAcquired:
+            raise ExportFailed(EXIT_UNAVAILABLE, "Another export of this Linxo account is still running")
+        csv_text = combine([filter_export(csv_content, filters) for filters in filter_sets])
+
+        output = ExportFormat(args.format, args.compress)
+        await asyncio.to_thread(write_output, output.stream(csv_text), args.output)
+
+        if args.webhook:
+            success, error = await send_csv_to_webhook(settings.n8n_webhook_url, csv_text.encode("utf-8"))
+            if not success:
+                raise ExportFailed(EXIT_UNAVAILABLE, f"Webhook send failed: {error}")
+        return EXIT_OK
+    except ExportFailed as e:
+        logger.error(f"Export failed: {str(e)}")
+        return e.exit_code
+    except Exception as e:
+        logger.error(f"Export failed: {str(e)}", exc_info=True)
+        return EXIT_FAILED
+    finally:
+        await browser_supervisor.stop()
+        await browser_pool.stop()
+        await close_state_backend()
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr)
+
+    from export_formats import PARQUET_AVAILABLE, ZSTD_AVAILABLE
+    if args.format == "parquet" and not PARQUET_AVAILABLE:
+        logger.error("--format parquet needs the pyarrow package")
+        return EXIT_USAGE
+    if args.compress == "zstd" and not ZSTD_AVAILABLE:
+        logger.error("--compress zstd needs the zstandard package")
+        return EXIT_USAGE
+
+    from tracing import setup_tracing, shutdown_tracing
+    setup_tracing()
+    try:
+        return asyncio.run(run(args))
+    finally:
+        shutdown_tracing()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,798 @@
+"""
+Linxo export engine
+
+The scrape behind /export-csv, /export-history and /collect, importable
+without the web server: browser context setup and teardown, Linxo login
+(with 2FA codes from Gmail), CSV download, concurrent collection of other
+secured pages, local filtering and the webhook send. Used by main.py and by
+the batch CLI (python -m export_cli).
+
+Failures use the same contract as the HTTP API: HTTPException (status code
+and detail), or a JSONResponse returned for login failures.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+# Playwright and httpx are imported lazily where they are used
+from artifacts import ArtifactRecorder
+from browser_supervisor import BrowserSession, browser_supervisor
+from collectors import PAGE_SECTIONS, scrape_section
+from export_filters import ExportFilters, FilterColumnMissing
+from gmail_helper import verify_gmail_access
+from gmail_quota import GmailRateLimited
+from linxo_sessions import LinxoSessionStore, is_logged_in
+from mailbox_dispatcher import mailbox_dispatcher
+from settings import get_settings, hash_api_key
+from state_backend import get_state_backend
+from tracing import inject_trace_headers, span
+from transactions import decode_csv
+
+logger = logging.getLogger(__name__)
+
+linxo_sessions = LinxoSessionStore.from_env(get_state_backend())
+EXPORT_LOCK_WAIT_SECONDS = float(os.getenv("EXPORT_LOCK_WAIT_SECONDS", 120))
+
+def linxo_scrape_lock(email: str, ttl: Optional[float] = None):
+    """One scrape at a time per Linxo account, across all workers, replicas and export_cli runs"""
+    return get_state_backend().lock(f"linxo-scrape:{hash_api_key(email)[:16]}",
+                                    ttl=ttl or browser_supervisor.export_deadline + 60, wait=EXPORT_LOCK_WAIT_SECONDS)
+
+async def setup_playwright(artifacts: ArtifactRecorder, storage_state: Optional[Dict] = None) -> BrowserSession:
+    """Get a fresh context and page on the shared browser, closed by the supervisor at the export deadline"""
+    context_options = artifacts.context_options()
+    if storage_state:
+        context_options["storage_state"] = storage_state
+    try:
+        with span("playwright.setup", browser=browser_supervisor.pool.profile.engine):
+            session = await browser_supervisor.open(context_options=context_options)
+            await artifacts.start_tracing(session.context)
+            return session
+    except Exception as e:
+        logger.error(f"Error setting up Playwright: {str(e)}", exc_info=True)
+        raise
+
+async def teardown_playwright(session: Optional[BrowserSession], artifacts: ArtifactRecorder):
+    """Save pending debug artifacts and close the export's browser context (idempotent)"""
+    with span("playwright.teardown"):
+        if session is not None and not session.closed:
+            await artifacts.flush(session.context)
+        await browser_supervisor.close(session)
+    await artifacts.finish()
+
+def deadline_exceeded_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail=f"Export did not finish within {browser_supervisor.export_deadline:g}s and was aborted"
+    )
+
+def require_linxo_credentials():
+    """Return the current settings, failing with 500 if Linxo credentials are missing"""
+    settings = get_settings()
+    if not settings.has_linxo_credentials:
+        error_msg = "Missing Linxo credentials in environment variables"
+        logger.error(error_msg)
+        logger.error(f"Email present: {'yes' if settings.linxo_email else 'no'}, Password present: {'yes' if settings.linxo_password else 'no'}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=error_msg
+        )
+    return settings
+
+async def check_gmail_available() -> bool:
+    """Check Gmail availability (optional for the service to work)"""
+    with span("gmail.verify_access") as gmail_span:
+        gmail_available = await asyncio.to_thread(verify_gmail_access)
+        gmail_span.set_attribute("gmail.available", gmail_available)
+    if not gmail_available:
+        logger.warning("Gmail API not available. If Linxo requires 2FA, the export may fail.")
+    return gmail_available
+
+async def login_to_linxo(page, email: str, password: str, gmail_available: bool, base_url: str,
+                         artifacts: ArtifactRecorder) -> Optional[JSONResponse]:
+    """
+    Log in to Linxo on `page`, entering the 2FA code from Gmail if asked.
+
+    Returns:
+        None on success, or a JSONResponse describing a login failure.
+        Other failures raise HTTPException.
+    """
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    logger.info("Navigating to Linxo login page")
+    with span("linxo.goto_login"):
+        await page.goto(f"{base_url}/auth.page#Login", timeout=60000)
+    
+    # Debug snapshot of the current page (only stored when artifacts=all)
+    artifacts.capture(page, "login_page")
+    
+    # Wait for and fill login form
+    logger.info("Waiting for login form...")
+    try:
+        # Try multiple possible selectors for the email field
+        email_selectors = [
+            'input[name="username"]',
+            'input[data-cy="email-input"]',
+            'input[type="email"]',
+            'input[type="text"][name="username"]',
+            'input[name*="mail"]',
+            'input[id*="mail"]',
+            'input[placeholder*="mail"]',
+            'input[autocomplete*="mail"]'
+        ]
+        
+        # Wait for any of the possible email fields
+        logger.info("Looking for email field...")
+        email_field = None
+        with span("linxo.find_email_field") as selector_span:
+            for attempt, selector in enumerate(email_selectors, start=1):
+                try:
+                    email_field = await page.wait_for_selector(selector, state='visible', timeout=3000)
+                    if email_field:
+                        logger.info(f"Found email field with selector: {selector}")
+                        selector_span.set_attributes({"selector": selector, "selector.attempts": attempt})
+                        break
+                except:
+                    continue
+        
+        if not email_field:
+            error_msg = "Could not find email field on Linxo login page"
+            logger.error(error_msg)
+            artifacts.capture(page, "email_field_not_found", error=True)
+            return JSONResponse(
+                status_code=503,
+                content={
+                    "message": "Export failed",
+                    "error": f"{error_msg}. The Linxo website structure may have changed."
+                }
+            )
+        
+        # Fill in the email
+        logger.info("Filling email...")
+        await email_field.fill(email)
+        
+        # Click on the email field again to activate the submit button
+        logger.info("Clicking email field to activate submit button...")
+        await email_field.click()
+        await page.wait_for_timeout(500)  # Small delay to let the button activate
+        
+        # Try to find and click the continue button
+        logger.info("Looking for continue button...")
+        button_selectors = [
+            'button[data-cy="submit-button"]',
+            'button[type="submit"]',
+            'button:has-text("Continuer")',
+            'button:has-text("Continue")'
+        ]
+        
+        clicked = False
+        with span("linxo.click_continue") as selector_span:
+            for attempt, selector in enumerate(button_selectors, start=1):
+                try:
+                    button = await page.wait_for_selector(selector, timeout=2000)
+                    if button:
+                        logger.info(f"Clicking button with selector: {selector}")
+                        await button.click()
+                        clicked = True
+                        selector_span.set_attributes({"selector": selector, "selector.attempts": attempt})
+                        break
+                except:
+                    continue
+        
+        if not clicked:
+            logger.warning("Could not find continue button, trying to press Enter...")
+            await page.keyboard.press('Enter')
+        
+        # Wait for password field with multiple possible selectors
+        logger.info("Waiting for password field...")
+        password_selectors = [
+            'input[name="password"]',
+            'input[type="password"]',
+            'input[data-cy="password-input"]',
+            'input[name*="pass"]',
+            'input[id*="pass"]'
+        ]
+        
+        password_field = None
+        with span("linxo.find_password_field") as selector_span:
+            for attempt, selector in enumerate(password_selectors, start=1):
+                try:
+                    password_field = await page.wait_for_selector(selector, state='visible', timeout=5000)
+                    if password_field:
+                        logger.info(f"Found password field with selector: {selector}")
+                        selector_span.set_attributes({"selector": selector, "selector.attempts": attempt})
+                        break
+                except:
+                    continue
+        
+        if not password_field:
+            error_msg = "Could not find password field on Linxo login page"
+            logger.error(error_msg)
+            artifacts.capture(page, "password_field_not_found", error=True)
+            return JSONResponse(
+                status_code=503,
+                content={
+                    "message": "Export failed",
+                    "error": f"{error_msg}. The Linxo website structure may have changed or login failed."
+                }
+            )
+        
+        # Fill in the password
+        logger.info("Filling password...")
+        await password_field.fill(password)
+        
+        # Click on the password field again to activate the submit button
+        logger.info("Clicking password field to activate submit button...")
+        await password_field.click()
+        await page.wait_for_timeout(500)  # Small delay to let the button activate
+        
+        code_ticket = None
+        try:
+            # Submitting the password is what makes Linxo send a 2FA email; the
+            # login timestamp lets the mailbox dispatcher route that email here
+            code_ticket = mailbox_dispatcher.expect_code()
+
+            # Click the login button
+            logger.info("Clicking login...")
+            login_clicked = False
+            with span("linxo.click_login") as selector_span:
+                for attempt, selector in enumerate(button_selectors, start=1):
+                    try:
+                        login_button = await page.wait_for_selector(selector, timeout=2000)
+                        if login_button:
+                            logger.info(f"Clicking login button with selector: {selector}")
+                            await login_button.click()
+                            login_clicked = True
+                            selector_span.set_attributes({"selector": selector, "selector.attempts": attempt})
+                            break
+                    except:
+                        continue
+
+            if not login_clicked:
+                logger.warning("Could not find login button, trying to press Enter...")
+                await page.keyboard.press('Enter')
+
+            # Wait for successful login or verification code page
+            logger.info("Waiting for login to complete...")
+            # Wait a bit to see if we're redirected to secured page or verification page
+            await page.wait_for_timeout(3000)
+            
+            current_url = page.url
+            logger.info(f"Current URL after login: {current_url}")
+            
+            # Check if we need to enter verification code
+            if "auth.page" in current_url or await page.query_selector('input[type="text"][maxlength="1"]'):
+                logger.info("Verification code required, fetching from Gmail...")
+                
+                # Debug snapshot
+                artifacts.capture(page, "verification_page")
+                
+                if not gmail_available:
+                    error_msg = "Verification code required but Gmail API is not available. Please ensure GMAIL_TOKEN_JSON is valid or regenerate the token."
+                    logger.error(error_msg)
+                    return JSONResponse(
+                        status_code=503,
+                        content={
+                            "message": "Export failed",
+                            "error": error_msg,
+                            "gmail_required": True
+                        }
+                    )
+                
+                # Fetch verification code from Gmail
+                with span("linxo.wait_verification_code", max_wait_seconds=60) as code_span:
+                    try:
+                        verification_code = await code_ticket.wait(60)
+                    except GmailRateLimited as e:
+                        code_span.set_attribute("gmail.rate_limited", True)
+                        logger.error(f"Could not retrieve verification code: {str(e)}")
+                        artifacts.capture(page, "verification_rate_limited", error=True)
+                        return JSONResponse(
+                            status_code=503,
+                            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+                            content={
+                                "message": "Export failed",
+                                "error": f"{str(e)}. The Linxo verification email could not be read in time.",
+                                "gmail_rate_limited": True
+                            }
+                        )
+                    code_span.set_attribute("code.found", verification_code is not None)
+                
+                if not verification_code:
+                    error_msg = "Could not retrieve verification code from Gmail within 60 seconds"
+                    logger.error(error_msg)
+                    artifacts.capture(page, "verification_timeout", error=True)
+                    return JSONResponse(
+                        status_code=504,
+                        content={
+                            "message": "Export failed",
+                            "error": f"{error_msg}. Please check if Linxo sent the verification email.",
+                            "gmail_issue": True
+                        }
+                    )
+                
+                logger.info(f"Retrieved verification code: {verification_code}")
+                
+                # Enter the verification code (6 digits in separate input fields)
+                code_inputs = await page.query_selector_all('input[type="text"][maxlength="1"]')
+
+                if len(code_inputs) == 6:
+                    logger.info(f"Found 6 input fields, entering verification code: {verification_code}")
+                    for i, digit in enumerate(verification_code):
+                        logger.info(f"Filling digit {i+1}: {digit}")
+
+                        # Wait for the input field to be ready and focus it
+                        await code_inputs[i].wait_for_element_state('visible')
+                        await code_inputs[i].wait_for_element_state('enabled')
+                        await code_inputs[i].scroll_into_view_if_needed()
+
+                        # Click and clear the field first
+                        await code_inputs[i].click()
+                        await code_inputs[i].fill('')
+
+                        # Type the digit with a small delay
+                        await code_inputs[i].type(digit, delay=100)
+
+                        # Verify the digit was entered
+                        value = await code_inputs[i].input_value()
+                        logger.info(f"Digit {i+1} entered: {value}")
+
+                    # Wait for all digits to be processed
+                    await page.wait_for_timeout(2000)
+
+                    # Try to trigger form validation by tabbing through fields
+                    for i in range(5):  # Tab through first 5 fields
+                        await code_inputs[i].press('Tab')
+                        await page.wait_for_timeout(200)
+
+                    # Click outside to trigger any validation
+                    await page.click('body')
+                    await page.wait_for_timeout(1000)
+                else:
+                    logger.info(f"Found {len(code_inputs)} input fields, trying alternative approach")
+
+                    # Try different selectors for verification code input
+                    alternative_selectors = [
+                        'input[name="code"]',
+                        'input[id*="code"]',
+                        'input[placeholder*="code"]',
+                        'input[type="text"]:not([name="username"]):not([name="password"])'
+                    ]
+
+                    code_entered = False
+                    for selector in alternative_selectors:
+                        try:
+                            logger.info(f"Trying selector: {selector}")
+                            code_input = await page.query_selector(selector)
+                            if code_input:
+                                await code_input.wait_for_element_state('visible')
+                                await code_input.wait_for_element_state('enabled')
+                                await code_input.scroll_into_view_if_needed()
+                                await code_input.click()
+                                await code_input.fill('')
+                                await code_input.type(verification_code, delay=100)
+
+                                value = await code_input.input_value()
+                                logger.info(f"Code entered with {selector}: {value}")
+                                code_entered = True
+                                break
+                        except Exception as e:
+                            logger.warning(f"Selector {selector} failed: {str(e)}")
+                            continue
+
+                    if not code_entered:
+                        error_msg = "Could not find verification code input field on page"
+                        logger.error(error_msg)
+                        artifacts.capture(page, "verification_fields_not_found", error=True)
+                        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"{error_msg}. The Linxo website structure may have changed."
+                        )
+                
+                # Click validate button
+                logger.info("Looking for validation button...")
+                validate_selectors = [
+                    'button:has-text("Valider")',
+                    'button:has-text("Validate")',
+                    'button[type="submit"]',
+                    'button[data-cy="submit-button"]',
+                    'input[type="submit"]',
+                    'button[class*="validate"]',
+                    'button[class*="submit"]'
+                ]
+
+                validate_clicked = False
+                with span("linxo.click_validate") as selector_span:
+                    for attempt, selector in enumerate(validate_selectors, start=1):
+                        try:
+                            logger.info(f"Trying validate button selector: {selector}")
+                            validate_button = await page.wait_for_selector(selector, timeout=5000, state='visible')
+                            if validate_button:
+                                logger.info(f"Found validate button with selector: {selector}")
+
+                                # Scroll into view and click
+                                await validate_button.scroll_into_view_if_needed()
+                                await validate_button.click()
+
+                                validate_clicked = True
+                                selector_span.set_attributes({"selector": selector, "selector.attempts": attempt})
+                                logger.info("Validate button clicked successfully")
+
+                                # Wait for the click to process
+                                await page.wait_for_timeout(2000)
+                                break
+                        except Exception as e:
+                            logger.warning(f"Validate button selector {selector} failed: {str(e)}")
+                            continue
+
+                if not validate_clicked:
+                    logger.warning("No validate button found with standard selectors, trying Enter key...")
+                    # Try pressing Enter on the last code input field
+                    if len(code_inputs) == 6:
+                        await code_inputs[5].press('Enter')
+                    else:
+                        await page.keyboard.press('Enter')
+                    await page.wait_for_timeout(2000)
+                
+                # Wait for redirect after validation
+                logger.info("Waiting for redirect after code validation...")
+
+                try:
+                    # Wait for URL change with longer timeout
+                    with span("linxo.wait_secured_redirect", timeout_ms=45000):
+                        await page.wait_for_url("**/secured/**", timeout=45000)
+                    logger.info("Successfully validated verification code - URL redirected")
+                except Exception as url_timeout:
+                    logger.warning(f"URL redirect timeout: {str(url_timeout)}")
+
+                    # Check current URL to see where we are
+                    current_url = page.url
+                    logger.info(f"Current URL after validation attempt: {current_url}")
+
+                    # Check if we're already on a secured page (maybe the pattern is different)
+                    if current_url.startswith(base_url) and ("secured" in current_url or "overview" in current_url or "history" in current_url):
+                        logger.info("Detected secured page with different URL pattern")
+                    else:
+                        # Check for error messages on the verification page
+                        error_selectors = [
+                            '.error-message', '.alert-danger', '.invalid-feedback',
+                            '.text-danger', '[class*="error"]', '[class*="invalid"]'
+                        ]
+
+                        for selector in error_selectors:
+                            try:
+                                error_element = await page.query_selector(selector)
+                                if error_element:
+                                    error_text = await error_element.inner_text()
+                                    logger.error(f"Verification error: {error_text}")
+                                    break
+                            except:
+                                continue
+
+                        # Debug snapshot of the verification result
+                        artifacts.capture(page, "verification_result")
+
+                        raise HTTPException(
+                            status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail=f"Verification code validation failed. Still on verification page. Current URL: {current_url}"
+                        )
+            else:
+                # Already on secured page
+                logger.info("Successfully logged in without verification code")
+
+        except Exception as e:
+            logger.error(f"Error during login: {str(e)}")
+            # Check if there's an error message on the page
+            error_message = await page.query_selector('.error-message, .alert, .error, .error-text, .notification--error, .invalid-feedback')
+            if error_message:
+                error_text = await error_message.inner_text()
+                logger.error(f"Login error message: {error_text}")
+            else:
+                logger.error("No error message found on page")
+
+            # Debug snapshot
+            artifacts.capture(page, "login_error", error=True)
+            logger.error(f"Login error artifacts saved for job {artifacts.job_id}")
+            raise
+        finally:
+            if code_ticket is not None:
+                code_ticket.close()
+                
+    except PlaywrightTimeoutError as e:
+        logger.error(f"Login timeout or element not found: {str(e)}")
+        # Debug snapshot
+        artifacts.capture(page, "login_timeout", error=True)
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timeout while trying to log in to Linxo. The login form might have changed or the service is unavailable."
+        )
+
+    return None
+
+async def send_csv_to_webhook(webhook_url: str, csv_utf8: bytes) -> Tuple[bool, Optional[str]]:
+    """POST a UTF-8 CSV to the n8n webhook; returns (success, error message)"""
+    import httpx
+    webhook_success = False
+    webhook_error = None
+    try:
+        logger.info(f"Webhook URL: {webhook_url}")
+        with span("n8n.webhook_send", **{"csv.bytes": len(csv_utf8)}) as webhook_span:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.post(
+                    webhook_url,
+                    content=csv_utf8,
+                    headers=inject_trace_headers({
+                        "Content-Type": "text/csv; charset=utf-8",
+                        "Content-Length": str(len(csv_utf8))
+                    })
+                )
+            webhook_span.set_attribute("http.status_code", response.status_code)
+            logger.info(f"Webhook response status: {response.status_code}")
+            logger.info(f"Webhook response body: {response.text[:200]}")
+            if response.status_code == 200:
+                webhook_success = True
+                logger.info("CSV successfully sent to n8n webhook")
+            else:
+                webhook_error = f"Status {response.status_code}: {response.text[:200]}"
+                logger.warning(f"n8n webhook returned non-200 status: {webhook_error}")
+    except httpx.TimeoutException as e:
+        webhook_error = f"Timeout: {str(e)}"
+        logger.error(f"Timeout sending CSV to n8n: {str(e)}")
+    except httpx.RequestError as e:
+        webhook_error = f"Request error: {str(e)}"
+        logger.error(f"Request error sending CSV to n8n: {str(e)}")
+    except Exception as e:
+        webhook_error = f"Unexpected error: {str(e)}"
+        logger.error(f"Unexpected error sending CSV to n8n: {str(e)}")
+    return webhook_success, webhook_error
+
+async def download_history_csv(page, base_url: str, filters: ExportFilters, artifacts: ArtifactRecorder) -> bytes:
+    """Open the history page with the filters' search and download its CSV"""
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    csv_content = None
+
+    # Navigate to transaction history
+    logger.info("Navigating to transaction history")
+    with span("linxo.goto_history"):
+        await page.goto(f"{base_url}/secured/history.page#{filters.history_fragment()}", timeout=30000)
+    
+    try:
+        # Wait for the page to load
+        logger.info("Waiting for transaction history page to load...")
+        with span("linxo.wait_history_idle"):
+            await page.wait_for_load_state("networkidle", timeout=10000)
+        
+        # Debug snapshot
+        artifacts.capture(page, "history_page")
+        
+        # Wait for and click CSV export button
+        logger.info("Looking for CSV export button...")
+        csv_button_selectors = [
+            'button:has-text("CSV")',
+            'button[type="button"]:has-text("CSV")',
+            '.GJALL4ABCV.GJALL4ABLW',
+            'button.GJALL4ABCV'
+        ]
+        
+        csv_button = None
+        with span("linxo.find_csv_button") as selector_span:
+            for attempt, selector in enumerate(csv_button_selectors, start=1):
+                try:
+                    csv_button = await page.wait_for_selector(selector, state='visible', timeout=5000)
+                    if csv_button:
+                        logger.info(f"Found CSV button with selector: {selector}")
+                        selector_span.set_attributes({"selector": selector, "selector.attempts": attempt})
+                        break
+                except:
+                    continue
+        
+        if not csv_button:
+            error_msg = "Could not find CSV export button on transaction history page"
+            logger.error(error_msg)
+            artifacts.capture(page, "csv_button_not_found", error=True)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"{error_msg}. The Linxo website structure may have changed."
+            )
+        
+        # Click the CSV export button and wait for download
+        logger.info("Clicking CSV export button...")
+        with span("linxo.csv_download") as download_span:
+            async with page.expect_download(timeout=30000) as download_info:
+                await csv_button.click()
+            
+            # Save the downloaded file
+            logger.info("Saving downloaded CSV file...")
+            download = await download_info.value
+            with tempfile.TemporaryDirectory() as tmpdir:
+                file_path = os.path.join(tmpdir, "linxo_transactions.csv")
+                await download.save_as(file_path)
+                
+                # Read the file content
+                with open(file_path, "rb") as f:
+                    csv_content = f.read()
+            download_span.set_attribute("csv.bytes", len(csv_content))
+        
+        logger.info("CSV file downloaded successfully")
+
+    except PlaywrightTimeoutError as e:
+        logger.error(f"Export timeout or element not found: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timeout while trying to export transactions. The page structure might have changed."
+        )
+
+    return csv_content
+
+async def _run_logged_in(settings, gmail_available: bool, artifacts: ArtifactRecorder,
+                         work: Callable[[BrowserSession], Awaitable[Any]]):
+    """
+    Log in to Linxo (or resume a stored session), run `work` on the session and close it.
+
+    Returns:
+        What `work` returned, or a JSONResponse describing a login failure.
+        Other failures raise HTTPException.
+    """
+    from playwright.async_api import Error as PlaywrightError
+
+    email = settings.linxo_email
+    password = settings.linxo_password
+    base_url = settings.linxo_base_url
+
+    session = None
+    page = None
+    
+    try:
+        logger.info("Starting Playwright browser")
+        stored_session = await linxo_sessions.load(email)
+        session = await setup_playwright(artifacts, storage_state=stored_session)
+        page = session.page
+        
+        # Login, unless a stored session is still accepted
+        if stored_session and await is_logged_in(page, base_url):
+            logger.info("Reusing stored Linxo session, skipping login")
+        else:
+            login_failure = await login_to_linxo(page, email, password, gmail_available, base_url, artifacts)
+            if login_failure is not None:
+                return login_failure
+            await linxo_sessions.save(email, session.context)
+        
+        return await work(session)
+
+    except HTTPException:
+        raise
+
+    except PlaywrightError as e:
+        if session is not None and session.expired:
+            raise deadline_exceeded_error()
+        error_msg = f"Playwright error: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        
+        # Debug snapshot, saved before the context is closed
+        artifacts.capture(page, "playwright_error", error=True)
+        
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=error_msg
+        )
+        
+    except Exception as e:
+        if session is not None and session.expired:
+            raise deadline_exceeded_error()
+        error_msg = f"Unexpected error: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=error_msg
+        )
+        
+    finally:
+        # Ensure resources are always cleaned up
+        try:
+            await teardown_playwright(session, artifacts)
+        except Exception as e:
+            logger.error(f"Error during cleanup: {str(e)}", exc_info=True)
+
+
+async def scrape_linxo_csv(settings, filters: ExportFilters, gmail_available: bool,
+                           artifacts: ArtifactRecorder):
+    """
+    Log in to Linxo (or resume a stored session) and download the history CSV.
+
+    Returns:
+        The raw CSV bytes, or a JSONResponse describing a login failure.
+        Other failures raise HTTPException.
+    """
+    return await _run_logged_in(
+        settings, gmail_available, artifacts,
+        lambda session: download_history_csv(session.page, settings.linxo_base_url, filters, artifacts)
+    )
+
+async def collect_linxo(settings, filters: ExportFilters, gmail_available: bool,
+                        artifacts: ArtifactRecorder, sections: Tuple[str, ...]):
+    """
+    Log in once and collect several sections concurrently, each in its own tab of the same context.
+
+    "transactions" downloads the history CSV on the login page's tab; the
+    other sections are scraped by collectors.scrape_section in new tabs.
+
+    Returns:
+        {"transactions": CSV bytes, <section>: rows, ..., "timings": {section: seconds},
+         "wall_seconds": float, "errors": {section: message}}, or a JSONResponse
+        describing a login failure. A failed transactions download raises
+        HTTPException like scrape_linxo_csv; other sections only report their error.
+    """
+    base_url = settings.linxo_base_url
+
+    async def work(session: BrowserSession) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"timings": {}, "errors": {}}
+        failures: Dict[str, BaseException] = {}
+
+        async def timed(name: str, coroutine):
+            started = time.perf_counter()
+            try:
+                result[name] = await coroutine
+            except Exception as e:
+                failures[name] = e
+                result["errors"][name] = str(getattr(e, "detail", e))
+                logger.error(f"Collecting {name} failed: {result['errors'][name]}")
+            finally:
+                result["timings"][name] = round(time.perf_counter() - started, 3)
+
+        collectors = []
+        for name in sections:
+            if name == "transactions":
+                collectors.append(timed(name, download_history_csv(session.page, base_url, filters, artifacts)))
+            else:
+                collectors.append(timed(name, scrape_section(session.context, base_url, PAGE_SECTIONS[name], artifacts)))
+        started = time.perf_counter()
+        with span("linxo.collect", sections=",".join(sections)):
+            await asyncio.gather(*collectors)
+        result["wall_seconds"] = round(time.perf_counter() - started, 3)
+
+        if session.expired:
+            raise deadline_exceeded_error()
+        if "transactions" in failures:
+            raise failures["transactions"]
+        return result
+
+    return await _run_logged_in(settings, gmail_available, artifacts, work)
+
+def apply_filters(csv_content: bytes, filters: ExportFilters) -> Tuple[bytes, Optional[Dict]]:
+    """
+    Apply the filters locally (Linxo may ignore some of them), keeping the original encoding
+
+    Returns:
+        (filtered CSV bytes, filter report or None when no row filter is set)
+
+    Raises:
+        HTTPException: 502 when the CSV lacks a column a filter needs (e.g.
+            Linxo renamed it), rather than reporting an empty export
+    """
+    if not filters.active:
+        return csv_content, None
+    with span("csv.filter", filters=",".join(filters.active)) as filter_span:
+        csv_text, encoding = decode_csv(csv_content)
+        try:
+            csv_text, row_counts = filters.apply(csv_text)
+        except FilterColumnMissing as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+        filter_span.set_attributes(row_counts)
+    filter_report = {
+        "server_side": filters.server_side,
+        "local": filters.active,
+        "exclude_duplicates": filters.exclude_duplicates,
+        **row_counts,
+    }
+    logger.info(f"Filtered CSV: {filter_report}")
+    return csv_text.encode(encoding), filter_report
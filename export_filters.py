@@ -0,0 +1,133 @@
+"""
+Export filters (date range, account, category, duplicates)
+
+Filters Linxo's history search understands are put in the history URL
+fragment so the CSV download is smaller. Every filter is also applied
+locally after the download, which covers filters Linxo ignores or cannot
+apply (e.g. category) and keeps the result correct either way. An account
+given by name (rather than by numeric id) is only matched locally.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, Query, status
+
+from transactions import parse_csv, parse_date, resolve_columns, serialize_csv
+
+logger = logging.getLogger(__name__)
+
+class FilterColumnMissing(ValueError):
+    """The CSV has no column an active filter needs"""
+
+
+# Filter -> key in the history.page#Search fragment
+SERVER_SIDE_KEYS = {
+    "date_from": "startDate",
+    "date_to": "endDate",
+    "account_id": "accountId",
+}
+# Linxo account ids are numeric; anything else is an account name
+ACCOUNT_ID_PATTERN = re.compile(r"^\d+$")
+
+
+@dataclass(frozen=True)
+class ExportFilters:
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    account_id: Optional[str] = None
+    category: Optional[str] = None
+    exclude_duplicates: bool = False
+
+    @property
+    def active(self) -> List[str]:
+        """Names of the row filters that are set"""
+        return [name for name in ("date_from", "date_to", "account_id", "category") if getattr(self, name)]
+
+    @property
+    def server_side(self) -> List[str]:
+        names = [name for name in self.active if name in SERVER_SIDE_KEYS]
+        if "account_id" in names and not ACCOUNT_ID_PATTERN.match(self.account_id.strip()):
+            names.remove("account_id")
+        return names
+
+    @property
+    def scope(self) -> str:
+        """Stable description of the filters, used to key per-filter state"""
+        values = [f"{name}={getattr(self, name)}" for name in self.active]
+        if self.exclude_duplicates:
+            values.append("exclude_duplicates")
+        return ";".join(values) or "all"
+
+    def history_fragment(self, page_number: int = 0) -> str:
+        """Build the `#Search;...` fragment of the history page URL"""
+        parts = [
+            "Search",
+            f"pageNumber={page_number}",
+            f"excludeDuplicates={'true' if self.exclude_duplicates else 'false'}",
+        ]
+        for name in self.server_side:
+            value = getattr(self, name)
+            value = value.isoformat() if isinstance(value, date) else value.strip()
+            parts.append(f"{SERVER_SIDE_KEYS[name]}={quote(value, safe='')}")
+        return ";".join(parts)
+
+    def _row_matches(self, row: Dict[str, str], columns: Dict[str, Optional[str]]) -> bool:
+        if self.date_from or self.date_to:
+            row_date = parse_date(row.get(columns["date"] or "", ""))
+            if row_date is None:
+                return False
+            if self.date_from and row_date < self.date_from:
+                return False
+            if self.date_to and row_date > self.date_to:
+                return False
+        if self.account_id:
+            wanted = self.account_id.strip().lower()
+            candidates = [row.get(columns[name] or "", "") for name in ("account_id", "account")]
+            if not any(candidate.strip().lower() == wanted for candidate in candidates):
+                return False
+        if self.category:
+            if row.get(columns["category"] or "", "").strip().lower() != self.category.strip().lower():
+                return False
+        return True
+
+    def apply(self, text: str) -> Tuple[str, Dict[str, int]]:
+        """
+        Filter decoded CSV text locally.
+
+        Returns:
+            (filtered text, {"rows_before": n, "rows_after": m})
+
+        Raises:
+            FilterColumnMissing: an active filter's column is not in the header;
+                filtering would otherwise drop every row
+        """
+        header, rows, delimiter = parse_csv(text)
+        columns = resolve_columns(header)
+        for name, names in (("date_from", ("date",)), ("date_to", ("date",)),
+                            ("account_id", ("account_id", "account")), ("category", ("category",))):
+            if getattr(self, name) and all(columns[column] is None for column in names):
+                raise FilterColumnMissing(f"Cannot filter on {name}: no {' or '.join(names)} column in CSV header {header}")
+        kept = [row for row in rows if self._row_matches(row, columns)]
+        # A byte order mark stays part of the first header name, so it is written back as-is
+        return serialize_csv(header, kept, delimiter), {"rows_before": len(rows), "rows_after": len(kept)}
+
+
+def export_filters(
+    date_from: Optional[date] = Query(None, alias="from", description="First transaction date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, alias="to", description="Last transaction date (YYYY-MM-DD)"),
+    account_id: Optional[str] = Query(None, description="Account id or account name"),
+    category: Optional[str] = Query(None, description="Category name"),
+    exclude_duplicates: bool = Query(False, description="Drop transactions Linxo flags as duplicates"),
+) -> ExportFilters:
+    """FastAPI dependency reading export filters from the query string"""
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="'from' must be on or before 'to'"
+        )
+    return ExportFilters(date_from, date_to, account_id, category, exclude_duplicates)
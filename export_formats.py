@@ -0,0 +1,217 @@
+"""
+Export response formats and compression
+
+/export-csv returns a JSON status by default. With `?format=` or an Accept
+header it streams the transactions back instead:
+
+    csv      text/csv                      UTF-8, same columns as Linxo's export
+    ndjson   application/x-ndjson          one JSON object per transaction
+    parquet  application/vnd.apache.parquet  typed columns (needs pyarrow)
+
+CSV and NDJSON bodies are compressed with zstd (needs zstandard) or gzip,
+picked from Accept-Encoding. Parquet is compressed internally instead.
+"""
+
+import importlib.util
+import json
+import logging
+import zlib
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Query, Request, status
+
+from transactions import parse_amount, parse_csv, parse_date, resolve_columns, serialize_csv
+
+logger = logging.getLogger(__name__)
+
+# pyarrow is slow to import, so only its presence is checked at startup
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Accept header media types -> format ("json" is the status response)
+ACCEPTED_MEDIA_TYPES = {
+    "application/json": "json",
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+_CENTS = Decimal("0.01")
+
+FILE_EXTENSIONS = {"csv": "csv", "ndjson": "ndjson", "parquet": "parquet"}
+
+CHUNK_SIZE = 64 * 1024
+ROWS_PER_CHUNK = 500
+
+
+def _parse_quality_list(header: str) -> List[Tuple[str, float]]:
+    """Parse "a;q=0.5, b" into [(a, 0.5), (b, 1.0)], highest quality first (stable)"""
+    entries = []
+    for item in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, *params = [piece.strip() for piece in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        entries.append((name.lower(), quality))
+    return sorted(entries, key=lambda entry: -entry[1])
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """Pick the response format from the Accept header (JSON status unless data is asked for)"""
+    for media_type, quality in _parse_quality_list(accept):
+        if quality > 0 and media_type in ACCEPTED_MEDIA_TYPES:
+            return ACCEPTED_MEDIA_TYPES[media_type]
+    return "json"
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    """Pick zstd, gzip or identity from Accept-Encoding (zstd wins ties)"""
+    supported = ["zstd", "gzip"] if ZSTD_AVAILABLE else ["gzip"]
+    offered = dict(_parse_quality_list(accept_encoding))
+    wildcard = offered.get("*", 0.0)
+    candidates = [(offered.get(name, wildcard), -index, name) for index, name in enumerate(supported)]
+    quality, _, name = max(candidates)
+    return name if quality > 0 else "identity"
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    format: str = "json"
+    encoding: str = "identity"
+
+    @property
+    def streams_data(self) -> bool:
+        return self.format != "json"
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    def response_headers(self, filename_stem: str = "linxo_transactions") -> Dict[str, str]:
+        headers = {
+            "Content-Disposition": f'attachment; filename="{filename_stem}.{FILE_EXTENSIONS[self.format]}"',
+            "Vary": "Accept, Accept-Encoding",
+        }
+        if self.encoding != "identity":
+            headers["Content-Encoding"] = self.encoding
+        return headers
+
+    def stream(self, csv_text: str) -> Iterator[bytes]:
+        """Encode decoded Linxo CSV text in this format, compressed as negotiated"""
+        header, rows, delimiter = parse_csv(csv_text)
+        if self.format == "csv":
+            chunks = iter_csv(header, rows, delimiter)
+        elif self.format == "ndjson":
+            chunks = iter_ndjson(header, rows)
+        else:
+            chunks = iter_parquet(header, rows)
+        return compress(chunks, self.encoding)
+
+
+def export_format(
+    request: Request,
+    format: Optional[str] = Query(None, description="Response format: json (status), csv, ndjson or parquet. "
+                                                    "Defaults to the Accept header."),
+) -> ExportFormat:
+    """FastAPI dependency choosing the export response format and compression"""
+    chosen = (format or negotiate_format(request.headers.get("accept"))).lower()
+    if chosen != "json" and chosen not in MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown format '{format}', expected one of: json, {', '.join(MEDIA_TYPES)}"
+        )
+    if chosen == "parquet" and not PARQUET_AVAILABLE:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="Parquet output needs the pyarrow package, which is not installed"
+        )
+    # Parquet pages are already compressed
+    encoding = "identity" if chosen in ("json", "parquet") else negotiate_encoding(request.headers.get("accept-encoding"))
+    return ExportFormat(chosen, encoding)
+
+
+def _clean_header(header: List[str]) -> List[str]:
+    return [name.lstrip("\ufeff").strip() for name in header]
+
+
+def iter_csv(header: List[str], rows: List[Dict[str, str]], delimiter: str) -> Iterator[bytes]:
+    """UTF-8 CSV in batches of rows, keeping Linxo's delimiter"""
+    clean = _clean_header(header)
+    renamed = [dict(zip(clean, (row.get(name, "") for name in header))) for row in rows]
+    for start in range(0, max(len(renamed), 1), ROWS_PER_CHUNK):
+        text = serialize_csv(clean, renamed[start:start + ROWS_PER_CHUNK], delimiter)
+        if start:
+            # Only the first batch carries the header line
+            text = text.split("\r\n", 1)[1]
+        yield text.encode("utf-8")
+
+
+def iter_ndjson(header: List[str], rows: List[Dict[str, str]]) -> Iterator[bytes]:
+    """One JSON object per row, values kept as exported"""
+    clean = _clean_header(header)
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(clean, (row.get(name, "") for name in header))), ensure_ascii=False))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_parquet(header: List[str], rows: List[Dict[str, str]]) -> Iterator[bytes]:
+    """Parquet file with the date column as date32 and the amount as decimal(18, 2)"""
+    import pyarrow
+    import pyarrow.parquet
+
+    columns = resolve_columns(header)
+    arrays = []
+    for name in header:
+        values = [row.get(name, "") for row in rows]
+        if name == columns["date"]:
+            arrays.append(pyarrow.array([parse_date(value) for value in values], type=pyarrow.date32()))
+        elif name == columns["amount"]:
+            amounts = [parse_amount(value) for value in values]
+            arrays.append(pyarrow.array([a.quantize(_CENTS) if a is not None else None for a in amounts],
+                                        type=pyarrow.decimal128(18, 2)))
+        else:
+            arrays.append(pyarrow.array(values, type=pyarrow.string()))
+    table = pyarrow.Table.from_arrays(arrays, names=_clean_header(header))
+
+    sink = pyarrow.BufferOutputStream()
+    pyarrow.parquet.write_table(table, sink, compression="zstd")
+    data = memoryview(sink.getvalue())
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield bytes(data[start:start + CHUNK_SIZE])
+
+
+def compress(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a chunk stream incrementally"""
+    if encoding == "identity":
+        yield from chunks
+        return
+    if encoding == "zstd":
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        # wbits=31 writes a gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
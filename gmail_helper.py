@@ -2,20 +2,47 @@ import os
 import re
 import time
 import json
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import base64
 import logging
+import threading
+from gmail_quota import GmailRateLimited, gmail_quota
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Built services are cached per thread: the underlying httplib2 client is not
+# thread-safe, and Gmail calls run in asyncio.to_thread worker threads
+_thread_cache = threading.local()
+
+# A successful verify_gmail_access is trusted for this long instead of
+# calling getProfile on every export
+VERIFY_CACHE_SECONDS = float(os.getenv('GMAIL_VERIFY_CACHE_SECONDS', 300))
+_verified = {'cache_key': None, 'at': 0.0}
+
 def get_gmail_service():
     """Authenticate and return Gmail API service"""
+    with span("gmail.get_service") as service_span:
+        cache_key = (os.getenv('GMAIL_TOKEN_JSON'), os.getenv('GMAIL_API_ENDPOINT'))
+        service = getattr(_thread_cache, 'service', None)
+        if service is not None and _thread_cache.cache_key == cache_key:
+            service_span.set_attribute("gmail.cached", True)
+            return service
+
+        service = _get_gmail_service(service_span)
+        _thread_cache.service = service
+        _thread_cache.cache_key = cache_key
+        return service
+
+def _get_gmail_service(service_span):
+    """Load, refresh or create credentials and build the Gmail API service"""
+    # Imported lazily to keep application start-up fast
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+    from googleapiclient.discovery import build
+
     creds = None
     
     # First, try to load from environment variable (for Docker/Coolify deployment)
@@ -25,6 +52,7 @@ def get_gmail_service():
         try:
             token_data = json.loads(token_json_env)
             creds = Credentials.from_authorized_user_info(token_data, SCOPES)
+            service_span.set_attribute("gmail.credentials_source", "env")
             logger.info(f"Successfully loaded credentials from environment variable")
             logger.info(f"Credentials valid: {creds.valid}, expired: {creds.expired}, has refresh_token: {creds.refresh_token is not None}")
             if creds.expiry:
@@ -36,13 +64,16 @@ def get_gmail_service():
     if not creds and os.path.exists('token.json'):
         logger.info("Loading Gmail credentials from token.json file")
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        service_span.set_attribute("gmail.credentials_source", "file")
     
     # If credentials are invalid or don't exist, try to refresh or authenticate
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             logger.info("Refreshing expired credentials...")
             try:
-                creds.refresh(Request())
+                with span("gmail.refresh_credentials"):
+                    creds.refresh(Request())
+                service_span.set_attribute("gmail.credentials_refreshed", True)
                 logger.info("Credentials refreshed successfully")
             except Exception as e:
                 logger.error(f"Error refreshing credentials: {str(e)}")
@@ -53,6 +84,7 @@ def get_gmail_service():
         else:
             # Interactive authentication (only works locally, not in Docker)
             logger.warning("No valid credentials found. Attempting interactive authentication...")
+            from google_auth_oauthlib.flow import InstalledAppFlow
             
             # Check for credentials.json file or environment variable
             credentials_json_env = os.getenv('GMAIL_CREDENTIALS_JSON')
@@ -88,7 +120,13 @@ def get_gmail_service():
             logger.info("New credentials saved to token.json. "
                        "Copy this file content to GMAIL_TOKEN_JSON environment variable for Docker deployment.")
     
-    return build('gmail', 'v1', credentials=creds)
+    # GMAIL_API_ENDPOINT lets benchmarks point the client at a local fake Gmail API
+    api_endpoint = os.getenv('GMAIL_API_ENDPOINT')
+    client_options = {'api_endpoint': api_endpoint} if api_endpoint else None
+    # static_discovery uses the Gmail discovery document bundled with
+    # google-api-python-client instead of fetching it over the network
+    return build('gmail', 'v1', credentials=creds, client_options=client_options,
+                 static_discovery=True, cache_discovery=False)
 
 def extract_verification_code(email_body):
     """Extract 6-digit verification code from email body"""
@@ -118,99 +156,89 @@ def verify_gmail_access():
     Returns:
         bool: True if Gmail API is accessible, False otherwise
     """
+    cache_key = (os.getenv('GMAIL_TOKEN_JSON'), os.getenv('GMAIL_API_ENDPOINT'))
+    if _verified['cache_key'] == cache_key and time.monotonic() - _verified['at'] < VERIFY_CACHE_SECONDS:
+        return True
     try:
         logger.info("Verifying Gmail API access...")
         service = get_gmail_service()
         
         # Test the connection by checking profile
-        profile = service.users().getProfile(userId='me').execute()
+        profile = gmail_quota.execute(service.users().getProfile(userId='me'), 'users.getProfile')
         email_address = profile.get('emailAddress', 'unknown')
         logger.info(f"✅ Gmail API access verified for: {email_address}")
+        _verified.update(cache_key=cache_key, at=time.monotonic())
+        return True
+    except GmailRateLimited as e:
+        # Rate limited is not broken: let the export try, polling will wait for quota
+        logger.warning(f"Gmail API verification skipped: {str(e)}")
         return True
     except Exception as e:
         error_msg = f"Gmail API verification failed: {str(e)}"
         logger.warning(f"{error_msg}. Gmail functionality will be unavailable.")
         return False
 
-def get_linxo_verification_code(max_wait_seconds=60):
+def list_verification_emails(after_seconds, deadline=None):
     """
-    Fetch the latest Linxo verification code from Gmail
-    Args:
-        max_wait_seconds: Maximum time to wait for the email (default: 60 seconds)
+    Ids of Linxo verification emails received after `after_seconds` (epoch), newest first
 
-    Returns:
-        str: The 6-digit verification code, or None if not found
+    Raises:
+        GmailRateLimited: Gmail was rate limited past `deadline` (a time.monotonic() value)
     """
-    try:
-        service = get_gmail_service()
+    service = get_gmail_service()
+    query = f'from:linxo.com subject:"code de vérification" after:{int(after_seconds)}'
+    results = gmail_quota.execute(service.users().messages().list(
+        userId='me',
+        q=query,
+        maxResults=10
+    ), 'users.messages.list', deadline)
+    return [message['id'] for message in results.get('messages', [])]
+
+def read_verification_email(message_id, deadline=None):
+    """
+    Fetch one email and extract its verification code
 
-        start_time = time.time()
-
-        while time.time() - start_time < max_wait_seconds:
-            # Search for recent emails from Linxo (last hour to get more results)
-            query = 'from:linxo.com subject:"code de vérification" newer_than:1h'
-
-            results = service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=10  # Get more results
-            ).execute()
-
-            messages = results.get('messages', [])
-
-            if not messages:
-                logger.info("No Linxo verification email found yet, waiting...")
-                time.sleep(5)
-                continue
-
-            # Sort messages by internal date (newest first)
-            # Gmail API doesn't guarantee order, so we'll check all and pick the most recent
-            logger.info(f"Found {len(messages)} Linxo emails, checking for codes...")
-
-            for message in messages:
-                msg = service.users().messages().get(
-                    userId='me',
-                    id=message['id'],
-                    format='full'
-                ).execute()
-
-                # Get email headers to check subject and date
-                headers = msg.get('payload', {}).get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-
-                # Get email body
-                payload = msg.get('payload', {})
-                body = ''
-
-                # Extract body from different parts
-                if 'parts' in payload:
-                    for part in payload['parts']:
-                        if part['mimeType'] == 'text/plain':
-                            body_data = part['body'].get('data', '')
-                            if body_data:
-                                body = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                                break
-                else:
-                    body_data = payload.get('body', {}).get('data', '')
-                    if body_data:
-                        body = base64.urlsafe_b64decode(body_data).decode('utf-8')
-
-                # Try to extract code from subject first, then body
-                code = extract_verification_code(subject)
-                if not code:
-                    code = extract_verification_code(body)
-
-                if code:
-                    logger.info(f"Found verification code: {code} in email dated {date}")
-                    return code
-
-            logger.info("Checked all emails but no code extracted, waiting for new email...")
-            time.sleep(5)
-
-        logger.error("Timeout waiting for verification code email")
-        return None
+    Returns:
+        dict: id, internal_date_ms (when Gmail received it), date header and code (None if none found)
 
-    except Exception as e:
-        logger.error(f"Error fetching verification code: {str(e)}")
-        return None
+    Raises:
+        GmailRateLimited: Gmail was rate limited past `deadline` (a time.monotonic() value)
+    """
+    service = get_gmail_service()
+    msg = gmail_quota.execute(service.users().messages().get(
+        userId='me',
+        id=message_id,
+        format='full'
+    ), 'users.messages.get', deadline)
+
+    # Get email headers to check subject and date
+    headers = msg.get('payload', {}).get('headers', [])
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+    date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+
+    # Get email body
+    payload = msg.get('payload', {})
+    body = ''
+
+    # Extract body from different parts
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain':
+                body_data = part['body'].get('data', '')
+                if body_data:
+                    body = base64.urlsafe_b64decode(body_data).decode('utf-8')
+                    break
+    else:
+        body_data = payload.get('body', {}).get('data', '')
+        if body_data:
+            body = base64.urlsafe_b64decode(body_data).decode('utf-8')
+
+    # Try to extract code from subject first, then body
+    code = extract_verification_code(subject) or extract_verification_code(body)
+
+    return {
+        'id': message_id,
+        'internal_date_ms': int(msg.get('internalDate', 0)),
+        'date': date,
+        'code': code,
+    }
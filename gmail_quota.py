@@ -0,0 +1,178 @@
+"""
+Gmail API quota budget
+
+Every Gmail call goes through GmailQuota.execute, which:
+
+- charges the call's quota units (users.getProfile = 1, messages.list and
+  messages.get = 5, ...) against a sliding one-minute budget shared by every
+  concurrent export in the process (GMAIL_QUOTA_UNITS_PER_MINUTE); a call that
+  would exceed it waits for units to free up instead of hitting Google's limit
+- retries 429 and 403 rate-limit responses with exponential backoff
+  (GMAIL_BACKOFF_BASE_SECONDS doubling up to GMAIL_BACKOFF_MAX_SECONDS, or the
+  server's Retry-After), pausing every other caller for the same time
+- raises GmailRateLimited when the budget or the backoff would run past the
+  caller's deadline, so rate limiting is not mistaken for "no email yet"
+
+Gmail calls run in worker threads (asyncio.to_thread), so this is
+synchronous and guarded by a threading lock. The budget is per process.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Quota units per method (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    "users.getProfile": 1,
+    "users.messages.list": 5,
+    "users.messages.get": 5,
+    "users.history.list": 2,
+}
+DEFAULT_UNITS = 5
+
+# 403 reasons Google uses for rate limiting (other 403s are permission errors)
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+
+WINDOW_SECONDS = 60
+
+
+class GmailRateLimited(Exception):
+    """Gmail calls are rate limited for longer than the caller can wait"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Gmail API rate limited, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    """True for googleapiclient HttpErrors that are 429s or rate-limit 403s"""
+    resp = getattr(error, "resp", None)
+    status = getattr(resp, "status", None)
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    try:
+        content = json.loads(getattr(error, "content", b"") or b"{}")
+        reasons = {detail.get("reason") for detail in content.get("error", {}).get("errors", [])}
+    except (ValueError, AttributeError):
+        return False
+    return bool(reasons & RATE_LIMIT_REASONS)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    resp = getattr(error, "resp", None)
+    try:
+        return float(resp.get("retry-after")) if resp is not None and resp.get("retry-after") else None
+    except (TypeError, ValueError):
+        return None
+
+
+class GmailQuota:
+    """Per-minute quota budget and rate-limit backoff shared by all Gmail calls"""
+
+    def __init__(self, units_per_minute: int = 3000, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 32.0):
+        self.units_per_minute = units_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        # (monotonic time, units) of calls in the last minute
+        self._window: deque = deque()
+        self._window_units = 0
+        self._blocked_until = 0.0
+        self.calls = defaultdict(int)
+        self.units = defaultdict(int)
+        self.throttled_waits = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited_responses = 0
+        self.retries = 0
+        self.gave_up = 0
+
+    @classmethod
+    def from_env(cls) -> "GmailQuota":
+        return cls(
+            units_per_minute=int(os.getenv("GMAIL_QUOTA_UNITS_PER_MINUTE", 3000)),
+            max_retries=int(os.getenv("GMAIL_MAX_RETRIES", 5)),
+            backoff_base=float(os.getenv("GMAIL_BACKOFF_BASE_SECONDS", 1)),
+            backoff_max=float(os.getenv("GMAIL_BACKOFF_MAX_SECONDS", 32)),
+        )
+
+    def _prune(self, now: float):
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            self._window_units -= self._window.popleft()[1]
+
+    def reserve(self, method: str, deadline: Optional[float] = None):
+        """Wait until `method`'s units fit in the budget and charge them; deadline is a time.monotonic() value"""
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                wait = max(self._blocked_until - now, 0)
+                if not wait and self.units_per_minute and self._window_units + units > self.units_per_minute:
+                    wait = self._window[0][0] + WINDOW_SECONDS - now if self._window else 0
+                if wait <= 0:
+                    self._window.append((now, units))
+                    self._window_units += units
+                    self.calls[method] += 1
+                    self.units[method] += units
+                    return
+                if deadline is not None and now + wait > deadline:
+                    self.gave_up += 1
+                    raise GmailRateLimited(wait)
+                self.throttled_waits += 1
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+    def execute(self, request, method: str, deadline: Optional[float] = None):
+        """Run a googleapiclient request within the budget, retrying rate-limit errors"""
+        attempt = 0
+        while True:
+            self.reserve(method, deadline)
+            try:
+                return request.execute()
+            except Exception as e:
+                if not _is_rate_limit(e):
+                    raise
+                delay = _retry_after(e) or min(self.backoff_base * 2 ** attempt, self.backoff_max)
+                delay *= random.uniform(1, 1.25)
+                with self._lock:
+                    self.rate_limited_responses += 1
+                    # Every caller backs off, not only this one
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                    out_of_time = deadline is not None and time.monotonic() + delay > deadline
+                    if attempt >= self.max_retries or out_of_time:
+                        self.gave_up += 1
+                        raise GmailRateLimited(delay) from e
+                    self.retries += 1
+                logger.warning(f"Gmail {method} rate limited, backing off {delay:.1f}s (attempt {attempt + 1})")
+                attempt += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            return {
+                "units_per_minute_budget": self.units_per_minute,
+                "units_last_minute": self._window_units,
+                "calls": dict(self.calls),
+                "units": dict(self.units),
+                "throttled_waits": self.throttled_waits,
+                "throttled_seconds": round(self.throttled_seconds, 1),
+                "rate_limited_responses": self.rate_limited_responses,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "backoff_remaining_seconds": round(max(self._blocked_until - now, 0), 1),
+            }
+
+
+gmail_quota = GmailQuota.from_env()
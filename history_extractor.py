@@ -0,0 +1,213 @@
+"""
+Paginated transaction history extraction
+
+The CSV button only exports what the current search returns and leaves out
+on-screen fields (tags, notes, pointed status). This module walks the
+history pages (`history.page#Search;pageNumber=N;...`) in several tabs of the
+same authenticated browser context at once, scrapes each page's table, and
+yields merged, de-duplicated rows in page order as soon as they are ready.
+
+A page that fails to load is retried (HISTORY_PAGE_ATTEMPTS, default 2
+attempts); if it still fails it is skipped and reported by an "_error" row,
+which stream_csv writes as a trailer line so the CSV is never silently
+truncated.
+
+The row selector can be overridden with LINXO_HISTORY_ROW_SELECTOR if the
+Linxo markup changes.
+"""
+
+import asyncio
+import csv
+import hashlib
+import io
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from export_filters import ExportFilters
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_SELECTOR = 'table tbody tr'
+
+# Turns each matched row into {header: text}. Checkbox cells (e.g. "pointed")
+# become "true"/"false"; row ids and duplicate markers go in "_"-prefixed keys.
+EXTRACT_ROWS_JS = """
+(rows) => rows.map((row) => {
+    const table = row.closest('table');
+    const headers = table ? Array.from(table.querySelectorAll('thead th')).map((th) => th.innerText.trim()) : [];
+    const cells = Array.from(row.querySelectorAll('td, [role="cell"]'));
+    const record = {};
+    cells.forEach((cell, index) => {
+        const name = headers[index] || `column_${index + 1}`;
+        const checkbox = cell.querySelector('input[type="checkbox"]');
+        record[name] = checkbox ? String(checkbox.checked) : cell.innerText.trim();
+    });
+    const rowId = row.getAttribute('data-id') || row.getAttribute('data-transaction-id') || row.id;
+    if (rowId) record._id = rowId;
+    if (/duplicate/i.test(row.className || '')) record._duplicate = 'true';
+    return record;
+}).filter((record) => Object.keys(record).some((key) => !key.startsWith('_')))
+"""
+
+
+def history_url(base_url: str, page_number: int, exclude_duplicates: bool = False) -> str:
+    fragment = ExportFilters(exclude_duplicates=exclude_duplicates).history_fragment(page_number)
+    return f"{base_url}/secured/history.page#{fragment}"
+
+
+def row_key(row: Dict[str, str]) -> str:
+    """Stable identity of a row: Linxo's id when present, otherwise a hash of its visible fields"""
+    if row.get("_id"):
+        return f"id:{row['_id']}"
+    visible = "\x1f".join(f"{key}={value}" for key, value in sorted(row.items()) if not key.startswith("_"))
+    return "sha1:" + hashlib.sha1(visible.encode("utf-8")).hexdigest()
+
+
+async def scrape_history_page(context, base_url: str, page_number: int,
+                              exclude_duplicates: bool, row_selector: str) -> List[Dict[str, str]]:
+    """Open one history page in a new tab and return its rows ([] past the last page)"""
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    with span("linxo.history_page", page_number=page_number) as page_span:
+        page = await context.new_page()
+        try:
+            await page.goto(history_url(base_url, page_number, exclude_duplicates), timeout=30000)
+            await page.wait_for_load_state("networkidle", timeout=10000)
+            try:
+                await page.wait_for_selector(row_selector, timeout=5000)
+            except PlaywrightTimeoutError:
+                logger.info(f"No transaction rows on history page {page_number}")
+                page_span.set_attribute("rows", 0)
+                return []
+            rows = await page.eval_on_selector_all(row_selector, EXTRACT_ROWS_JS)
+            page_span.set_attribute("rows", len(rows))
+            logger.info(f"History page {page_number}: {len(rows)} rows")
+            return rows
+        finally:
+            await page.close()
+
+
+async def scrape_history_page_with_retries(context, base_url: str, page_number: int, exclude_duplicates: bool,
+                                           row_selector: str, attempts: int) -> Tuple[List[Dict[str, str]], Optional[str]]:
+    """Rows of one history page and None, or [] and the last error once every attempt failed"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await scrape_history_page(context, base_url, page_number, exclude_duplicates, row_selector), None
+        except Exception as e:
+            logger.warning(f"History page {page_number} failed (attempt {attempt}/{attempts}): {str(e)}")
+            error = str(e) or type(e).__name__
+    return [], error
+
+
+async def iter_history_rows(context, base_url: str, max_pages: int = 20, parallelism: int = 4,
+                            exclude_duplicates: bool = False,
+                            row_selector: Optional[str] = None) -> AsyncIterator[Dict[str, str]]:
+    """
+    Yield de-duplicated rows from history pages 0..max_pages-1.
+
+    Up to `parallelism` pages are loaded at once. Rows are yielded in page
+    order; the first empty page marks the end of the history. Rows with a
+    Linxo id seen on two pages (the listing shifted while paging) are yielded
+    once. Rows without an id are only compared by content with
+    exclude_duplicates, which also drops rows Linxo flags as duplicates:
+    identical transactions (two equal payments on the same day) are otherwise
+    kept, so an id-less row repeated across a page boundary can appear twice.
+
+    A page that still fails after its retries yields {"_error": message} in
+    its place and the following pages are read as usual.
+    """
+    row_selector = row_selector or os.getenv("LINXO_HISTORY_ROW_SELECTOR", DEFAULT_ROW_SELECTOR)
+    attempts = max(1, int(os.getenv("HISTORY_PAGE_ATTEMPTS", 2)))
+    pending: Dict[int, asyncio.Task] = {}
+    completed: Dict[int, List[Dict[str, str]]] = {}
+    failed: Dict[int, str] = {}
+    next_page = 0
+    next_to_emit = 0
+    last_page: Optional[int] = None
+    seen_keys = set()
+
+    def within_history(page_number: int) -> bool:
+        return page_number < max_pages and (last_page is None or page_number <= last_page)
+
+    try:
+        while True:
+            while len(pending) < parallelism and within_history(next_page):
+                pending[next_page] = asyncio.create_task(
+                    scrape_history_page_with_retries(context, base_url, next_page, exclude_duplicates,
+                                                     row_selector, attempts)
+                )
+                next_page += 1
+
+            if not pending and next_to_emit not in completed:
+                break
+
+            if pending:
+                done, _ = await asyncio.wait(pending.values(), return_when=asyncio.FIRST_COMPLETED)
+                for page_number in [number for number, task in pending.items() if task in done]:
+                    rows, error = pending.pop(page_number).result()
+                    completed[page_number] = rows
+                    if error is not None:
+                        # A failed page says nothing about where the history ends
+                        failed[page_number] = error
+                    elif not rows and (last_page is None or page_number - 1 < last_page):
+                        last_page = page_number - 1
+
+                # Pages past the end are not needed any more
+                for page_number in [number for number in pending if not within_history(number)]:
+                    pending.pop(page_number).cancel()
+
+            while next_to_emit in completed and within_history(next_to_emit):
+                if next_to_emit in failed:
+                    yield {"_error": f"history page {next_to_emit} could not be loaded: {failed.pop(next_to_emit)}"}
+                for row in completed.pop(next_to_emit):
+                    if exclude_duplicates and row.get("_duplicate"):
+                        continue
+                    key = row_key(row) if (exclude_duplicates or row.get("_id")) else None
+                    if key is not None:
+                        if key in seen_keys:
+                            continue
+                        seen_keys.add(key)
+                    yield row
+                next_to_emit += 1
+
+            if not within_history(next_to_emit) and not pending:
+                break
+    finally:
+        for task in pending.values():
+            task.cancel()
+
+
+async def stream_csv(rows: AsyncIterator[Dict[str, str]], batch_size: int = 200) -> AsyncIterator[bytes]:
+    """
+    Encode rows as UTF-8 CSV, using the first row's columns as the header
+
+    "_error" rows are collected and written last, as "#error,<message>" lines.
+    """
+    buffer = io.StringIO()
+    writer = None
+    pending_rows = 0
+    errors = []
+
+    async for row in rows:
+        if "_error" in row:
+            errors.append(row["_error"])
+            continue
+        if writer is None:
+            columns = [key for key in row if not key.startswith("_")]
+            writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow(row)
+        pending_rows += 1
+        if pending_rows >= batch_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending_rows = 0
+
+    trailer = csv.writer(buffer)
+    for error in errors:
+        trailer.writerow(["#error", error])
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,44 @@
+"""
+Export job status, shared between workers through the state backend
+
+Every export gets a job id (the same id its debug artifacts are stored
+under). Its status can be read from any worker with GET /jobs/{job_id}.
+"""
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+from state_backend import StateBackend
+
+# How long finished jobs stay queryable
+JOB_TTL_SECONDS = 7 * 24 * 3600
+
+
+class JobStore:
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    async def start(self, job_id: str, kind: str, key_id: str, **details):
+        await self.backend.set_json(self._key(job_id), {
+            "job_id": job_id,
+            "kind": kind,
+            "api_key_id": key_id,
+            "status": "running",
+            "started_at": time.time(),
+            "finished_at": None,
+            "worker_pid": os.getpid(),
+            **details,
+        }, ttl=JOB_TTL_SECONDS)
+
+    async def finish(self, job_id: str, status: str, **details):
+        job = await self.get(job_id) or {"job_id": job_id}
+        job.update(status=status, finished_at=time.time(), **details)
+        await self.backend.set_json(self._key(job_id), job, ttl=JOB_TTL_SECONDS)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.backend.get_json(self._key(job_id))
@@ -0,0 +1,65 @@
+"""
+Reuse of logged-in Linxo sessions
+
+After a successful login the browser context's storage state (cookies and
+local storage) is kept in the shared state backend for
+LINXO_SESSION_TTL_SECONDS. The next export, on any worker, starts its
+context from it and skips the login and 2FA round-trip while Linxo still
+accepts the session. Disabled unless LINXO_SESSION_REUSE=true, since the
+stored state holds session cookies.
+"""
+
+import hashlib
+import logging
+import os
+from typing import Dict, Optional
+
+from state_backend import StateBackend
+
+logger = logging.getLogger(__name__)
+
+
+class LinxoSessionStore:
+    def __init__(self, backend: StateBackend, enabled: bool = False, ttl: float = 1800):
+        self.backend = backend
+        self.enabled = enabled
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls, backend: StateBackend) -> "LinxoSessionStore":
+        return cls(
+            backend,
+            enabled=os.getenv("LINXO_SESSION_REUSE", "false").lower() == "true",
+            ttl=float(os.getenv("LINXO_SESSION_TTL_SECONDS", 1800)),
+        )
+
+    @staticmethod
+    def _key(email: str) -> str:
+        # The key must not reveal the account's email address
+        return "linxo-session:" + hashlib.sha256(email.lower().encode("utf-8")).hexdigest()[:32]
+
+    async def load(self, email: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        return await self.backend.get_json(self._key(email))
+
+    async def save(self, email: str, context):
+        if not self.enabled:
+            return
+        try:
+            await self.backend.set_json(self._key(email), await context.storage_state(), ttl=self.ttl)
+        except Exception as e:
+            logger.warning(f"Could not store Linxo session: {str(e)}")
+
+    async def forget(self, email: str):
+        await self.backend.delete(self._key(email))
+
+
+async def is_logged_in(page, base_url: str) -> bool:
+    """Open the history page and check that Linxo did not send us back to the login page"""
+    await page.goto(f"{base_url}/secured/history.page", timeout=30000)
+    try:
+        await page.wait_for_load_state("networkidle", timeout=10000)
+    except Exception:
+        pass
+    return "auth.page" not in page.url
@@ -0,0 +1,223 @@
+"""
+Shared 2FA mailbox dispatcher
+
+Concurrent exports get their 2FA codes from the same Gmail inbox. Instead of
+every export polling Gmail and taking the first code it finds (possibly
+another session's), one dispatcher polls the mailbox for all of them and
+routes each code to one waiter:
+
+- an export calls expect_code() right before submitting its password, which
+  records its login timestamp, then awaits the ticket once Linxo asks for
+  the code
+- while anyone is waiting, a single poller lists Linxo emails received after
+  the oldest pending login (every GMAIL_POLL_INTERVAL_SECONDS) and reads each
+  new email once
+- emails are handed out oldest first (Gmail internalDate), each to the oldest
+  waiter that logged in before the email arrived (with
+  GMAIL_CODE_CLOCK_SKEW_SECONDS of tolerance); a code is never given twice,
+  and emails older than every pending login are dropped as stale
+
+Gmail load therefore does not grow with the number of waiting exports. The
+dispatcher is per process and does not see logins of other workers. Those
+are kept apart by the single-flight lock (one scrape per Linxo account across
+workers), which /export-csv, /collect, /export-history and export_cli take;
+logins of different accounts sharing one inbox, in different workers, can
+still race for a code.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from gmail_helper import list_verification_emails, read_verification_email
+from gmail_quota import GmailRateLimited
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Tickets taken at login but never awaited (no 2FA was asked) stop counting after this
+UNAWAITED_TICKET_SECONDS = 30
+# Message ids remembered as already read
+MAX_SEEN_MESSAGES = 1000
+
+
+class CodeTicket:
+    """One login waiting for its verification code"""
+
+    def __init__(self, dispatcher: "MailboxDispatcher", ticket_id: int, requested_at: float):
+        self.dispatcher = dispatcher
+        self.ticket_id = ticket_id
+        self.requested_at = requested_at
+        self.registered_at = time.monotonic()
+        self.waiting = False
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def wait(self, timeout: float) -> Optional[str]:
+        """
+        Wait for this login's code
+
+        Returns:
+            str: The 6-digit verification code, or None if none arrived in time
+
+        Raises:
+            GmailRateLimited: Gmail was rate limited until the wait ran out
+        """
+        return await self.dispatcher._wait(self, timeout)
+
+    def close(self):
+        self.dispatcher._remove(self)
+
+
+class MailboxDispatcher:
+    """Polls the 2FA mailbox once for every waiting login and routes codes to them"""
+
+    def __init__(self, poll_interval: float = 5, clock_skew_seconds: float = 5):
+        self.poll_interval = poll_interval
+        self.clock_skew_seconds = clock_skew_seconds
+        self._tickets: List[CodeTicket] = []
+        self._ids = itertools.count(1)
+        # Emails read but not handed out yet
+        self._unclaimed: List[Dict] = []
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._poller: Optional[asyncio.Task] = None
+        self.rate_limited: Optional[GmailRateLimited] = None
+        self.polls = 0
+        self.emails_read = 0
+        self.codes_dispatched = 0
+        self.stale_dropped = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls) -> "MailboxDispatcher":
+        return cls(
+            poll_interval=float(os.getenv("GMAIL_POLL_INTERVAL_SECONDS", 5)),
+            clock_skew_seconds=float(os.getenv("GMAIL_CODE_CLOCK_SKEW_SECONDS", 5)),
+        )
+
+    def expect_code(self, requested_at: Optional[float] = None) -> CodeTicket:
+        """Register a login that may need a code; call right before submitting the password"""
+        ticket = CodeTicket(self, next(self._ids), requested_at or time.time())
+        self._tickets.append(ticket)
+        self._tickets.sort(key=lambda t: t.requested_at)
+        return ticket
+
+    def _remove(self, ticket: CodeTicket):
+        if ticket in self._tickets:
+            self._tickets.remove(ticket)
+
+    def _pending(self) -> List[CodeTicket]:
+        """Tickets that can still receive a code, oldest login first"""
+        now = time.monotonic()
+        for ticket in list(self._tickets):
+            if not ticket.waiting and now - ticket.registered_at > UNAWAITED_TICKET_SECONDS:
+                self._remove(ticket)
+        return [ticket for ticket in self._tickets if not ticket.future.done()]
+
+    async def _wait(self, ticket: CodeTicket, timeout: float) -> Optional[str]:
+        ticket.waiting = True
+        self._dispatch()
+        if self._poller is None or self._poller.done():
+            # The poller serves every waiter: run it in a fresh context rather than this
+            # request's, or its spans would be recorded in this request's run and trace
+            self._poller = asyncio.create_task(self._run(), context=contextvars.Context())
+        try:
+            with span("gmail.wait_verification_code", ticket=ticket.ticket_id, timeout_seconds=timeout) as wait_span:
+                polls_before = self.polls
+                try:
+                    code = await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    wait_span.set_attributes({"code.found": False, "gmail.polls": self.polls - polls_before})
+                    if self.rate_limited is not None:
+                        raise self.rate_limited
+                    return None
+                wait_span.set_attributes({"code.found": True, "gmail.polls": self.polls - polls_before})
+                return code
+        finally:
+            self._remove(ticket)
+
+    async def _run(self):
+        """Poll while any login waits for a code"""
+        while self._pending():
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"Error polling the verification mailbox: {str(e)}")
+            self._dispatch()
+            if not self._pending():
+                break
+            await asyncio.sleep(self.rate_limited.retry_after if self.rate_limited else self.poll_interval)
+
+    async def poll_once(self):
+        """List recent Linxo emails and read the ones not seen yet"""
+        pending = self._pending()
+        if not pending:
+            return
+        self.polls += 1
+        after = min(ticket.requested_at for ticket in pending) - self.clock_skew_seconds
+        deadline = time.monotonic() + self.poll_interval * 2
+        with span("gmail.poll_mailbox", waiters=len(pending)) as poll_span:
+            try:
+                message_ids = await asyncio.to_thread(list_verification_emails, after, deadline)
+                new_ids = [message_id for message_id in message_ids if message_id not in self._seen]
+                poll_span.set_attribute("gmail.new_messages", len(new_ids))
+                # Oldest first, so emails are dispatched in arrival order
+                for message_id in reversed(new_ids):
+                    email = await asyncio.to_thread(read_verification_email, message_id, deadline)
+                    self._mark_seen(message_id)
+                    self.emails_read += 1
+                    if email["code"]:
+                        self._unclaimed.append(email)
+                    else:
+                        logger.info(f"No verification code found in email {message_id}")
+            except GmailRateLimited as e:
+                self.rate_limited = e
+                poll_span.set_attribute("gmail.rate_limited", True)
+                logger.warning(f"{str(e)}, waiting before polling the mailbox again...")
+                return
+        self.rate_limited = None
+
+    def _mark_seen(self, message_id: str):
+        self._seen[message_id] = None
+        while len(self._seen) > MAX_SEEN_MESSAGES:
+            self._seen.popitem(last=False)
+
+    def _dispatch(self):
+        """Hand unclaimed codes, oldest email first, to the oldest login that precedes each email"""
+        pending = self._pending()
+        skew_ms = self.clock_skew_seconds * 1000
+        self._unclaimed.sort(key=lambda email: email["internal_date_ms"])
+        for email in list(self._unclaimed):
+            if not pending:
+                break
+            ticket = next((t for t in pending if t.requested_at * 1000 - skew_ms <= email["internal_date_ms"]), None)
+            self._unclaimed.remove(email)
+            if ticket is None:
+                # Sent before every pending login: a previous session's code
+                self.stale_dropped += 1
+                continue
+            pending.remove(ticket)
+            ticket.future.set_result(email["code"])
+            self.codes_dispatched += 1
+            logger.info(f"Routed verification code from email {email['id']} ({email['date']}) to login {ticket.ticket_id}")
+
+    def stats(self):
+        return {
+            "waiting": sum(1 for ticket in self._tickets if ticket.waiting),
+            "expected": len(self._tickets),
+            "unclaimed_codes": len(self._unclaimed),
+            "polls": self.polls,
+            "emails_read": self.emails_read,
+            "codes_dispatched": self.codes_dispatched,
+            "stale_dropped": self.stale_dropped,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited is not None,
+        }
+
+
+mailbox_dispatcher = MailboxDispatcher.from_env()
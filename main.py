@@ -1,18 +1,48 @@
-from fastapi import FastAPI, HTTPException, status, Security, Depends
-from fastapi.responses import StreamingResponse, JSONResponse, RedirectResponse
+import time
+_import_start = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, status, Depends, Query
+from fastapi.responses import StreamingResponse, JSONResponse, RedirectResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import APIKeyHeader
+from contextlib import AsyncExitStack, asynccontextmanager
 import os
 import logging
 import asyncio
 import platform
+import anyio
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
-import tempfile
 import io
-import httpx
 from typing import Dict, Any, Optional, Tuple
-from gmail_helper import get_linxo_verification_code, verify_gmail_access
+from dataclasses import asdict
+# Playwright, httpx and the Google API client are imported lazily where they are used
+from gmail_helper import get_gmail_service
+from gmail_quota import gmail_quota
+from mailbox_dispatcher import mailbox_dispatcher
+from browser_pool import browser_pool
+from browser_supervisor import browser_supervisor
+from artifacts import ArtifactRecorder, artifact_recorder, artifact_store
+from export_engine import (
+    EXPORT_LOCK_WAIT_SECONDS, apply_filters, check_gmail_available, collect_linxo, deadline_exceeded_error,
+    linxo_scrape_lock, login_to_linxo, require_linxo_credentials, scrape_linxo_csv, send_csv_to_webhook,
+    setup_playwright, teardown_playwright
+)
+from history_extractor import iter_history_rows, stream_csv
+from export_filters import ExportFilters, export_filters
+from export_formats import ExportFormat, export_format
+from transactions import decode_csv, parse_csv
+from collectors import SECTIONS, parse_sections
+from change_detection import ContentHashes, DeliveryState, content_hashes
+from profiling import PROFILE_MODES, Profile, ProfileBusy, export_profile, loop_monitor
+from rollups import rollup_store
+from run_history import RunRecorder, run_history, run_recorder
+from snapshots import parse_since, snapshot_store
+from state_backend import LockNotAcquired, get_state_backend, close_state_backend
+from jobs import JobStore
+from outbox import DeliveryOutbox
+from admission import AdmissionController, RateLimiter
+from auth import require_scope
+from settings import ApiKey, get_settings, install_reload_signal_handler
+from tracing import setup_tracing, shutdown_tracing, instrument_app, span, current_span
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,34 +59,128 @@ if os.getenv('DEBUG', 'false').lower() == 'true':
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# API Key Security
-API_KEY_NAME = "X-API-Key"
-api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
+# Configure tracing (no-op unless OTEL_TRACES_EXPORTER is set)
+setup_tracing()
 
-async def verify_api_key(api_key: str = Security(api_key_header)):
-    """Verify the API key from the request header"""
-    expected_api_key = os.getenv("API_KEY")
-    
-    if not expected_api_key:
-        logger.error("API_KEY not configured in environment variables")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="API authentication not properly configured"
-        )
-    
-    if api_key != expected_api_key:
-        logger.warning(f"Invalid API key attempt: {api_key[:8]}...")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key"
-        )
-    
+IMPORT_SECONDS = time.perf_counter() - _import_start
+logger.info(f"Application modules imported in {IMPORT_SECONDS * 1000:.0f} ms")
+
+# Startup warm-up state, reported by /ready
+readiness: Dict[str, Any] = {
+    "ready": False,
+    "import_seconds": round(IMPORT_SECONDS, 3),
+    "warmup_seconds": None,
+    "browser": "pending",
+    "gmail": "pending",
+}
+
+async def warm_up():
+    """Pre-launch the shared browser and build the Gmail client off the request path"""
+    start_time = time.perf_counter()
+
+    async def warm_browser():
+        try:
+            await browser_pool.warm_up()
+            readiness["browser"] = "ok"
+        except Exception as e:
+            readiness["browser"] = f"error: {str(e)}"
+            logger.error(f"Browser warm-up failed: {str(e)}")
+
+    async def warm_gmail():
+        if not os.getenv("GMAIL_TOKEN_JSON") and not os.path.exists("token.json"):
+            # Never start the interactive OAuth flow during start-up
+            readiness["gmail"] = "not configured"
+            return
+        try:
+            await asyncio.to_thread(get_gmail_service)
+            readiness["gmail"] = "ok"
+        except Exception as e:
+            # Gmail is optional (only needed for 2FA), so this does not block readiness
+            readiness["gmail"] = f"unavailable: {str(e)}"
+            logger.warning(f"Gmail warm-up failed: {str(e)}")
+
+    await asyncio.gather(warm_browser(), warm_gmail())
+    readiness["warmup_seconds"] = round(time.perf_counter() - start_time, 3)
+    readiness["ready"] = readiness["browser"] == "ok"
+    logger.info(f"Warm-up finished in {readiness['warmup_seconds']}s (ready: {readiness['ready']})")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load settings, start warm-up in the background, and clean up on shutdown"""
+    settings = get_settings()
+    logger.info(f"Settings loaded: {len(settings.api_keys)} API key(s) configured")
+    if install_reload_signal_handler(asyncio.get_running_loop()):
+        logger.info("Send SIGHUP to reload configuration and API keys")
+
+    warmup_task = None
+    prewarm = os.getenv("PREWARM", "true").lower() == "true"
+    if prewarm:
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        readiness.update(ready=True, browser="lazy", gmail="lazy")
+    # Deadlines, zombie reaping, crash relaunch and recycling of the shared browser
+    browser_supervisor.start_watchdog(keep_warm=prewarm)
+    # Retry failed webhook deliveries
+    delivery_outbox.start()
+    # Report event loop stalls with the stack that blocked it
+    loop_monitor.start()
+
+    yield
+
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    await loop_monitor.stop()
+    await delivery_outbox.stop()
+    await browser_supervisor.stop()
+    await browser_pool.stop()
+    await close_state_backend()
+    # Flush pending spans before the process exits
+    shutdown_tracing()
+
+# Admission control: cap concurrent scrapes and rate-limit each API key
+export_admission = AdmissionController.from_env()
+export_rate_limiter = RateLimiter.from_env()
+
+# State shared between workers/replicas (STATE_BACKEND: memory, sqlite or redis)
+state = get_state_backend()
+delivery_state = DeliveryState(state)
+jobs = JobStore(state)
+EXPORT_CACHE_TTL_SECONDS = float(os.getenv("EXPORT_CACHE_TTL_SECONDS", 60))
+
+def scrape_busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Another export of this Linxo account is still running, retry later",
+        headers={"Retry-After": str(int(EXPORT_LOCK_WAIT_SECONDS) or 30)}
+    )
+
+async def redeliver_csv(csv_utf8: bytes) -> Tuple[bool, Optional[str]]:
+    webhook_url = get_settings().n8n_webhook_url
+    if not webhook_url:
+        return False, "N8N_WEBHOOK_URL not configured"
+    return await send_csv_to_webhook(webhook_url, csv_utf8)
+
+async def record_redelivery(metadata: Dict[str, Any]):
+    # Runs under the scope's delivery lock, held by the outbox while it retries
+    await delivery_state.record(metadata["scope"], ContentHashes(**metadata["hashes"]), metadata.get("produced_at"))
+
+delivery_outbox = DeliveryOutbox.from_env(state, redeliver_csv, record_redelivery)
+
+async def rate_limit_export(api_key: ApiKey = Depends(require_scope("export"))) -> ApiKey:
+    """Consume one export token for the caller's API key"""
+    export_rate_limiter.check(api_key.key_id)
     return api_key
 
+async def admit_export(api_key: ApiKey = Depends(rate_limit_export)):
+    """Rate-limit the caller and hold an export slot until the request completes"""
+    async with export_admission.slot():
+        yield api_key
+
 app = FastAPI(
     title="Linxo CSV Exporter",
     description="API to export transaction data from Linxo to CSV",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -68,6 +192,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+instrument_app(app)
+
 @app.get("/", include_in_schema=False)
 async def root():
     """Redirect to API documentation"""
@@ -75,20 +201,32 @@ async def root():
 
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def health():
-    """Health check endpoint"""
+    """Liveness check: the process is up and serving requests"""
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: warm-up finished and the browser is available"""
+    content = dict(readiness, browser_pool=browser_pool.stats())
+    # A browser relaunched by a later export also makes the service ready
+    if not (readiness["ready"] or browser_pool.is_running):
+        state = "starting" if readiness["warmup_seconds"] is None else "not_ready"
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=dict(content, status=state))
+    return dict(content, status="ready")
+
 @app.get("/debug/env")
-async def debug_env(api_key: str = Depends(verify_api_key)):
-    """Debug endpoint to check environment variables (requires API key)"""
+async def debug_env(api_key: ApiKey = Depends(require_scope("admin"))):
+    """Debug endpoint to check environment variables (requires admin API key)"""
+    settings = get_settings()
     gmail_token = os.getenv("GMAIL_TOKEN_JSON", "")
     # Show first 10 chars as ASCII codes to debug encoding issues
     first_10_ascii = [ord(c) for c in gmail_token[:10]] if gmail_token else []
     return {
-        "LINXO_EMAIL": "set" if os.getenv("LINXO_EMAIL") else "missing",
-        "LINXO_PASSWORD": "set" if os.getenv("LINXO_PASSWORD") else "missing",
-        "API_KEY": "set" if os.getenv("API_KEY") else "missing",
-        "N8N_WEBHOOK_URL": "set" if os.getenv("N8N_WEBHOOK_URL") else "missing",
+        "LINXO_EMAIL": "set" if settings.linxo_email else "missing",
+        "LINXO_PASSWORD": "set" if settings.linxo_password else "missing",
+        "API_KEYS": [{"id": key.key_id, "scopes": sorted(key.scopes)} for key in settings.api_keys],
+        "N8N_WEBHOOK_URL": "set" if settings.n8n_webhook_url else "missing",
+        "configuration_problems": list(settings.problems),
         "GMAIL_TOKEN_JSON": "set" if gmail_token else "missing",
         "GMAIL_TOKEN_JSON_length": len(gmail_token),
         "GMAIL_TOKEN_JSON_first_50": gmail_token[:50] if gmail_token else "N/A",
@@ -97,636 +235,528 @@ async def debug_env(api_key: str = Depends(verify_api_key)):
         "token_json_file_exists": os.path.exists("token.json")
     }
 
-async def setup_playwright():
-    """Setup Playwright browser and context"""
+@app.get("/debug/browser")
+async def debug_browser(api_key: ApiKey = Depends(require_scope("admin"))):
+    """Browser supervisor state: live processes, sessions, restarts and kills (requires admin API key)"""
+    return browser_supervisor.stats()
+
+@app.get("/debug/gmail")
+async def debug_gmail(api_key: ApiKey = Depends(require_scope("admin"))):
+    """Gmail API quota usage and 2FA mailbox dispatcher counters (requires admin API key)"""
+    return dict(gmail_quota.stats(), mailbox=mailbox_dispatcher.stats())
+
+@app.get("/debug/loop-lag")
+async def debug_loop_lag(api_key: ApiKey = Depends(require_scope("admin"))):
+    """Event loop lag and recent stalls with the stack that blocked the loop (requires admin API key)"""
+    return loop_monitor.stats()
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = Query(10, gt=0, le=120, description="How long to profile"),
+    mode: str = Query("sample", pattern=f"^({'|'.join(PROFILE_MODES)})$",
+                      description="sample: folded stacks of all threads; cprofile: pstats of the event loop thread"),
+    api_key: ApiKey = Depends(require_scope("admin"))
+):
+    """Profile the live process for a number of seconds and download the result (requires admin API key)"""
+    profile = Profile(mode)
     try:
-        logger.info("Initializing Playwright...")
-        playwright = await async_playwright().start()
-        logger.info("Launching browser...")
-        # Set headless=False to see the browser (for debugging)
-        browser = await playwright.chromium.launch(headless=True, args=[
-            '--disable-blink-features=AutomationControlled',
-            '--disable-infobars',
-            '--window-size=1920,1080'
-        ])
-        logger.info("Creating new context...")
-        context = await browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.81 Safari/537.36',
-            java_script_enabled=True
-        )
-        logger.info("Creating new page...")
-        page = await context.new_page()
-        return playwright, browser, context, page
-    except Exception as e:
-        logger.error(f"Error setting up Playwright: {str(e)}", exc_info=True)
-        raise
+        profile.start()
+    except ProfileBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        data = profile.stop()
+    media_type = "text/plain; charset=utf-8" if mode == "sample" else "application/octet-stream"
+    return Response(content=data, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{profile.file_name}"'})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, api_key: ApiKey = Depends(require_scope("query"))):
+    """Status of an export job, from any worker (requires query API key)"""
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown job")
+    return job
+
+@app.get("/exports/diff")
+async def diff_exports(
+    since: str = Query(..., description="Export id (job_id of an earlier export), Unix timestamp or ISO 8601 date/time"),
+    filters: ExportFilters = Depends(export_filters),
+    api_key: ApiKey = Depends(require_scope("query"))
+):
+    """
+    Transactions added, removed or modified between an earlier export and the
+    latest one (requires query API key).
+
+    `since` is an export's job_id, or a time: the newest export taken at or
+    before it is used, among exports with the same filters as this request.
+    """
+    base = await asyncio.to_thread(snapshot_store.get, since)
+    if base is None:
+        since_ts = parse_since(since)
+        if since_ts is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown export id")
+        base = await asyncio.to_thread(snapshot_store.latest, filters.scope, since_ts)
+        if base is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="No export with these filters at or before 'since'")
+    latest = await asyncio.to_thread(snapshot_store.latest, base["scope"])
+    with span("snapshot.diff", since=base["export_id"], until=latest["export_id"]) as diff_span:
+        diff = await asyncio.to_thread(snapshot_store.diff, base, latest)
+        diff_span.set_attributes(diff["counts"])
+    return {
+        "scope": base["scope"],
+        "since": {"export_id": base["export_id"], "created_at": base["created_at"], "row_count": base["row_count"]},
+        "until": {"export_id": latest["export_id"], "created_at": latest["created_at"], "row_count": latest["row_count"]},
+        **diff,
+    }
 
-async def teardown_playwright(playwright, browser, context):
-    """Clean up Playwright resources"""
-    if context:
-        await context.close()
-    if browser:
-        await browser.close()
-    if playwright:
-        await playwright.stop()
+@app.get("/summary")
+async def get_summary(
+    filters: ExportFilters = Depends(export_filters),
+    api_key: ApiKey = Depends(require_scope("query"))
+):
+    """
+    Transactions, income, spend and net flow per month, per month and category
+    and per month and account, as of the latest export with the same filters as
+    this request (requires query API key).
+    """
+    summary = await asyncio.to_thread(rollup_store.summary, filters.scope)
+    if summary is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No export with these filters yet")
+    return summary
+
+@app.get("/runs/stats")
+async def get_run_stats(
+    kind: str = Query("export-csv", description="Run kind"),
+    window_hours: Optional[float] = Query(None, gt=0, description="Recent window compared with the baseline (default: RUNS_WINDOW_HOURS)"),
+    api_key: ApiKey = Depends(require_scope("admin"))
+):
+    """
+    Rolling p50/p95/p99/max per stage over the recent window and the baseline
+    days before it, outcomes, selector fallbacks, Gmail polls and CSV sizes,
+    and the stages whose p95 regressed (requires admin API key).
+    """
+    return await asyncio.to_thread(run_history.stats, kind, window_hours)
+
+@app.get("/artifacts")
+async def list_artifacts(api_key: ApiKey = Depends(require_scope("admin"))):
+    """Stored debug artifact jobs, newest first (requires admin API key)"""
+    return {"jobs": await asyncio.to_thread(artifact_store.list_jobs)}
+
+@app.get("/artifacts/{job_id}")
+async def get_artifact_job(job_id: str, api_key: ApiKey = Depends(require_scope("admin"))):
+    """Files captured for one export job (requires admin API key)"""
+    job = await asyncio.to_thread(artifact_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown artifact job")
+    return job
+
+@app.get("/artifacts/{job_id}/{name}")
+async def get_artifact_file(job_id: str, name: str, api_key: ApiKey = Depends(require_scope("admin"))):
+    """Download one debug artifact (requires admin API key)"""
+    path = artifact_store.file_path(job_id, name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown artifact")
+    return FileResponse(path, filename=name)
 
 @app.get("/export-csv", response_description="CSV file with transaction data")
-async def export_linxo_csv(api_key: str = Depends(verify_api_key)) -> JSONResponse:
-    """Export transaction data from Linxo to CSV"""
-    # Get credentials from environment
-    email = os.getenv("LINXO_EMAIL")
-    password = os.getenv("LINXO_PASSWORD")
-    webhook_url = os.getenv("N8N_WEBHOOK_URL")
-    
-    if not email or not password:
-        error_msg = "Missing Linxo credentials in environment variables"
-        logger.error(error_msg)
-        logger.error(f"Email present: {'yes' if email else 'no'}, Password present: {'yes' if password else 'no'}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=error_msg
-        )
-
-    # Check Gmail availability (optional for the service to work)
-    gmail_available = await asyncio.to_thread(verify_gmail_access)
-    if not gmail_available:
-        logger.warning("Gmail API not available. If Linxo requires 2FA, the export may fail.")
+async def export_linxo_csv(
+    # Resolved first: requests rejected by auth, rate limiting or admission are not
+    # recorded as runs, and the recorded run and profile do not include the queue wait
+    api_key: ApiKey = Depends(admit_export),
+    filters: ExportFilters = Depends(export_filters),
+    output: ExportFormat = Depends(export_format),
+    force: bool = Query(False, description="Deliver even if the transactions did not change since the last run"),
+    artifacts: ArtifactRecorder = Depends(artifact_recorder),
+    profile: Optional[Profile] = Depends(export_profile),
+    run: RunRecorder = Depends(run_recorder("export-csv"))
+):
+    """
+    Export transaction data from Linxo to CSV.
+
+    Optional filters: `from`/`to` (YYYY-MM-DD), `account_id`, `category` and
+    `exclude_duplicates`. Filters Linxo's search supports are applied on its
+    side; all of them are applied again on the downloaded CSV.
+
+    Returns a JSON status by default. With `format=csv|ndjson|parquet` (or the
+    matching Accept header) the transactions are streamed back instead,
+    compressed with zstd or gzip when the client accepts it.
+
+    When the transactions are identical to the last delivered export (same
+    filters), the webhook send and the local file write are skipped and the
+    response reports `changed: false`. Use `force=true` to deliver anyway
+    (this also bypasses the short-lived result cache).
+
+    Stage timings are recorded in the run history (GET /runs/stats); the
+    response lists the stages currently regressed against their baseline.
+    """
+    # Credentials are loaded once at startup (and on SIGHUP)
+    settings = require_linxo_credentials()
+    email = settings.linxo_email
+    webhook_url = settings.n8n_webhook_url
+
+    gmail_available = await check_gmail_available()
         
     logger.info("Starting export process")
 
-    playwright = None
-    browser = None
-    context = None
-    page = None
-    csv_content = None
-    
+    # One scrape at a time per Linxo account across all workers and replicas;
+    # a request that waited for another scrape reuses its result from the cache
+    cache_key = f"export-cache:{filters.scope}"
+    from_cache = False
+    await jobs.start(artifacts.job_id, "export-csv", api_key.key_id, filters=filters.scope)
     try:
-        logger.info("Starting Playwright browser")
-        playwright, browser, context, page = await setup_playwright()
-        
-        # Login
-        logger.info("Navigating to Linxo login page")
-        await page.goto("https://wwws.linxo.com/auth.page#Login", timeout=60000)
-        
-        # Take a screenshot of the current page for debugging
-        await page.screenshot(path='login_page.png')
-        
-        # Wait for and fill login form
-        logger.info("Waiting for login form...")
-        try:
-            # Try multiple possible selectors for the email field
-            email_selectors = [
-                'input[name="username"]',
-                'input[data-cy="email-input"]',
-                'input[type="email"]',
-                'input[type="text"][name="username"]',
-                'input[name*="mail"]',
-                'input[id*="mail"]',
-                'input[placeholder*="mail"]',
-                'input[autocomplete*="mail"]'
-            ]
-            
-            # Wait for any of the possible email fields
-            logger.info("Looking for email field...")
-            email_field = None
-            for selector in email_selectors:
-                try:
-                    email_field = await page.wait_for_selector(selector, state='visible', timeout=3000)
-                    if email_field:
-                        logger.info(f"Found email field with selector: {selector}")
-                        break
-                except:
-                    continue
-            
-            if not email_field:
-                error_msg = "Could not find email field on Linxo login page"
-                logger.error(error_msg)
-                await page.screenshot(path='email_field_not_found.png')
-                await teardown_playwright(playwright, browser, context)
-                return JSONResponse(
-                    status_code=503,
-                    content={
-                        "message": "Export failed",
-                        "error": f"{error_msg}. The Linxo website structure may have changed."
-                    }
-                )
-            
-            # Fill in the email
-            logger.info("Filling email...")
-            await email_field.fill(email)
-            
-            # Click on the email field again to activate the submit button
-            logger.info("Clicking email field to activate submit button...")
-            await email_field.click()
-            await page.wait_for_timeout(500)  # Small delay to let the button activate
-            
-            # Try to find and click the continue button
-            logger.info("Looking for continue button...")
-            button_selectors = [
-                'button[data-cy="submit-button"]',
-                'button[type="submit"]',
-                'button:has-text("Continuer")',
-                'button:has-text("Continue")'
-            ]
-            
-            clicked = False
-            for selector in button_selectors:
-                try:
-                    button = await page.wait_for_selector(selector, timeout=2000)
-                    if button:
-                        logger.info(f"Clicking button with selector: {selector}")
-                        await button.click()
-                        clicked = True
-                        break
-                except:
-                    continue
-            
-            if not clicked:
-                logger.warning("Could not find continue button, trying to press Enter...")
-                await page.keyboard.press('Enter')
-            
-            # Wait for password field with multiple possible selectors
-            logger.info("Waiting for password field...")
-            password_selectors = [
-                'input[name="password"]',
-                'input[type="password"]',
-                'input[data-cy="password-input"]',
-                'input[name*="pass"]',
-                'input[id*="pass"]'
-            ]
-            
-            password_field = None
-            for selector in password_selectors:
-                try:
-                    password_field = await page.wait_for_selector(selector, state='visible', timeout=5000)
-                    if password_field:
-                        logger.info(f"Found password field with selector: {selector}")
-                        break
-                except:
-                    continue
-            
-            if not password_field:
-                error_msg = "Could not find password field on Linxo login page"
-                logger.error(error_msg)
-                await page.screenshot(path='password_field_not_found.png')
-                await teardown_playwright(playwright, browser, context)
-                return JSONResponse(
-                    status_code=503,
-                    content={
-                        "message": "Export failed",
-                        "error": f"{error_msg}. The Linxo website structure may have changed or login failed."
-                    }
-                )
-            
-            # Fill in the password
-            logger.info("Filling password...")
-            await password_field.fill(password)
-            
-            # Click on the password field again to activate the submit button
-            logger.info("Clicking password field to activate submit button...")
-            await password_field.click()
-            await page.wait_for_timeout(500)  # Small delay to let the button activate
-            
-            # Click the login button
-            logger.info("Clicking login...")
-            login_clicked = False
-            for selector in button_selectors:
-                try:
-                    login_button = await page.wait_for_selector(selector, timeout=2000)
-                    if login_button:
-                        logger.info(f"Clicking login button with selector: {selector}")
-                        await login_button.click()
-                        login_clicked = True
-                        break
-                except:
-                    continue
-            
-            if not login_clicked:
-                logger.warning("Could not find login button, trying to press Enter...")
-                await page.keyboard.press('Enter')
-            
-            # Wait for successful login or verification code page
-            logger.info("Waiting for login to complete...")
-            try:
-                # Wait a bit to see if we're redirected to secured page or verification page
-                await page.wait_for_timeout(3000)
-                
-                current_url = page.url
-                logger.info(f"Current URL after login: {current_url}")
-                
-                # Check if we need to enter verification code
-                if "auth.page" in current_url or await page.query_selector('input[type="text"][maxlength="1"]'):
-                    logger.info("Verification code required, fetching from Gmail...")
-                    
-                    # Take a screenshot
-                    await page.screenshot(path='verification_page.png')
-                    
-                    if not gmail_available:
-                        error_msg = "Verification code required but Gmail API is not available. Please ensure GMAIL_TOKEN_JSON is valid or regenerate the token."
-                        logger.error(error_msg)
-                        await teardown_playwright(playwright, browser, context)
-                        return JSONResponse(
-                            status_code=503,
-                            content={
-                                "message": "Export failed",
-                                "error": error_msg,
-                                "gmail_required": True
-                            }
-                        )
-                    
-                    # Fetch verification code from Gmail
-                    verification_code = await asyncio.to_thread(get_linxo_verification_code, 60)
-                    
-                    if not verification_code:
-                        error_msg = "Could not retrieve verification code from Gmail within 60 seconds"
-                        logger.error(error_msg)
-                        await page.screenshot(path='verification_timeout.png')
-                        await teardown_playwright(playwright, browser, context)
-                        return JSONResponse(
-                            status_code=504,
-                            content={
-                                "message": "Export failed",
-                                "error": f"{error_msg}. Please check if Linxo sent the verification email.",
-                                "gmail_issue": True
-                            }
-                        )
-                    
-                    logger.info(f"Retrieved verification code: {verification_code}")
-                    
-                    # Enter the verification code (6 digits in separate input fields)
-                    code_inputs = await page.query_selector_all('input[type="text"][maxlength="1"]')
-
-                    if len(code_inputs) == 6:
-                        logger.info(f"Found 6 input fields, entering verification code: {verification_code}")
-                        for i, digit in enumerate(verification_code):
-                            logger.info(f"Filling digit {i+1}: {digit}")
-
-                            # Wait for the input field to be ready and focus it
-                            await code_inputs[i].wait_for_element_state('visible')
-                            await code_inputs[i].wait_for_element_state('enabled')
-                            await code_inputs[i].scroll_into_view_if_needed()
-
-                            # Click and clear the field first
-                            await code_inputs[i].click()
-                            await code_inputs[i].fill('')
-
-                            # Type the digit with a small delay
-                            await code_inputs[i].type(digit, delay=100)
-
-                            # Verify the digit was entered
-                            value = await code_inputs[i].input_value()
-                            logger.info(f"Digit {i+1} entered: {value}")
-
-                        # Wait for all digits to be processed
-                        await page.wait_for_timeout(2000)
-
-                        # Try to trigger form validation by tabbing through fields
-                        for i in range(5):  # Tab through first 5 fields
-                            await code_inputs[i].press('Tab')
-                            await page.wait_for_timeout(200)
-
-                        # Click outside to trigger any validation
-                        await page.click('body')
-                        await page.wait_for_timeout(1000)
-                    else:
-                        logger.info(f"Found {len(code_inputs)} input fields, trying alternative approach")
-
-                        # Try different selectors for verification code input
-                        alternative_selectors = [
-                            'input[name="code"]',
-                            'input[id*="code"]',
-                            'input[placeholder*="code"]',
-                            'input[type="text"]:not([name="username"]):not([name="password"])'
-                        ]
-
-                        code_entered = False
-                        for selector in alternative_selectors:
-                            try:
-                                logger.info(f"Trying selector: {selector}")
-                                code_input = await page.query_selector(selector)
-                                if code_input:
-                                    await code_input.wait_for_element_state('visible')
-                                    await code_input.wait_for_element_state('enabled')
-                                    await code_input.scroll_into_view_if_needed()
-                                    await code_input.click()
-                                    await code_input.fill('')
-                                    await code_input.type(verification_code, delay=100)
-
-                                    value = await code_input.input_value()
-                                    logger.info(f"Code entered with {selector}: {value}")
-                                    code_entered = True
-                                    break
-                            except Exception as e:
-                                logger.warning(f"Selector {selector} failed: {str(e)}")
-                                continue
-
-                        if not code_entered:
-                            error_msg = "Could not find verification code input field on page"
-                            logger.error(error_msg)
-                            await page.screenshot(path='verification_fields_not_found.png')
-                            raise HTTPException(
-                                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                                detail=f"{error_msg}. The Linxo website structure may have changed."
-                            )
-                    
-                    # Click validate button
-                    logger.info("Looking for validation button...")
-                    validate_selectors = [
-                        'button:has-text("Valider")',
-                        'button:has-text("Validate")',
-                        'button[type="submit"]',
-                        'button[data-cy="submit-button"]',
-                        'input[type="submit"]',
-                        'button[class*="validate"]',
-                        'button[class*="submit"]'
-                    ]
-
-                    validate_clicked = False
-                    for selector in validate_selectors:
-                        try:
-                            logger.info(f"Trying validate button selector: {selector}")
-                            validate_button = await page.wait_for_selector(selector, timeout=5000, state='visible')
-                            if validate_button:
-                                logger.info(f"Found validate button with selector: {selector}")
-
-                                # Scroll into view and click
-                                await validate_button.scroll_into_view_if_needed()
-                                await validate_button.click()
-
-                                validate_clicked = True
-                                logger.info("Validate button clicked successfully")
-
-                                # Wait for the click to process
-                                await page.wait_for_timeout(2000)
-                                break
-                        except Exception as e:
-                            logger.warning(f"Validate button selector {selector} failed: {str(e)}")
-                            continue
-
-                    if not validate_clicked:
-                        logger.warning("No validate button found with standard selectors, trying Enter key...")
-                        # Try pressing Enter on the last code input field
-                        if len(code_inputs) == 6:
-                            await code_inputs[5].press('Enter')
-                        else:
-                            await page.keyboard.press('Enter')
-                        await page.wait_for_timeout(2000)
-                    
-                    # Wait for redirect after validation
-                    logger.info("Waiting for redirect after code validation...")
-
-                    try:
-                        # Wait for URL change with longer timeout
-                        await page.wait_for_url("**/secured/**", timeout=45000)
-                        logger.info("Successfully validated verification code - URL redirected")
-                    except Exception as url_timeout:
-                        logger.warning(f"URL redirect timeout: {str(url_timeout)}")
-
-                        # Check current URL to see where we are
-                        current_url = page.url
-                        logger.info(f"Current URL after validation attempt: {current_url}")
-
-                        # Check if we're already on a secured page (maybe the pattern is different)
-                        if "linxo.com" in current_url and ("secured" in current_url or "overview" in current_url or "history" in current_url):
-                            logger.info("Detected secured page with different URL pattern")
-                        else:
-                            # Check for error messages on the verification page
-                            error_selectors = [
-                                '.error-message', '.alert-danger', '.invalid-feedback',
-                                '.text-danger', '[class*="error"]', '[class*="invalid"]'
-                            ]
-
-                            for selector in error_selectors:
-                                try:
-                                    error_element = await page.query_selector(selector)
-                                    if error_element:
-                                        error_text = await error_element.inner_text()
-                                        logger.error(f"Verification error: {error_text}")
-                                        break
-                                except:
-                                    continue
-
-                            # Take screenshot of the verification result
-                            await page.screenshot(path='verification_result.png')
-                            logger.info("Screenshot saved to verification_result.png")
-
-                            raise HTTPException(
-                                status_code=status.HTTP_401_UNAUTHORIZED,
-                                detail=f"Verification code validation failed. Still on verification page. Current URL: {current_url}"
-                            )
-                else:
-                    # Already on secured page
-                    logger.info("Successfully logged in without verification code")
-
-            except Exception as e:
-                logger.error(f"Error during login: {str(e)}")
-                # Check if there's an error message on the page
-                error_message = await page.query_selector('.error-message, .alert, .error, .error-text, .notification--error, .invalid-feedback')
-                if error_message:
-                    error_text = await error_message.inner_text()
-                    logger.error(f"Login error message: {error_text}")
-                else:
-                    logger.error("No error message found on page")
-
-                # Take a screenshot for debugging
-                await page.screenshot(path='login_error.png')
-                logger.error("Screenshot saved to login_error.png for debugging")
-                raise
-                    
-        except PlaywrightTimeoutError as e:
-            logger.error(f"Login timeout or element not found: {str(e)}")
-            # Take a screenshot for debugging
-            await page.screenshot(path='login_timeout.png')
-            raise HTTPException(
-                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                detail="Timeout while trying to log in to Linxo. The login form might have changed or the service is unavailable."
-            )
-        
-        # Navigate to transaction history
-        logger.info("Navigating to transaction history")
-        await page.goto("https://wwws.linxo.com/secured/history.page#Search;pageNumber=0;excludeDuplicates=false", timeout=30000)
-        
-        try:
-            # Wait for the page to load
-            logger.info("Waiting for transaction history page to load...")
-            await page.wait_for_load_state("networkidle", timeout=10000)
-            
-            # Take a screenshot for debugging
-            await page.screenshot(path='history_page.png')
-            
-            # Wait for and click CSV export button
-            logger.info("Looking for CSV export button...")
-            csv_button_selectors = [
-                'button:has-text("CSV")',
-                'button[type="button"]:has-text("CSV")',
-                '.GJALL4ABCV.GJALL4ABLW',
-                'button.GJALL4ABCV'
-            ]
-            
-            csv_button = None
-            for selector in csv_button_selectors:
-                try:
-                    csv_button = await page.wait_for_selector(selector, state='visible', timeout=5000)
-                    if csv_button:
-                        logger.info(f"Found CSV button with selector: {selector}")
-                        break
-                except:
-                    continue
-            
-            if not csv_button:
-                error_msg = "Could not find CSV export button on transaction history page"
-                logger.error(error_msg)
-                await page.screenshot(path='csv_button_not_found.png')
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail=f"{error_msg}. The Linxo website structure may have changed."
-                )
-            
-            # Click the CSV export button and wait for download
-            logger.info("Clicking CSV export button...")
-            async with page.expect_download(timeout=30000) as download_info:
-                await csv_button.click()
-            
-            # Save the downloaded file
-            logger.info("Saving downloaded CSV file...")
-            download = await download_info.value
-            with tempfile.TemporaryDirectory() as tmpdir:
-                file_path = os.path.join(tmpdir, "linxo_transactions.csv")
-                await download.save_as(file_path)
-                
-                # Read the file content
-                with open(file_path, "rb") as f:
-                    csv_content = f.read()
-            
-            logger.info("CSV file downloaded successfully")
-    
-        except PlaywrightTimeoutError as e:
-            logger.error(f"Export timeout or element not found: {str(e)}")
-            raise HTTPException(
-                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                detail="Timeout while trying to export transactions. The page structure might have changed."
-            )
-        
-    except PlaywrightError as e:
-        error_msg = f"Playwright error: {str(e)}"
-        logger.error(error_msg, exc_info=True)
-        
-        # Take a screenshot if page is available
-        if page:
-            try:
-                screenshot = await page.screenshot()
-                screenshot_path = "error_screenshot.png"
-                with open(screenshot_path, "wb") as f:
-                    f.write(screenshot)
-                logger.info(f"Screenshot saved to {screenshot_path}")
-            except Exception as screenshot_error:
-                logger.error(f"Failed to take screenshot: {str(screenshot_error)}")
-        
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=error_msg
-        )
-        
-    except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        logger.error(error_msg, exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=error_msg
-        )
-        
-    finally:
-        # Ensure resources are always cleaned up
-        try:
-            await teardown_playwright(playwright, browser, context)
-        except Exception as e:
-            logger.error(f"Error during cleanup: {str(e)}", exc_info=True)
-    
-    # Send CSV to n8n webhook first
-    logger.info("Sending CSV to n8n webhook...")
-    webhook_success = False
-    webhook_error = None
-    if webhook_url:
-        try:
-            logger.info(f"Webhook URL: {webhook_url}")
-            logger.info(f"Original CSV content size: {len(csv_content)} bytes")
-            
-            # Convert CSV from UTF-16 to UTF-8 for better n8n compatibility
-            try:
-                # Try UTF-16 LE (Little Endian) first - most common for Windows/Linxo
-                csv_text = csv_content.decode('utf-16-le')
-                logger.info("Decoded CSV as UTF-16 LE")
-            except UnicodeDecodeError:
-                try:
-                    # Try UTF-16 BE (Big Endian) as fallback
-                    csv_text = csv_content.decode('utf-16-be')
-                    logger.info("Decoded CSV as UTF-16 BE")
-                except UnicodeDecodeError:
-                    # If both fail, try UTF-8 (maybe it's already UTF-8)
-                    csv_text = csv_content.decode('utf-8')
-                    logger.info("CSV is already UTF-8")
-            
-            # Re-encode as UTF-8
-            csv_utf8 = csv_text.encode('utf-8')
-            logger.info(f"Converted CSV to UTF-8, new size: {len(csv_utf8)} bytes")
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    webhook_url,
-                    content=csv_utf8,
-                    headers={
-                        "Content-Type": "text/csv; charset=utf-8",
-                        "Content-Length": str(len(csv_utf8))
-                    }
-                )
-                logger.info(f"Webhook response status: {response.status_code}")
-                logger.info(f"Webhook response body: {response.text[:200]}")
-                if response.status_code == 200:
-                    webhook_success = True
-                    logger.info("CSV successfully sent to n8n webhook")
-                else:
-                    webhook_error = f"Status {response.status_code}: {response.text[:200]}"
-                    logger.warning(f"n8n webhook returned non-200 status: {webhook_error}")
-        except httpx.TimeoutException as e:
-            webhook_error = f"Timeout: {str(e)}"
-            logger.error(f"Timeout sending CSV to n8n: {str(e)}")
-        except httpx.RequestError as e:
-            webhook_error = f"Request error: {str(e)}"
-            logger.error(f"Request error sending CSV to n8n: {str(e)}")
-        except Exception as e:
-            webhook_error = f"Unexpected error: {str(e)}"
-            logger.error(f"Unexpected error sending CSV to n8n: {str(e)}")
-    else:
-        webhook_error = "N8N_WEBHOOK_URL not configured"
-        logger.warning("N8N_WEBHOOK_URL not set, skipping webhook send")
+        async with linxo_scrape_lock(email):
+            csv_content = None
+            if EXPORT_CACHE_TTL_SECONDS and not force:
+                csv_content = await state.get(cache_key)
+            from_cache = csv_content is not None
+            if from_cache:
+                logger.info("Using transactions scraped by a concurrent export")
+            else:
+                result = await scrape_linxo_csv(settings, filters, gmail_available, artifacts)
+                if isinstance(result, JSONResponse):
+                    await jobs.finish(artifacts.job_id, "failed", error=bytes(result.body).decode("utf-8", "replace"))
+                    run.finish("failed", status=result.status_code)
+                    return result
+                csv_content = result
+                if EXPORT_CACHE_TTL_SECONDS:
+                    await state.set(cache_key, csv_content, ttl=EXPORT_CACHE_TTL_SECONDS)
+    except LockNotAcquired:
+        await jobs.finish(artifacts.job_id, "failed", error="Another export of this Linxo account is still running")
+        run.finish("busy")
+        raise scrape_busy_error()
+    except HTTPException as e:
+        await jobs.finish(artifacts.job_id, "failed", error=str(e.detail))
+        raise
+
+    # When the delivered CSV was scraped (or taken from the cache)
+    produced_at = time.time()
+
+    try:
+        csv_content, filter_report = apply_filters(csv_content, filters)
+    except HTTPException as e:
+        await jobs.finish(artifacts.job_id, "failed", error=str(e.detail))
+        raise
+
+    csv_text, _ = decode_csv(csv_content)
 
-    # Save CSV locally after webhook attempt
-    logger.info("Saving CSV locally...")
-    local_save_path = "linxo_transactions.csv"
+    # Compare with the last delivered export, deliver and record the delivery under the
+    # scope's delivery lock (shared with the outbox): an export served the same data from
+    # the cache then sees it as delivered instead of sending it again
+    try:
+        async with delivery_outbox.lock(filters.scope, wait=EXPORT_LOCK_WAIT_SECONDS):
+            with span("csv.content_hash") as hash_span:
+                hashes = content_hashes(csv_text)
+                changed_accounts = await delivery_state.changed_accounts(filters.scope, hashes)
+                changed = force or await delivery_state.is_changed(filters.scope, hashes)
+                hash_span.set_attributes({"changed": changed, "rows": hashes.row_count})
+            logger.info(f"Content hash {hashes.overall[:12]}, changed: {changed}")
+
+            # Send CSV to n8n webhook first
+            logger.info("Sending CSV to n8n webhook...")
+            webhook_success = False
+            webhook_error = None
+            webhook_queued = False
+            if not changed:
+                logger.info("Transactions unchanged since the last delivery, skipping webhook send")
+            elif webhook_url:
+                logger.info(f"Original CSV content size: {len(csv_content)} bytes")
+                # Convert CSV from UTF-16 to UTF-8 for better n8n compatibility
+                csv_utf8 = csv_text.encode('utf-8')
+                logger.info(f"Converted CSV to UTF-8, new size: {len(csv_utf8)} bytes")
+                webhook_success, webhook_error = await send_csv_to_webhook(webhook_url, csv_utf8)
+                if not webhook_success:
+                    # Retried in the background; the delivery hash is recorded once it goes through
+                    await delivery_outbox.enqueue(filters.scope, csv_utf8, webhook_error,
+                                                  hashes=asdict(hashes), produced_at=produced_at)
+                    webhook_queued = True
+            else:
+                webhook_error = "N8N_WEBHOOK_URL not configured"
+                logger.warning("N8N_WEBHOOK_URL not set, skipping webhook send")
+            if not webhook_queued:
+                # An older CSV still queued for this scope must not be sent after this export
+                await delivery_outbox.discard(filters.scope)
+
+            # Save CSV locally after webhook attempt
+            local_save_path = "linxo_transactions.csv"
+            if not changed:
+                local_save_success = os.path.exists(local_save_path)
+                logger.info("Transactions unchanged, keeping the existing local CSV")
+            else:
+                logger.info("Saving CSV locally...")
+                try:
+                    with open(local_save_path, "wb") as f:
+                        f.write(csv_content)
+                    logger.info(f"CSV saved locally to {local_save_path}")
+                    local_save_success = True
+                except Exception as e:
+                    logger.error(f"Error saving CSV locally: {str(e)}")
+                    local_save_success = False
+
+            # Only a complete delivery counts: a failed webhook send is retried next run
+            if changed and local_save_success and (webhook_success or not webhook_url):
+                await delivery_state.record(filters.scope, hashes, produced_at)
+    except LockNotAcquired:
+        await jobs.finish(artifacts.job_id, "failed", error="Another delivery of these transactions is still running")
+        run.finish("busy")
+        raise scrape_busy_error()
+
+    # Keep a snapshot for GET /exports/diff (unchanged months reuse stored chunks)
+    snapshot_saved = False
+    rollups_updated = False
     try:
-        with open(local_save_path, "wb") as f:
-            f.write(csv_content)
-        logger.info(f"CSV saved locally to {local_save_path}")
-        local_save_success = True
+        with span("snapshot.save"):
+            previous = await asyncio.to_thread(snapshot_store.latest, filters.scope)
+            manifest = await asyncio.to_thread(snapshot_store.save, artifacts.job_id, filters.scope, csv_text)
+        snapshot_saved = True
+        # Apply only the rows that changed since the previous snapshot to GET /summary's rollups
+        with span("rollups.update") as rollup_span:
+            rollup_report = await asyncio.to_thread(rollup_store.update, previous, manifest)
+            rollup_span.set_attributes(rollup_report)
+        rollups_updated = True
     except Exception as e:
-        logger.error(f"Error saving CSV locally: {str(e)}")
-        local_save_success = False
+        logger.error(f"Error saving export snapshot or rollups: {str(e)}")
+
+    await jobs.finish(artifacts.job_id, "succeeded", changed=changed, rows=hashes.row_count,
+                      webhook_sent=webhook_success, webhook_queued=webhook_queued, from_cache=from_cache,
+                      snapshot_saved=snapshot_saved, rollups_updated=rollups_updated)
+    run.finish("succeeded", status=status.HTTP_200_OK, rows=hashes.row_count, from_cache=from_cache)
+
+    # Stages slower than their baseline, as of the previous runs
+    regressions = [regression["stage"] for regression in await run_history.current_regressions("export-csv")]
+    if regressions:
+        logger.warning(f"Performance regression in: {', '.join(regressions)}")
+    current_span().set_attribute("run.regressions", ",".join(regressions))
+
+    if output.streams_data:
+        headers = output.response_headers()
+        headers.update({
+            "X-Job-Id": artifacts.job_id,
+            "X-Changed": str(changed).lower(),
+            "X-Content-Hash": hashes.overall,
+            "X-Webhook-Sent": str(webhook_success).lower(),
+            "X-Local-Save-Success": str(local_save_success).lower(),
+            "X-Performance-Regressions": ",".join(regressions),
+        })
+        logger.info(f"Streaming transactions as {output.format} ({output.encoding})")
+        return StreamingResponse(output.stream(csv_text), media_type=output.media_type, headers=headers)
 
     # Return JSON response with status
     response_data = {
-        "message": "CSV export completed",
+        "message": "CSV export completed" if changed else "No changes since the last export",
+        "changed": changed,
+        "changed_accounts": changed_accounts,
+        "content_hash": hashes.overall,
+        "row_count": hashes.row_count,
         "webhook_sent": webhook_success,
         "webhook_error": webhook_error if not webhook_success else None,
+        "webhook_queued": webhook_queued,
         "local_save_success": local_save_success,
         "local_save_path": local_save_path if local_save_success else None,
-        "csv_size_bytes": len(csv_content)
+        "csv_size_bytes": len(csv_content),
+        "filters": filter_report,
+        "job_id": artifacts.job_id,
+        "snapshot_saved": snapshot_saved,
+        "rollups_updated": rollups_updated,
+        "artifacts": artifacts.captured,
+        "from_cache": from_cache,
+        "performance_regressions": regressions
     }
     logger.info(f"Returning status response: {response_data}")
     return JSONResponse(content=response_data)
 
+@app.get("/collect")
+async def collect_linxo_data(
+    sections: str = Query(",".join(SECTIONS), description=f"Comma-separated sections to collect: {', '.join(SECTIONS)}"),
+    filters: ExportFilters = Depends(export_filters),
+    artifacts: ArtifactRecorder = Depends(artifact_recorder),
+    api_key: ApiKey = Depends(admit_export)
+):
+    """
+    Log in once and collect transactions, accounts (with balances) and
+    budgets concurrently, each in its own tab of the same browser context
+    (requires export API key).
+
+    The filters apply to the transactions. A failed accounts or budget page is
+    reported in `errors` without failing the whole collection.
+    """
+    try:
+        wanted = parse_sections(sections)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    if not wanted:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="No section requested")
+
+    settings = require_linxo_credentials()
+    gmail_available = await check_gmail_available()
+    await jobs.start(artifacts.job_id, "collect", api_key.key_id, sections=",".join(wanted), filters=filters.scope)
+    try:
+        async with linxo_scrape_lock(settings.linxo_email):
+            result = await collect_linxo(settings, filters, gmail_available, artifacts, wanted)
+    except LockNotAcquired:
+        await jobs.finish(artifacts.job_id, "failed", error="Another export of this Linxo account is still running")
+        raise scrape_busy_error()
+    except HTTPException as e:
+        await jobs.finish(artifacts.job_id, "failed", error=str(e.detail))
+        raise
+    if isinstance(result, JSONResponse):
+        await jobs.finish(artifacts.job_id, "failed", error=bytes(result.body).decode("utf-8", "replace"))
+        return result
+
+    response_data = {"job_id": artifacts.job_id, "sections": list(wanted)}
+    if "transactions" in wanted:
+        try:
+            csv_content, filter_report = apply_filters(result["transactions"], filters)
+        except HTTPException as e:
+            await jobs.finish(artifacts.job_id, "failed", error=str(e.detail))
+            raise
+        csv_text, _ = decode_csv(csv_content)
+        header, rows, _ = parse_csv(csv_text)
+        names = [name.lstrip("\ufeff").strip() for name in header]
+        response_data["transactions"] = {
+            "row_count": len(rows),
+            "filters": filter_report,
+            "rows": [dict(zip(names, (row.get(name, "") for name in header))) for row in rows],
+        }
+    for name in wanted:
+        if name != "transactions":
+            response_data[name] = result.get(name)
+    response_data.update(
+        errors=result["errors"],
+        timings=result["timings"],
+        wall_seconds=result["wall_seconds"],
+        artifacts=artifacts.captured,
+    )
+    await jobs.finish(artifacts.job_id, "succeeded", sections=",".join(wanted), errors=sorted(result["errors"]),
+                      wall_seconds=result["wall_seconds"])
+    logger.info(f"Collected {', '.join(wanted)} in {result['wall_seconds']}s "
+                f"(sum of sections {sum(result['timings'].values()):.2f}s)")
+    return response_data
+
+@app.get("/export-history", response_description="CSV stream of transactions scraped from the history pages")
+async def export_linxo_history(
+    max_pages: int = Query(20, ge=1, le=200, description="Maximum number of history pages to read"),
+    parallelism: int = Query(4, ge=1, le=8, description="History pages loaded at the same time"),
+    exclude_duplicates: bool = Query(False, description="Drop transactions Linxo flags as duplicates"),
+    artifacts: ArtifactRecorder = Depends(artifact_recorder),
+    api_key: ApiKey = Depends(rate_limit_export)
+):
+    """
+    Stream transactions scraped from the paginated history view as CSV.
+
+    Unlike /export-csv this includes on-screen fields (tags, notes, pointed
+    status). Pages are fetched in parallel tabs after a single login.
+
+    The first page is loaded before the response starts, so login and
+    navigation failures get an error status. A later page that keeps failing
+    is skipped and reported by a trailing `#error,<message>` line.
+    """
+    from playwright.async_api import Error as PlaywrightError
+
+    settings = require_linxo_credentials()
+    gmail_available = await check_gmail_available()
+
+    # The slot and the scrape lock must outlive this handler: they are released when the stream ends
+    acquired_at = await export_admission.acquire()
+    held = AsyncExitStack()
+    session = None
+    await jobs.start(artifacts.job_id, "export-history", api_key.key_id, max_pages=max_pages)
+
+    async def cleanup(job_status: str = "failed", **details):
+        try:
+            await teardown_playwright(session, artifacts)
+            await jobs.finish(artifacts.job_id, job_status, **details)
+        except Exception as e:
+            logger.error(f"Error during cleanup: {str(e)}", exc_info=True)
+        finally:
+            try:
+                await held.aclose()
+            finally:
+                export_admission.release(acquired_at)
+
+    try:
+        await held.enter_async_context(linxo_scrape_lock(settings.linxo_email))
+    except LockNotAcquired:
+        await cleanup(error="Another export of this Linxo account is still running")
+        raise scrape_busy_error()
+    except BaseException:
+        await cleanup()
+        raise
+
+    try:
+        session = await setup_playwright(artifacts)
+        page = session.page
+        login_failure = await login_to_linxo(page, settings.linxo_email, settings.linxo_password,
+                                             gmail_available, settings.linxo_base_url, artifacts)
+        if login_failure is not None:
+            await cleanup()
+            return login_failure
+        # History pages are opened in their own tabs
+        await page.close()
+        rows = iter_history_rows(
+            session.context,
+            settings.linxo_base_url,
+            max_pages=max_pages,
+            parallelism=parallelism,
+            exclude_duplicates=exclude_duplicates
+        )
+        first_row = await anext(rows, None)
+        if first_row is not None and "_error" in first_row:
+            await rows.aclose()
+            await cleanup(error=first_row["_error"])
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                                detail=f"Could not load the Linxo history: {first_row['_error']}")
+    except HTTPException:
+        raise
+    except PlaywrightError as e:
+        await cleanup()
+        if session is not None and session.expired:
+            raise deadline_exceeded_error()
+        logger.error(f"Playwright error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Playwright error: {str(e)}"
+        )
+    except BaseException:
+        await cleanup()
+        raise
+
+    failed_pages = []
+
+    async def all_rows():
+        if first_row is not None:
+            yield first_row
+        async for row in rows:
+            if "_error" in row:
+                failed_pages.append(row["_error"])
+            yield row
+
+    async def csv_body():
+        job_status = "failed"
+        try:
+            async for chunk in stream_csv(all_rows()):
+                yield chunk
+            job_status = "partial" if failed_pages else "succeeded"
+        finally:
+            # A client disconnect cancels the stream, and every await here with it; shield the cleanup
+            with anyio.CancelScope(shield=True):
+                await rows.aclose()
+                await cleanup(job_status, errors=failed_pages)
+
+    return StreamingResponse(
+        csv_body(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="linxo_history.csv"', "X-Job-Id": artifacts.job_id}
+    )
+
 if __name__ == "__main__":
     import uvicorn
-    host = os.getenv("HOST", "0.0.0.0")
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    settings = get_settings()
+    workers = int(os.getenv("WORKERS", 1))
+    if workers > 1:
+        # Workers share state through STATE_BACKEND (sqlite or redis, not memory)
+        uvicorn.run("main:app", host=settings.host, port=settings.port, workers=workers)
+    else:
+        uvicorn.run(app, host=settings.host, port=settings.port)
@@ -0,0 +1,188 @@
+"""
+Webhook delivery outbox
+
+A webhook send that fails is not lost: the CSV is stored in the shared state
+backend and retried in the background with exponential backoff
+(OUTBOX_RETRY_SECONDS, doubling up to OUTBOX_MAX_RETRY_SECONDS) until
+OUTBOX_MAX_ATTEMPTS is reached.
+
+Only the latest undelivered CSV of each export scope (set of filters) is
+kept: a newer failed export supersedes the queued one, and a newer export
+delivered directly discards it, so n8n never receives an older CSV after a
+newer one. Every delivery of a scope, direct or retried, happens under the
+scope's delivery lock. For a retry the lock is a lease
+(OUTBOX_LEASE_SECONDS): the item stays stored while it is being sent, so a
+worker killed mid-send leaves it to be retried by another worker once the
+lease expires instead of losing it.
+
+The worker loop also purges expired state backend entries every
+STATE_PURGE_INTERVAL_SECONDS.
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from state_backend import LockNotAcquired, StateBackend
+
+logger = logging.getLogger(__name__)
+
+ITEM_PREFIX = "outbox:"
+
+
+class DeliveryOutbox:
+    def __init__(self, backend: StateBackend,
+                 send: Callable[[bytes], Awaitable[Tuple[bool, Optional[str]]]],
+                 on_delivered: Callable[[Dict], Awaitable[None]],
+                 retry_seconds: float = 30, max_retry_seconds: float = 900, max_attempts: int = 10,
+                 lease_seconds: float = 120, purge_interval_seconds: float = 300):
+        self.backend = backend
+        self.send = send
+        self.on_delivered = on_delivered
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self._worker: Optional[asyncio.Task] = None
+        self._next_purge = 0.0
+        self.delivered = 0
+        self.dropped = 0
+        self.superseded = 0
+
+    @classmethod
+    def from_env(cls, backend: StateBackend, send, on_delivered) -> "DeliveryOutbox":
+        return cls(
+            backend, send, on_delivered,
+            retry_seconds=float(os.getenv("OUTBOX_RETRY_SECONDS", 30)),
+            max_retry_seconds=float(os.getenv("OUTBOX_MAX_RETRY_SECONDS", 900)),
+            max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10)),
+            lease_seconds=float(os.getenv("OUTBOX_LEASE_SECONDS", 120)),
+            purge_interval_seconds=float(os.getenv("STATE_PURGE_INTERVAL_SECONDS", 300)),
+        )
+
+    @staticmethod
+    def _key(scope: str) -> str:
+        return f"{ITEM_PREFIX}{scope}"
+
+    def lock(self, scope: str, wait: float = 0):
+        """The scope's delivery lock; hold it to deliver, enqueue or discard a scope's CSV"""
+        return self.backend.lock(f"delivery:{scope}", ttl=self.lease_seconds, wait=wait)
+
+    async def enqueue(self, scope: str, payload: bytes, last_error: Optional[str] = None, **metadata) -> str:
+        """
+        Store a CSV for redelivery, superseding the scope's queued one; call under lock(scope)
+
+        metadata, with the scope added, is handed back to on_delivered.
+        """
+        item_id = uuid.uuid4().hex
+        if await self.backend.get(self._key(scope)) is not None:
+            self.superseded += 1
+            logger.info(f"Webhook delivery for '{scope}' superseded by {item_id}")
+        await self.backend.set_json(self._key(scope), {
+            "id": item_id,
+            "scope": scope,
+            "payload": base64.b64encode(payload).decode("ascii"),
+            "attempts": 1,
+            "not_before": time.time() + self.retry_seconds,
+            "last_error": last_error,
+            "metadata": dict(metadata, scope=scope),
+        })
+        logger.info(f"Webhook delivery {item_id} queued for retry")
+        return item_id
+
+    async def discard(self, scope: str) -> bool:
+        """Drop the scope's queued CSV after a newer one was delivered; call under lock(scope)"""
+        if await self.backend.get(self._key(scope)) is None:
+            return False
+        await self.backend.delete(self._key(scope))
+        self.superseded += 1
+        logger.info(f"Queued webhook delivery for '{scope}' discarded, a newer export was delivered")
+        return True
+
+    async def pending(self) -> List[Dict]:
+        """Queued items without their payload"""
+        items = []
+        for key in await self.backend.keys(ITEM_PREFIX):
+            item = await self.backend.get_json(key)
+            if item is not None:
+                item.pop("payload", None)
+                items.append(item)
+        return items
+
+    async def process_due(self) -> int:
+        """Retry every item whose backoff has elapsed; returns the number of items handled"""
+        handled = 0
+        for key in await self.backend.keys(ITEM_PREFIX):
+            item = await self.backend.get_json(key)
+            if item is None or item["not_before"] > time.time():
+                continue
+            try:
+                async with self.lock(item["scope"]):
+                    handled += await self._retry(item["scope"])
+            except LockNotAcquired:
+                # Leased by another worker, or the scope is being delivered by an export
+                continue
+        return handled
+
+    async def _retry(self, scope: str) -> int:
+        # Read again under the lease: the item may have been delivered, superseded or discarded meanwhile
+        item = await self.backend.get_json(self._key(scope))
+        if item is None or item["not_before"] > time.time():
+            return 0
+        try:
+            success, error = await self.send(base64.b64decode(item["payload"]))
+        except Exception as e:
+            success, error = False, f"Unexpected error: {str(e)}"
+        if success:
+            await self.backend.delete(self._key(scope))
+            self.delivered += 1
+            logger.info(f"Webhook delivery {item['id']} succeeded after {item['attempts'] + 1} attempts")
+            await self.on_delivered(item["metadata"])
+            return 1
+        item["attempts"] += 1
+        item["last_error"] = error
+        if item["attempts"] >= self.max_attempts:
+            await self.backend.delete(self._key(scope))
+            self.dropped += 1
+            logger.error(f"Giving up on webhook delivery {item['id']} after {item['attempts']} attempts: {error}")
+            return 1
+        delay = min(self.retry_seconds * 2 ** (item["attempts"] - 1), self.max_retry_seconds)
+        item["not_before"] = time.time() + delay
+        await self.backend.set_json(self._key(scope), item)
+        return 1
+
+    async def purge_if_due(self):
+        """Drop expired state backend entries (jobs, caches, stale locks) every purge interval"""
+        if not self.purge_interval_seconds or time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval_seconds
+        removed = await self.backend.purge_expired()
+        if removed:
+            logger.info(f"Purged {removed} expired state entries")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(self.retry_seconds, 30))
+            try:
+                await self.process_due()
+                await self.purge_if_due()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {str(e)}", exc_info=True)
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
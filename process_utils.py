@@ -0,0 +1,97 @@
+"""
+Process inspection helpers (Linux /proc based)
+
+Used to account for Chromium child processes, which do not show up in the
+Python process's own RSS, and to kill and reap them when a browser hangs.
+"""
+
+import glob
+import os
+import signal
+from typing import Iterable, List, Optional
+
+
+def read_rss_bytes(pid: int) -> int:
+    """Resident set size of a single process, 0 if it is gone or unreadable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return 0
+
+
+def child_pids(pid: int) -> List[int]:
+    """Direct children of a process"""
+    children = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(path) as f:
+                children.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, PermissionError):
+            continue
+    return children
+
+
+def descendant_pids(pid: int) -> List[int]:
+    """All descendants of a process (children, grandchildren, ...)"""
+    descendants = []
+    pending = child_pids(pid)
+    while pending:
+        current = pending.pop()
+        descendants.append(current)
+        pending.extend(child_pids(current))
+    return descendants
+
+
+def process_tree_rss_bytes(pid: Optional[int] = None) -> int:
+    """Sum of RSS for a process and all its descendants"""
+    pid = pid or os.getpid()
+    return read_rss_bytes(pid) + sum(read_rss_bytes(child) for child in descendant_pids(pid))
+
+
+def process_state(pid: int) -> Optional[str]:
+    """Single-letter state from /proc/<pid>/stat (R, S, Z, ...), None if the process is gone"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name is in parentheses and may contain spaces
+            return f.read().rsplit(")", 1)[1].split()[0]
+    except (FileNotFoundError, ProcessLookupError, PermissionError, IndexError):
+        return None
+
+
+def kill_process_tree(pid: int, sig: int = signal.SIGKILL) -> List[int]:
+    """Signal a process and all its descendants; returns the pids signalled"""
+    targets = [pid] + descendant_pids(pid)
+    signalled = []
+    # Stop the parent first so it cannot respawn children while they are killed
+    for target in targets:
+        try:
+            os.kill(target, sig)
+            signalled.append(target)
+        except (ProcessLookupError, PermissionError):
+            continue
+    return signalled
+
+
+def reap_zombie_children(exclude: Iterable[int] = ()) -> List[int]:
+    """
+    Collect exit statuses of zombie children of this process.
+
+    Orphaned Chromium processes are re-parented to PID 1, which is this
+    process when it runs as a container's entrypoint. Pids in `exclude`
+    (subprocesses asyncio waits for itself) are left alone.
+    """
+    excluded = set(exclude)
+    reaped = []
+    for child in child_pids(os.getpid()):
+        if child in excluded or process_state(child) != "Z":
+            continue
+        try:
+            os.waitpid(child, os.WNOHANG)
+            reaped.append(child)
+        except ChildProcessError:
+            continue
+    return reaped
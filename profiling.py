@@ -0,0 +1,242 @@
+"""
+Event-loop lag monitoring and on-demand profiling
+
+Loop lag: a heartbeat task on the event loop records how late it wakes up.
+A watchdog thread notices when the heartbeat stops for longer than
+LOOP_LAG_THRESHOLD_MS (default 250, 0 disables the monitor) and captures the
+loop thread's stack while it is still blocked, so a stall is reported with
+the code that caused it (a synchronous file write, a blocking Gmail call,
+CPU-heavy CSV work...). Recent stalls are served by GET /debug/loop-lag.
+
+Profiles, admin only, one at a time per process:
+
+    cprofile  deterministic cProfile of the event loop thread, saved as a
+              pstats file (snakeviz, `python -m pstats`, flameprof)
+    sample    stacks of every thread sampled every PROFILE_SAMPLE_INTERVAL_MS
+              (default 5), saved as folded stacks (speedscope, flamegraph.pl)
+
+An export is profiled by sending `X-Profile: cprofile|sample`; the profile is
+stored with the job's artifacts (profile.prof / profile.folded). GET
+/debug/profile profiles the live process for a number of seconds. Both cover
+everything the process runs meanwhile, not only one request. In sample
+mode a mostly idle loop waiting in select() means the time went to Chromium,
+Linxo or Gmail rather than to Python.
+"""
+
+import asyncio
+import cProfile
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from fastapi import Depends, Header, HTTPException, status
+
+from artifacts import ArtifactRecorder, artifact_recorder
+from auth import verify_api_key
+from settings import ApiKey
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("cprofile", "sample")
+PROFILE_FILE_NAMES = {"cprofile": "profile.prof", "sample": "profile.folded"}
+# Stalls kept for GET /debug/loop-lag
+MAX_STALLS = 20
+
+
+class LoopLagMonitor:
+    """Measures event loop lag and captures the blocking stack of long stalls"""
+
+    def __init__(self, threshold_ms: float = 250):
+        self.threshold = threshold_ms / 1000
+        self.interval = min(0.1, self.threshold / 2) if self.threshold else 0.1
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._stall_stack: Optional[List[str]] = None
+        self.stalls: deque = deque(maxlen=MAX_STALLS)
+        self.beats = 0
+        self.stall_count = 0
+        self.max_lag_ms = 0.0
+        self.last_lag_ms = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LoopLagMonitor":
+        return cls(threshold_ms=float(os.getenv("LOOP_LAG_THRESHOLD_MS", 250)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self):
+        """Start monitoring the running event loop"""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.to_thread(self._watchdog.join)
+        self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            self.beats += 1
+            self.last_lag_ms = lag * 1000
+            self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+            else:
+                self._stall_stack = None
+
+    def _record_stall(self, lag: float):
+        stack, self._stall_stack = self._stall_stack, None
+        self.stall_count += 1
+        self.stalls.append({"at": time.time() - lag, "lag_ms": round(lag * 1000, 1), "stack": stack or []})
+        where = stack[-1].strip().splitlines()[0] if stack else "unknown"
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms, at {where}")
+
+    def _watch(self):
+        """Capture the loop thread's stack once per stall, while it is still blocked"""
+        while not self._stopped.wait(self.interval / 2):
+            if self._stall_stack is not None or time.monotonic() - self._last_beat < self.threshold + self.interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._stall_stack = traceback.format_stack(frame)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "beats": self.beats,
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls),
+        }
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+# cProfile hooks the whole loop thread, so only one profile runs at a time
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded_stack(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join([thread_name] + labels[::-1])
+
+
+class Profile:
+    """A cProfile or sampling profile of the process"""
+
+    def __init__(self, mode: str, sample_interval_ms: Optional[float] = None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'")
+        self.mode = mode
+        self.file_name = PROFILE_FILE_NAMES[mode]
+        self.sample_interval = (sample_interval_ms or float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))) / 1000
+        self.samples: Counter = Counter()
+        self._profiler: Optional[cProfile.Profile] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.started_at: Optional[float] = None
+
+    def start(self):
+        """Start profiling; call from the event loop thread"""
+        if not _profile_lock.acquire(blocking=False):
+            raise ProfileBusy("Another profile is running")
+        self.started_at = time.perf_counter()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[_folded_stack(names.get(thread_id, str(thread_id)), frame)] += 1
+
+    def stop(self) -> bytes:
+        """Stop profiling and return the profile file's content"""
+        try:
+            if self._profiler is not None:
+                self._profiler.disable()
+                self._profiler.create_stats()
+                data = marshal.dumps(self._profiler.stats)
+            else:
+                self._stopped.set()
+                self._sampler.join()
+                data = "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common()).encode("utf-8")
+        finally:
+            _profile_lock.release()
+        logger.info(f"Captured {self.mode} profile over {time.perf_counter() - self.started_at:.1f}s ({len(data)} bytes)")
+        return data
+
+
+async def export_profile(
+    x_profile: Optional[str] = Header(None, pattern="^(cprofile|sample)$",
+                                      description="Profile this export (admin keys only): cprofile or sample"),
+    artifacts: ArtifactRecorder = Depends(artifact_recorder),
+    api_key: ApiKey = Depends(verify_api_key),
+):
+    """FastAPI dependency profiling the request when X-Profile is sent; the profile is saved with the job's artifacts"""
+    if x_profile is None:
+        yield None
+        return
+    if not api_key.has_scope("admin"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="X-Profile requires an admin API key")
+    profile = Profile(x_profile)
+    try:
+        profile.start()
+    except ProfileBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    try:
+        yield profile
+    finally:
+        await artifacts.add_file(profile.file_name, profile.stop())
+        logger.info(f"Saved {profile.mode} profile for job {artifacts.job_id} as {profile.file_name}")
+
+
+loop_monitor = LoopLagMonitor.from_env()
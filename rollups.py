@@ -0,0 +1,204 @@
+"""
+Incrementally maintained rollups of exported transactions
+
+Downstream consumers mostly want the same aggregates (spend per month and
+category, net flow per account), so they are kept up to date here and served
+by GET /summary instead of being recomputed from the full CSV every time.
+
+Rollups follow the export snapshots: after each export, the diff against the
+previous snapshot of the same scope (filters) is applied to the stored
+totals, removed and modified rows subtracting their old values. Months whose
+snapshot chunk did not change are not read at all. When the stored rollup
+does not belong to the previous snapshot (first export, failed update,
+pruned snapshot), it is rebuilt from the whole new snapshot.
+
+Tables, one group per key:
+
+    month            month
+    month_category   month, category
+    month_account    month, account
+
+Each group holds [transactions, income cents, spend cents] (spend is
+negative). Grouping is vectorized with pyarrow when it is installed, and
+done in plain Python otherwise.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from export_formats import PARQUET_AVAILABLE
+from snapshots import UNDATED, SnapshotStore, snapshot_store
+from transactions import parse_amount, parse_date, resolve_columns
+
+logger = logging.getLogger(__name__)
+
+TABLES = {
+    "month": ("month",),
+    "month_category": ("month", "category"),
+    "month_account": ("month", "account"),
+}
+
+# {table: {JSON-encoded group key: [transactions, income cents, spend cents]}}
+Totals = Dict[str, Dict[str, List[int]]]
+
+
+def _group_columns(header: List[str], rows: Iterable[Dict[str, str]]) -> Dict[str, List]:
+    """Group key and amount columns of the rows, amounts in signed cents"""
+    columns = resolve_columns(header)
+    date_name, amount_name, category_name = columns["date"], columns["amount"], columns["category"]
+    account_name = columns["account"] or columns["account_id"]
+    data = {"month": [], "category": [], "account": [], "income": [], "spend": []}
+    for row in rows:
+        parsed = parse_date(row.get(date_name, "")) if date_name else None
+        amount = parse_amount(row.get(amount_name, "")) if amount_name else None
+        cents = int((amount * 100).to_integral_value()) if amount is not None else 0
+        data["month"].append(parsed.strftime("%Y-%m") if parsed else UNDATED)
+        data["category"].append(row.get(category_name, "") if category_name else "")
+        data["account"].append(row.get(account_name, "") if account_name else "")
+        data["income"].append(max(cents, 0))
+        data["spend"].append(min(cents, 0))
+    return data
+
+
+def _aggregate_arrow(data: Dict[str, List]) -> Totals:
+    import pyarrow
+
+    table = pyarrow.table({
+        **{name: pyarrow.array(data[name], type=pyarrow.string()) for name in ("month", "category", "account")},
+        "income": pyarrow.array(data["income"], type=pyarrow.int64()),
+        "spend": pyarrow.array(data["spend"], type=pyarrow.int64()),
+        "transactions": pyarrow.array([1] * len(data["month"]), type=pyarrow.int64()),
+    })
+    totals: Totals = {}
+    for name, keys in TABLES.items():
+        grouped = table.group_by(list(keys)).aggregate(
+            [("transactions", "sum"), ("income", "sum"), ("spend", "sum")]
+        ).to_pydict()
+        totals[name] = {
+            json.dumps(list(key)): [count, income, spend]
+            for *key, count, income, spend in zip(*(grouped[k] for k in keys), grouped["transactions_sum"],
+                                                   grouped["income_sum"], grouped["spend_sum"])
+        }
+    return totals
+
+
+def _aggregate_python(data: Dict[str, List]) -> Totals:
+    totals: Totals = {name: {} for name in TABLES}
+    for i in range(len(data["month"])):
+        for name, keys in TABLES.items():
+            group = totals[name].setdefault(json.dumps([data[k][i] for k in keys]), [0, 0, 0])
+            group[0] += 1
+            group[1] += data["income"][i]
+            group[2] += data["spend"][i]
+    return totals
+
+
+def aggregate(header: List[str], rows: Iterable[Dict[str, str]]) -> Totals:
+    """Per-group totals of the given rows"""
+    data = _group_columns(header, rows)
+    if not data["month"]:
+        return {name: {} for name in TABLES}
+    if PARQUET_AVAILABLE:
+        return _aggregate_arrow(data)
+    return _aggregate_python(data)
+
+
+def merge(totals: Totals, delta: Totals, sign: int = 1):
+    """Add (or with sign=-1 subtract) delta into totals, dropping emptied groups"""
+    for name, groups in delta.items():
+        table = totals.setdefault(name, {})
+        for key, values in groups.items():
+            group = table.setdefault(key, [0, 0, 0])
+            for i, value in enumerate(values):
+                group[i] += sign * value
+            if group[0] <= 0:
+                del table[key]
+
+
+class RollupStore:
+    """Rollups per export scope, stored as JSON next to the snapshots"""
+
+    def __init__(self, snapshots: SnapshotStore):
+        self.snapshots = snapshots
+        self.rollup_dir = os.path.join(snapshots.root, "rollups")
+
+    def _path(self, scope: str) -> str:
+        return os.path.join(self.rollup_dir, hashlib.sha256(scope.encode("utf-8")).hexdigest()[:32] + ".json")
+
+    def get(self, scope: str) -> Optional[Dict]:
+        try:
+            with open(self._path(scope), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def update(self, previous: Optional[Dict], manifest: Dict) -> Dict:
+        """
+        Bring the scope's rollup to a newly saved snapshot
+
+        Args:
+            previous: The scope's snapshot before this export (None for the first one)
+            manifest: The snapshot just saved
+
+        Returns:
+            {"mode": "incremental" | "rebuilt" | "unchanged", "rows_applied": n}
+        """
+        rollup = self.get(manifest["scope"])
+        mode = "rebuilt"
+        rows_applied = 0
+        totals: Optional[Totals] = None
+        if rollup is not None and previous is not None and rollup["export_id"] == previous["export_id"]:
+            if previous["chunks"] == manifest["chunks"]:
+                mode, totals = "unchanged", rollup["tables"]
+            else:
+                try:
+                    diff = self.snapshots.diff(previous, manifest)
+                except FileNotFoundError as e:
+                    logger.warning(f"Rebuilding rollups of '{manifest['scope']}': {str(e)}")
+                else:
+                    totals = rollup["tables"]
+                    removed = diff["removed"] + [change["before"] for change in diff["modified"]]
+                    added = diff["added"] + [change["after"] for change in diff["modified"]]
+                    merge(totals, aggregate(previous["header"], removed), -1)
+                    merge(totals, aggregate(manifest["header"], added))
+                    mode, rows_applied = "incremental", len(removed) + len(added)
+        if totals is None:
+            totals = aggregate(manifest["header"], self.snapshots.rows(manifest))
+            rows_applied = manifest["row_count"]
+
+        rollup = {
+            "scope": manifest["scope"],
+            "export_id": manifest["export_id"],
+            "updated_at": time.time(),
+            "row_count": manifest["row_count"],
+            "tables": totals,
+        }
+        SnapshotStore._write_atomic(self._path(manifest["scope"]), json.dumps(rollup).encode("utf-8"))
+        logger.info(f"Updated rollups of '{manifest['scope']}' ({mode}, {rows_applied} rows applied)")
+        return {"mode": mode, "rows_applied": rows_applied}
+
+    def summary(self, scope: str) -> Optional[Dict]:
+        """The scope's rollups as lists of groups, amounts in currency units"""
+        rollup = self.get(scope)
+        if rollup is None:
+            return None
+        result = {key: rollup[key] for key in ("scope", "export_id", "updated_at", "row_count")}
+        for name, keys in TABLES.items():
+            groups = []
+            for key, (count, income, spend) in sorted(rollup["tables"].get(name, {}).items()):
+                groups.append({
+                    **dict(zip(keys, json.loads(key))),
+                    "transactions": count,
+                    "income": income / 100,
+                    "spend": spend / 100,
+                    "net": (income + spend) / 100,
+                })
+            result[f"by_{name}"] = groups
+        return result
+
+
+rollup_store = RollupStore(snapshot_store)
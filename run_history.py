@@ -0,0 +1,291 @@
+"""
+Per-run performance history
+
+Every export records one compact line per run in a local time series
+(RUNS_DIR/<UTC day>.jsonl, kept RUNS_RETENTION_DAYS days): its outcome and
+HTTP status, total duration, the duration of each stage (the tracing spans,
+summed per name, in ms), the selector fallbacks taken (selector spans that
+needed more than one candidate), the Gmail polls waited for, the CSV bytes
+downloaded and the row count. Spans are recorded whether or not tracing is
+enabled. Lines are appended with O_APPEND, so the workers of one host share
+the same files.
+
+GET /runs/stats compares the last RUNS_WINDOW_HOURS (default 24) with the
+RUNS_BASELINE_DAYS (default 7) before them: p50/p95/p99/max per stage,
+outcomes and fallback counts. A stage regresses when its window p95 is at
+least RUNS_REGRESSION_FACTOR (default 2) times the baseline p95, by at least
+RUNS_REGRESSION_MIN_MS, with RUNS_MIN_SAMPLES runs on both sides. Regressed
+linxo.* stages mean Linxo itself got slower (`linxo_slow`), as opposed to
+Gmail, the browser or this service. The p99/max of a stage is what its
+timeout (3000/5000/45000 ms in the scraper) should be tuned against.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from tracing import record_spans, stop_recording_spans
+
+logger = logging.getLogger(__name__)
+
+# Stage name prefixes and the component they measure
+STAGE_GROUPS = (("linxo.", "linxo"), ("gmail.", "gmail"), ("playwright.", "browser"), ("run.", "run"))
+# Pseudo-stage holding the duration of whole successful, non-cached runs
+TOTAL_STAGE = "run.total"
+
+
+def stage_group(stage: str) -> str:
+    return next((group for prefix, group in STAGE_GROUPS if stage.startswith(prefix)), "service")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summarize(values: List[float]) -> Dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+class RunRecorder:
+    """Spans and outcome of one run, turned into a history record"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.outcome: Optional[str] = None
+        self.details: Dict = {}
+
+    def finish(self, outcome: str, **details):
+        """Set the outcome (succeeded, failed, busy, ...) and extra fields such as status or rows"""
+        self.outcome = outcome
+        self.details.update(details)
+
+    def to_record(self) -> Dict:
+        stages: Dict[str, float] = {}
+        fallbacks: Dict[str, int] = {}
+        gmail_polls = 0
+        csv_bytes = 0
+        for recorded in self.spans:
+            name, attributes = recorded["name"], recorded["attributes"]
+            stages[name] = stages.get(name, 0) + recorded["seconds"] * 1000
+            attempts = attributes.get("selector.attempts")
+            if isinstance(attempts, int) and attempts > 1:
+                fallbacks[name] = fallbacks.get(name, 0) + attempts - 1
+            gmail_polls += attributes.get("gmail.polls", 0)
+            if name == "linxo.csv_download":
+                csv_bytes += attributes.get("csv.bytes", 0)
+        record = {
+            "t": round(self.started_at, 3),
+            "kind": self.kind,
+            "outcome": self.outcome or "error",
+            "ms": round((time.perf_counter() - self._start) * 1000),
+            "stages": {name: round(ms) for name, ms in stages.items()},
+            **self.details,
+        }
+        if fallbacks:
+            record["fallbacks"] = fallbacks
+        if gmail_polls:
+            record["gmail_polls"] = gmail_polls
+        if csv_bytes:
+            record["bytes"] = csv_bytes
+        return record
+
+
+class RunHistory:
+    """Daily JSON-lines files of run records, with rolling stats and regression detection"""
+
+    def __init__(self, root: str, retention_days: float = 35, window_hours: float = 24,
+                 baseline_days: float = 7, regression_factor: float = 2, regression_min_ms: float = 250,
+                 min_samples: int = 5, cache_seconds: float = 60):
+        self.root = root
+        self.retention_days = retention_days
+        self.window_hours = window_hours
+        self.baseline_days = baseline_days
+        self.regression_factor = regression_factor
+        self.regression_min_ms = regression_min_ms
+        self.min_samples = min_samples
+        self.cache_seconds = cache_seconds
+        self._pruned_day: Optional[str] = None
+        self._cached: Dict[str, tuple] = {}
+
+    @classmethod
+    def from_env(cls) -> "RunHistory":
+        return cls(
+            os.getenv("RUNS_DIR", "runs"),
+            retention_days=float(os.getenv("RUNS_RETENTION_DAYS", 35)),
+            window_hours=float(os.getenv("RUNS_WINDOW_HOURS", 24)),
+            baseline_days=float(os.getenv("RUNS_BASELINE_DAYS", 7)),
+            regression_factor=float(os.getenv("RUNS_REGRESSION_FACTOR", 2)),
+            regression_min_ms=float(os.getenv("RUNS_REGRESSION_MIN_MS", 250)),
+            min_samples=int(os.getenv("RUNS_MIN_SAMPLES", 5)),
+            cache_seconds=float(os.getenv("RUNS_STATS_CACHE_SECONDS", 60)),
+        )
+
+    @staticmethod
+    def _day(timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+    def _path(self, day: str) -> str:
+        return os.path.join(self.root, f"{day}.jsonl")
+
+    def append(self, record: Dict):
+        """Append one run; a single O_APPEND write keeps concurrent workers' lines whole"""
+        os.makedirs(self.root, exist_ok=True)
+        day = self._day(record["t"])
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        fd = os.open(self._path(day), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        if self._pruned_day != day:
+            self._pruned_day = day
+            self.prune()
+
+    def prune(self) -> List[str]:
+        """Delete day files older than the retention"""
+        oldest = self._day(time.time() - self.retention_days * 86400)
+        removed = []
+        for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            if name.endswith(".jsonl") and name[:-len(".jsonl")] < oldest:
+                os.remove(os.path.join(self.root, name))
+                removed.append(name)
+        if removed:
+            logger.info(f"Pruned {len(removed)} day(s) of run history")
+        return removed
+
+    def load(self, since: float, kind: Optional[str] = None) -> List[Dict]:
+        """Runs started at or after `since`, oldest first"""
+        runs = []
+        day = datetime.fromtimestamp(since, timezone.utc).date()
+        today = datetime.now(timezone.utc).date()
+        while day <= today:
+            try:
+                with open(self._path(day.isoformat()), encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            run = json.loads(line)
+                        except ValueError:
+                            continue
+                        if run["t"] >= since and (kind is None or run["kind"] == kind):
+                            runs.append(run)
+            except FileNotFoundError:
+                pass
+            day += timedelta(days=1)
+        return sorted(runs, key=lambda run: run["t"])
+
+    @staticmethod
+    def _durations(runs: List[Dict], stage: str) -> List[float]:
+        if stage == TOTAL_STAGE:
+            return [run["ms"] for run in runs if run["outcome"] == "succeeded" and not run.get("from_cache")]
+        return [run["stages"][stage] for run in runs if stage in run["stages"]]
+
+    @staticmethod
+    def _counts(runs: List[Dict]) -> Dict:
+        outcomes = Counter(run["outcome"] for run in runs)
+        fallbacks = Counter()
+        for run in runs:
+            fallbacks.update(run.get("fallbacks", {}))
+        return {
+            "runs": len(runs),
+            "outcomes": dict(outcomes),
+            "failure_rate": round(1 - outcomes["succeeded"] / len(runs), 3) if runs else None,
+            "fallbacks": dict(fallbacks),
+            "gmail_polls": summarize([run["gmail_polls"] for run in runs if "gmail_polls" in run]),
+            "bytes": summarize([run["bytes"] for run in runs if "bytes" in run]),
+        }
+
+    def stats(self, kind: str = "export-csv", window_hours: Optional[float] = None,
+              now: Optional[float] = None) -> Dict:
+        """Rolling percentiles of the recent window against the baseline before it, and the regressions found"""
+        now = now or time.time()
+        window_hours = window_hours or self.window_hours
+        window_start = now - window_hours * 3600
+        runs = self.load(window_start - self.baseline_days * 86400, kind)
+        window = [run for run in runs if run["t"] >= window_start]
+        baseline = [run for run in runs if run["t"] < window_start]
+
+        stage_names = {TOTAL_STAGE}
+        for run in runs:
+            stage_names.update(run["stages"])
+        stages = {}
+        regressions = []
+        for stage in sorted(stage_names):
+            recent, before = summarize(self._durations(window, stage)), summarize(self._durations(baseline, stage))
+            stages[stage] = {"group": stage_group(stage), "window": recent, "baseline": before}
+            if recent["count"] < self.min_samples or before["count"] < self.min_samples:
+                continue
+            if (recent["p95"] >= self.regression_factor * before["p95"]
+                    and recent["p95"] - before["p95"] >= self.regression_min_ms):
+                regressions.append({
+                    "stage": stage,
+                    "group": stage_group(stage),
+                    "window_p95_ms": recent["p95"],
+                    "baseline_p95_ms": before["p95"],
+                    "ratio": round(recent["p95"] / max(before["p95"], 1), 2),
+                })
+        return {
+            "kind": kind,
+            "generated_at": now,
+            "window_hours": window_hours,
+            "baseline_days": self.baseline_days,
+            "regression_factor": self.regression_factor,
+            "window": self._counts(window),
+            "baseline": self._counts(baseline),
+            "stages": stages,
+            "regressions": regressions,
+            "linxo_slow": any(regression["group"] == "linxo" for regression in regressions),
+        }
+
+    async def current_regressions(self, kind: str = "export-csv") -> List[Dict]:
+        """Regressions of the default window, computed at most every RUNS_STATS_CACHE_SECONDS"""
+        cached = self._cached.get(kind)
+        if cached is None or time.monotonic() - cached[0] > self.cache_seconds:
+            stats = await asyncio.to_thread(self.stats, kind)
+            cached = self._cached[kind] = (time.monotonic(), stats["regressions"])
+        return cached[1]
+
+
+run_history = RunHistory.from_env()
+
+
+def run_recorder(kind: str):
+    """Dependency factory recording the request's spans and outcome in the run history"""
+
+    async def dependency():
+        run = RunRecorder(kind)
+        run.spans, token = record_spans()
+        try:
+            yield run
+        except HTTPException as e:
+            if run.outcome is None:
+                run.finish("failed", status=e.status_code)
+            raise
+        finally:
+            stop_recording_spans(token)
+            try:
+                await asyncio.to_thread(run_history.append, run.to_record())
+            except Exception as e:
+                logger.warning(f"Could not record the {kind} run: {str(e)}")
+
+    return dependency
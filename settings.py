@@ -0,0 +1,218 @@
+"""
+Application settings, loaded once and reloadable on SIGHUP
+
+API keys are stored as SHA-256 hashes with scopes:
+    export  - run exports
+    query   - read-only query endpoints
+    admin   - debug/admin endpoints (implies every other scope)
+
+Sources (all are merged):
+    API_KEY        legacy single plaintext key, granted every scope
+    API_KEYS       "id:sha256hex:scope|scope,id2:sha256hex:scope"
+    API_KEYS_FILE  JSON file: [{"id": "n8n", "sha256": "...", "scopes": ["export"]}]
+
+Generate a hash with: echo -n "$KEY" | sha256sum
+"""
+
+import hashlib
+import json
+import logging
+import os
+import signal
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from dotenv import dotenv_values
+
+logger = logging.getLogger(__name__)
+
+SCOPES = frozenset({"export", "query", "admin"})
+
+
+@dataclass(frozen=True)
+class ApiKey:
+    """A configured API key (only its hash is kept in memory)"""
+    key_id: str
+    key_hash: str
+    scopes: FrozenSet[str]
+
+    def has_scope(self, scope: str) -> bool:
+        return scope in self.scopes or "admin" in self.scopes
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Validated configuration snapshot"""
+    linxo_email: Optional[str]
+    linxo_password: Optional[str]
+    n8n_webhook_url: Optional[str]
+    linxo_base_url: str = "https://wwws.linxo.com"
+    api_keys: Tuple[ApiKey, ...] = ()
+    host: str = "0.0.0.0"
+    port: int = 8000
+    problems: Tuple[str, ...] = field(default=(), compare=False)
+
+    @property
+    def has_linxo_credentials(self) -> bool:
+        return bool(self.linxo_email and self.linxo_password)
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _is_sha256_hex(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def _parse_scopes(raw_scopes, key_id: str, problems: List[str]) -> FrozenSet[str]:
+    scopes = frozenset(scope.strip() for scope in raw_scopes if scope.strip())
+    unknown = scopes - SCOPES
+    if unknown:
+        problems.append(f"API key '{key_id}' has unknown scopes: {sorted(unknown)}")
+    return scopes & SCOPES
+
+
+def _parse_api_keys(problems: List[str]) -> Tuple[ApiKey, ...]:
+    keys = []
+
+    legacy_key = os.getenv("API_KEY")
+    if legacy_key:
+        keys.append(ApiKey("default", hash_api_key(legacy_key), SCOPES))
+
+    for entry in filter(None, (e.strip() for e in os.getenv("API_KEYS", "").split(","))):
+        parts = entry.split(":")
+        if len(parts) != 3:
+            problems.append(f"Malformed API_KEYS entry (expected id:sha256:scopes): {parts[0]}")
+            continue
+        key_id, key_hash, raw_scopes = parts
+        keys.append(ApiKey(key_id, key_hash.lower(), _parse_scopes(raw_scopes.split("|"), key_id, problems)))
+
+    keys_file = os.getenv("API_KEYS_FILE")
+    if keys_file:
+        try:
+            with open(keys_file) as f:
+                for entry in json.load(f):
+                    key_id = entry["id"]
+                    keys.append(ApiKey(key_id, entry["sha256"].lower(),
+                                       _parse_scopes(entry.get("scopes", []), key_id, problems)))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            problems.append(f"Could not read API_KEYS_FILE {keys_file}: {str(e)}")
+
+    for key in keys:
+        if not _is_sha256_hex(key.key_hash):
+            problems.append(f"API key '{key.key_id}' hash is not a SHA-256 hex digest, ignoring it")
+
+    return tuple(key for key in keys if _is_sha256_hex(key.key_hash))
+
+
+# .env file to read; None lets python-dotenv find it
+DOTENV_PATH: Optional[str] = None
+
+# The process environment before .env was applied (main loads .env after importing settings)
+_process_environ: Dict[str, str] = dict(os.environ)
+# Variables whose current value came from .env
+_dotenv_applied: Dict[str, str] = {}
+
+
+def _apply_dotenv(override: bool) -> None:
+    """
+    Copy .env into the environment. A variable an earlier load took from .env that is
+    no longer in the file goes back to its process value, or is unset, so a key
+    deleted from .env stops authenticating after a reload.
+    """
+    values = {name: value for name, value in dotenv_values(DOTENV_PATH).items() if value is not None}
+    for name, applied in _dotenv_applied.items():
+        if name in values:
+            continue
+        original = _process_environ.get(name)
+        if original is not None and original != applied:
+            os.environ[name] = original
+        else:
+            os.environ.pop(name, None)
+    _dotenv_applied.clear()
+    for name, value in values.items():
+        if override or name not in os.environ:
+            os.environ[name] = value
+        if os.environ[name] == value:
+            _dotenv_applied[name] = value
+
+
+def load_settings(override_env: bool = False) -> Settings:
+    """Read settings from the environment (and .env), collecting validation problems"""
+    _apply_dotenv(override=override_env)
+    problems: List[str] = []
+
+    api_keys = _parse_api_keys(problems)
+    if not api_keys:
+        problems.append("No API key configured (set API_KEY, API_KEYS or API_KEYS_FILE)")
+
+    email = os.getenv("LINXO_EMAIL")
+    password = os.getenv("LINXO_PASSWORD")
+    if not email or not password:
+        problems.append("Missing Linxo credentials (LINXO_EMAIL / LINXO_PASSWORD)")
+
+    try:
+        port = int(os.getenv("PORT", 8000))
+    except ValueError:
+        problems.append(f"PORT is not a number: {os.getenv('PORT')}")
+        port = 8000
+
+    return Settings(
+        linxo_email=email,
+        linxo_password=password,
+        n8n_webhook_url=os.getenv("N8N_WEBHOOK_URL") or None,
+        linxo_base_url=os.getenv("LINXO_BASE_URL", "https://wwws.linxo.com").rstrip("/"),
+        api_keys=api_keys,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=port,
+        problems=tuple(problems),
+    )
+
+
+_settings: Optional[Settings] = None
+_reload_callbacks = []
+
+
+def get_settings() -> Settings:
+    """Current settings snapshot (loaded on first use)"""
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+        for problem in _settings.problems:
+            logger.error(f"Configuration problem: {problem}")
+    return _settings
+
+
+def on_reload(callback):
+    """Register a callback run after settings are reloaded"""
+    _reload_callbacks.append(callback)
+    return callback
+
+
+def reload_settings() -> Settings:
+    """
+    Re-read the .env file and swap the snapshot. Values in .env win; variables removed
+    from it are no longer taken from it (API keys included)
+    """
+    global _settings
+    new_settings = load_settings(override_env=True)
+    _settings = new_settings
+    for callback in _reload_callbacks:
+        callback(new_settings)
+    logger.info(f"Settings reloaded: {len(new_settings.api_keys)} API key(s) configured")
+    for problem in new_settings.problems:
+        logger.error(f"Configuration problem: {problem}")
+    return new_settings
+
+
+def install_reload_signal_handler(loop) -> bool:
+    """Reload settings when the process receives SIGHUP (no-op where SIGHUP does not exist)"""
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        loop.add_signal_handler(signal.SIGHUP, reload_settings)
+        return True
+    except (NotImplementedError, RuntimeError) as e:
+        logger.warning(f"Could not install SIGHUP handler: {str(e)}")
+        return False
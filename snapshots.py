@@ -0,0 +1,290 @@
+"""
+Export snapshots and diffs
+
+Every export's transactions are kept as a snapshot so downstream systems can
+ask what changed instead of re-reading whole CSVs (GET /exports/diff).
+
+Storage (SNAPSHOTS_DIR, default: snapshots/):
+
+    manifests/<export_id>.json   scope, time, header and the export's chunk ids
+    chunks/<sha256>.zst|.gz      compressed rows of one account and month
+
+Chunks are content-addressed: a month whose transactions did not change
+produces the same chunk as in the previous export and is stored once. Old
+manifests are deleted after SNAPSHOTS_MAX_AGE_DAYS (the latest one per scope
+is always kept) and chunks no manifest refers to are removed with them.
+
+Rows are matched by a key hashed from their identity (date, account, label,
+amount, plus an occurrence number for identical transactions), and compared
+by a hash of all their fields, so a diff is linear in the number of rows and
+chunks shared by both snapshots are skipped entirely. A row whose identity
+fields change (e.g. its amount) is reported as removed and added.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from export_formats import ZSTD_AVAILABLE
+from transactions import parse_csv, parse_date, resolve_columns
+
+logger = logging.getLogger(__name__)
+
+# Columns identifying a transaction; the other columns (category, notes, ...) can be modified
+IDENTITY_COLUMNS = ("date", "account_id", "account", "label", "amount")
+UNDATED = "undated"
+# Chunks written or reused this recently are never pruned (a save may be in progress)
+CHUNK_GRACE_SECONDS = 3600
+
+
+@dataclass
+class SnapshotRow:
+    key: str
+    content_hash: str
+    values: List[str]
+
+
+def _hash(values: List[str]) -> str:
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def snapshot_rows(csv_text: str) -> Tuple[List[str], Dict[str, List[SnapshotRow]]]:
+    """
+    Normalize an export into keyed rows grouped by chunk (account and month)
+
+    Returns:
+        (header, {chunk name: rows sorted by key})
+    """
+    header, rows, _ = parse_csv(csv_text)
+    names = [name.lstrip("\ufeff").strip() for name in header]
+    columns = resolve_columns(header)
+    identity = [header.index(columns[logical]) for logical in IDENTITY_COLUMNS if columns.get(logical)]
+    date_index = header.index(columns["date"]) if columns.get("date") else None
+    account_index = header.index(columns["account"]) if columns.get("account") else None
+
+    occurrences: Dict[str, int] = {}
+    chunks: Dict[str, List[SnapshotRow]] = {}
+    # Sorting by content first numbers identical transactions the same way in every export
+    normalized = sorted([(row.get(name) or "").strip() for name in header] for row in rows)
+    for values in normalized:
+        identity_values = [values[i] for i in identity] if identity else values
+        base_key = _hash(identity_values)
+        occurrence = occurrences.get(base_key, 0)
+        occurrences[base_key] = occurrence + 1
+        key = base_key if not occurrence else _hash([base_key, str(occurrence)])
+
+        parsed = parse_date(values[date_index]) if date_index is not None else None
+        month = parsed.strftime("%Y-%m") if parsed else UNDATED
+        account = values[account_index] if account_index is not None else ""
+        chunks.setdefault(f"{account}|{month}", []).append(SnapshotRow(key, _hash(values), values))
+
+    for chunk_rows in chunks.values():
+        chunk_rows.sort(key=lambda row: row.key)
+    return names, chunks
+
+
+class SnapshotStore:
+    """Content-addressed snapshot storage in a directory"""
+
+    def __init__(self, root: str, max_age_days: float = 30):
+        self.root = root
+        self.max_age_seconds = max_age_days * 86400
+        self.manifest_dir = os.path.join(root, "manifests")
+        self.chunk_dir = os.path.join(root, "chunks")
+
+    @classmethod
+    def from_env(cls) -> "SnapshotStore":
+        return cls(
+            os.getenv("SNAPSHOTS_DIR", "snapshots"),
+            max_age_days=float(os.getenv("SNAPSHOTS_MAX_AGE_DAYS", 30)),
+        )
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    # Chunks
+
+    def _chunk_path(self, chunk_id: str) -> Optional[str]:
+        for extension in (".zst", ".gz"):
+            path = os.path.join(self.chunk_dir, chunk_id + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _put_chunk(self, header: List[str], rows: List[SnapshotRow]) -> Tuple[str, bool]:
+        """Store a chunk unless it exists; returns (chunk id, newly written)"""
+        data = json.dumps({"header": header, "rows": [[row.key, row.content_hash, row.values] for row in rows]},
+                          ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        chunk_id = hashlib.sha256(data).hexdigest()
+        existing = self._chunk_path(chunk_id)
+        if existing:
+            os.utime(existing)
+            return chunk_id, False
+        if ZSTD_AVAILABLE:
+            import zstandard
+            self._write_atomic(os.path.join(self.chunk_dir, chunk_id + ".zst"),
+                               zstandard.ZstdCompressor(level=10).compress(data))
+        else:
+            self._write_atomic(os.path.join(self.chunk_dir, chunk_id + ".gz"), gzip.compress(data, 9))
+        return chunk_id, True
+
+    def _load_chunk(self, chunk_id: str) -> Iterator[SnapshotRow]:
+        path = self._chunk_path(chunk_id)
+        if path is None:
+            raise FileNotFoundError(f"Snapshot chunk {chunk_id} is missing")
+        with open(path, "rb") as f:
+            data = f.read()
+        if path.endswith(".zst"):
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            data = gzip.decompress(data)
+        for key, content_hash, values in json.loads(data)["rows"]:
+            yield SnapshotRow(key, content_hash, values)
+
+    def rows(self, manifest: Dict) -> Iterator[Dict[str, str]]:
+        """All rows of a snapshot, keyed by its header"""
+        for chunk_id in manifest["chunks"]:
+            for row in self._load_chunk(chunk_id):
+                yield dict(zip(manifest["header"], row.values))
+
+    # Manifests
+
+    def save(self, export_id: str, scope: str, csv_text: str) -> Dict:
+        """Store an export's snapshot; returns its manifest"""
+        header, chunks = snapshot_rows(csv_text)
+        chunk_ids = []
+        new_chunks = 0
+        for name in sorted(chunks):
+            chunk_id, written = self._put_chunk(header, chunks[name])
+            chunk_ids.append(chunk_id)
+            new_chunks += written
+        manifest = {
+            "export_id": export_id,
+            "scope": scope,
+            "created_at": time.time(),
+            "header": header,
+            "row_count": sum(len(rows) for rows in chunks.values()),
+            "chunks": chunk_ids,
+        }
+        self._write_atomic(os.path.join(self.manifest_dir, f"{export_id}.json"),
+                           json.dumps(manifest).encode("utf-8"))
+        logger.info(f"Saved snapshot {export_id}: {manifest['row_count']} rows, "
+                    f"{len(chunk_ids)} chunks ({new_chunks} new)")
+        self.prune()
+        return manifest
+
+    def get(self, export_id: str) -> Optional[Dict]:
+        if not export_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.manifest_dir, f"{export_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self, scope: Optional[str] = None) -> List[Dict]:
+        """Manifests, oldest first"""
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        manifests = []
+        for name in os.listdir(self.manifest_dir):
+            if name.endswith(".json") and not name.startswith("."):
+                manifest = self.get(name[:-len(".json")])
+                if manifest and (scope is None or manifest["scope"] == scope):
+                    manifests.append(manifest)
+        return sorted(manifests, key=lambda manifest: manifest["created_at"])
+
+    def latest(self, scope: str, before: Optional[float] = None) -> Optional[Dict]:
+        """Newest snapshot of a scope, optionally taken at or before a timestamp"""
+        manifests = [m for m in self.list(scope) if before is None or m["created_at"] <= before]
+        return manifests[-1] if manifests else None
+
+    def prune(self) -> List[str]:
+        """Delete expired manifests (keeping the latest per scope) and unreferenced chunks"""
+        if not self.max_age_seconds:
+            return []
+        manifests = self.list()
+        latest = {manifest["scope"]: manifest["export_id"] for manifest in manifests}
+        cutoff = time.time() - self.max_age_seconds
+        removed = []
+        for manifest in manifests:
+            if manifest["created_at"] < cutoff and latest[manifest["scope"]] != manifest["export_id"]:
+                os.unlink(os.path.join(self.manifest_dir, f"{manifest['export_id']}.json"))
+                removed.append(manifest["export_id"])
+        if removed:
+            referenced = {chunk_id for manifest in manifests if manifest["export_id"] not in removed
+                          for chunk_id in manifest["chunks"]}
+            for entry in os.scandir(self.chunk_dir):
+                if entry.name.startswith(".") or entry.name.split(".", 1)[0] in referenced:
+                    continue
+                if entry.stat().st_mtime < time.time() - CHUNK_GRACE_SECONDS:
+                    os.unlink(entry.path)
+            logger.info(f"Pruned {len(removed)} snapshot(s)")
+        return removed
+
+    # Diffs
+
+    def diff(self, old: Dict, new: Dict) -> Dict:
+        """Rows added, removed and modified between two snapshots"""
+        old_chunks, new_chunks = set(old["chunks"]), set(new["chunks"])
+        shared = old_chunks & new_chunks
+
+        before: Dict[str, SnapshotRow] = {}
+        for chunk_id in old_chunks - shared:
+            for row in self._load_chunk(chunk_id):
+                before[row.key] = row
+
+        old_header, new_header = old["header"], new["header"]
+        added, modified = [], []
+        for chunk_id in new_chunks - shared:
+            for row in self._load_chunk(chunk_id):
+                previous = before.pop(row.key, None)
+                if previous is None:
+                    added.append(dict(zip(new_header, row.values)))
+                elif previous.content_hash != row.content_hash:
+                    modified.append({"before": dict(zip(old_header, previous.values)),
+                                     "after": dict(zip(new_header, row.values))})
+        # Keys are unique within a snapshot and a key's chunk (account and month) is part of
+        # its identity, so rows of shared chunks cannot match anything left in `before`
+        removed = [dict(zip(old_header, row.values)) for row in before.values()]
+
+        return {
+            "added": added,
+            "removed": removed,
+            "modified": modified,
+            "counts": {"added": len(added), "removed": len(removed), "modified": len(modified)},
+            "chunks": {"unchanged": len(shared), "compared": len(old_chunks ^ new_chunks)},
+        }
+
+
+def parse_since(value: str) -> Optional[float]:
+    """Epoch seconds from a Unix timestamp or an ISO 8601 date/time, None if it is neither"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.timestamp()
+
+
+snapshot_store = SnapshotStore.from_env()
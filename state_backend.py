@@ -0,0 +1,374 @@
+"""
+Shared state backend
+
+State that has to be shared between uvicorn/gunicorn workers and replicas
+goes through one small async interface:
+
+    get / set / delete        key-value with optional TTL (sessions, job status, result cache,
+                              delivery hashes, webhook delivery outbox)
+    keys                      live keys with a given prefix
+    acquire_lock / release    single-flight locks with a TTL, released only by their holder
+    push / pop                FIFO queues
+    purge_expired             drop expired entries (run periodically by the outbox worker)
+
+Implementations, selected with STATE_BACKEND:
+
+    memory  - in-process dicts; one worker only
+    sqlite  - file at STATE_SQLITE_PATH (default: state.db); every worker on one host (default)
+    redis   - REDIS_URL (any Redis-protocol server); several hosts/replicas, needs the redis package
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LockNotAcquired(Exception):
+    """Raised when a single-flight lock could not be acquired in time"""
+
+
+class StateBackend(ABC):
+    """Interface shared by every backend; values are bytes"""
+
+    name = "base"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def keys(self, prefix: str) -> List[str]:
+        """Live (unexpired) keys starting with prefix, lock keys included"""
+
+    @abstractmethod
+    async def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        """Try once to take a lock; returns a token to release it with, or None if it is held"""
+
+    @abstractmethod
+    async def release_lock(self, name: str, token: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def push(self, queue: str, value: bytes):
+        ...
+
+    @abstractmethod
+    async def pop(self, queue: str) -> Optional[bytes]:
+        """Remove and return the oldest item (each item is handed to one caller only)"""
+
+    async def purge_expired(self) -> int:
+        """Delete expired entries; returns how many were removed (backends with native expiry keep the default)"""
+        return 0
+
+    async def close(self):
+        pass
+
+    async def get_json(self, key: str) -> Any:
+        value = await self.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self.set(key, json.dumps(value).encode("utf-8"), ttl)
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float, wait: float = 0, poll_interval: float = 0.25):
+        """Hold a lock for the duration of the block, waiting up to `wait` seconds for it"""
+        deadline = time.monotonic() + wait
+        while True:
+            token = await self.acquire_lock(name, ttl)
+            if token is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise LockNotAcquired(name)
+            await asyncio.sleep(poll_interval)
+        try:
+            yield token
+        finally:
+            await self.release_lock(name, token)
+
+
+class MemoryBackend(StateBackend):
+    """Process-local state (tests, single-worker deployments)"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._queues: Dict[str, deque] = defaultdict(deque)
+
+    def _live(self, key: str) -> Optional[tuple]:
+        entry = self._values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._values[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._live(key)
+        return entry[0] if entry else None
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def keys(self, prefix: str) -> List[str]:
+        return [key for key in list(self._values) if key.startswith(prefix) and self._live(key)]
+
+    async def purge_expired(self) -> int:
+        # Expired keys are otherwise only dropped when they are read again
+        expired = [key for key in list(self._values) if self._live(key) is None]
+        return len(expired)
+
+    async def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        key = f"lock:{name}"
+        if self._live(key):
+            return None
+        token = uuid.uuid4().hex
+        await self.set(key, token.encode(), ttl)
+        return token
+
+    async def release_lock(self, name: str, token: str) -> bool:
+        key = f"lock:{name}"
+        entry = self._live(key)
+        if entry and entry[0] == token.encode():
+            del self._values[key]
+            return True
+        return False
+
+    async def push(self, queue: str, value: bytes):
+        self._queues[queue].append(value)
+
+    async def pop(self, queue: str) -> Optional[bytes]:
+        items = self._queues.get(queue)
+        return items.popleft() if items else None
+
+
+class SQLiteBackend(StateBackend):
+    """State in a SQLite file, shared by every process on the host"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, value BLOB NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS queue_name ON queue (name, id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; asyncio.to_thread uses a small pool of threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: bytes, ttl: Optional[float]):
+        self._connect().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, time.time() + ttl if ttl else None)
+        )
+
+    def _acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        now = time.time()
+        # Takes the lock if it is free or expired, atomically
+        cursor = self._connect().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+            (f"lock:{name}", token.encode(), now + ttl, now)
+        )
+        return token if cursor.rowcount == 1 else None
+
+    def _release_lock(self, name: str, token: str) -> bool:
+        cursor = self._connect().execute(
+            "DELETE FROM kv WHERE key = ? AND value = ?", (f"lock:{name}", token.encode())
+        )
+        return cursor.rowcount == 1
+
+    def _pop(self, queue: str) -> Optional[bytes]:
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT id, value FROM queue WHERE name = ? ORDER BY id LIMIT 1", (queue,)
+            ).fetchone()
+            if row:
+                connection.execute("DELETE FROM queue WHERE id = ?", (row[0],))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return row[1] if row else None
+
+    def _keys(self, prefix: str) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT key FROM kv WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?) ORDER BY key",
+            (len(prefix), prefix, time.time())
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _purge_expired(self) -> int:
+        cursor = self._connect().execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(lambda: self._connect().execute("DELETE FROM kv WHERE key = ?", (key,)))
+
+    async def keys(self, prefix: str) -> List[str]:
+        return await asyncio.to_thread(self._keys, prefix)
+
+    async def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        return await asyncio.to_thread(self._acquire_lock, name, ttl)
+
+    async def release_lock(self, name: str, token: str) -> bool:
+        return await asyncio.to_thread(self._release_lock, name, token)
+
+    async def push(self, queue: str, value: bytes):
+        await asyncio.to_thread(
+            lambda: self._connect().execute("INSERT INTO queue (name, value) VALUES (?, ?)", (queue, value))
+        )
+
+    async def pop(self, queue: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._pop, queue)
+
+    async def purge_expired(self) -> int:
+        return await asyncio.to_thread(self._purge_expired)
+
+
+class RedisBackend(StateBackend):
+    """State on a Redis-protocol server, shared by every replica"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "linxo:"):
+        # Imported lazily: only needed when this backend is selected
+        import redis.asyncio
+
+        self.url = url
+        self.prefix = prefix
+        self._redis = redis.asyncio.from_url(url)
+        self._watch_error = redis.WatchError
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(self._key(key))
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        await self._redis.set(self._key(key), value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str):
+        await self._redis.delete(self._key(key))
+
+    async def keys(self, prefix: str) -> List[str]:
+        # SCAN is incremental, unlike KEYS; expired keys are never returned by Redis
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in self._key(prefix)) + "*"
+        found = [key.decode() async for key in self._redis.scan_iter(match=pattern, count=500)]
+        return sorted(key[len(self.prefix):] for key in found)
+
+    async def acquire_lock(self, name: str, ttl: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = await self._redis.set(self._key(f"lock:{name}"), token, nx=True, px=int(ttl * 1000))
+        return token if acquired else None
+
+    async def release_lock(self, name: str, token: str) -> bool:
+        # Check-and-delete in a WATCH/MULTI transaction (no Lua, so it works on any Redis-protocol server)
+        key = self._key(f"lock:{name}")
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) != token.encode():
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                await pipe.execute()
+                return True
+            except self._watch_error:
+                return False
+
+    async def push(self, queue: str, value: bytes):
+        await self._redis.rpush(self._key(f"queue:{queue}"), value)
+
+    async def pop(self, queue: str) -> Optional[bytes]:
+        return await self._redis.lpop(self._key(f"queue:{queue}"))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_backend(name: Optional[str] = None) -> StateBackend:
+    """Build the backend selected by STATE_BACKEND"""
+    name = (name or os.getenv("STATE_BACKEND", "sqlite")).lower()
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend(os.getenv("STATE_SQLITE_PATH", "state.db"))
+    if name == "redis":
+        return RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                            prefix=os.getenv("REDIS_KEY_PREFIX", "linxo:"))
+    raise ValueError(f"Unknown STATE_BACKEND: {name} (expected memory, sqlite or redis)")
+
+
+_backend: Optional[StateBackend] = None
+
+
+def get_state_backend() -> StateBackend:
+    """Process-wide backend (created on first use)"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+        logger.info(f"Using {_backend.name} state backend")
+    return _backend
+
+
+async def close_state_backend():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
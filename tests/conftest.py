@@ -0,0 +1,67 @@
+"""
+Shared fixtures
+
+`backend_factory` builds state backends of each kind inside the test's event
+loop; backends built by one factory share their data, like the workers of a
+deployment. Redis runs against fakeredis, or against a real Redis-protocol
+server when REDIS_TEST_URL is set.
+
+`app_main` imports the API with a memory state backend and every file it
+writes in a temporary directory.
+"""
+
+import os
+import uuid
+
+import pytest
+
+from state_backend import MemoryBackend, RedisBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend_factory(request, tmp_path):
+    kind = request.param
+    if kind == "memory":
+        # A single process: every "worker" is the same backend
+        shared = MemoryBackend()
+        return lambda: shared
+    if kind == "sqlite":
+        return lambda: SQLiteBackend(str(tmp_path / "state.db"))
+
+    prefix = f"test-{uuid.uuid4().hex}:"
+    test_url = os.getenv("REDIS_TEST_URL")
+    if test_url:
+        return lambda: RedisBackend(test_url, prefix=prefix)
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def create():
+        backend = RedisBackend("redis://localhost:6379/0", prefix=prefix)
+        backend._redis = fakeredis.FakeAsyncRedis(server=server)
+        return backend
+
+    return create
+
+
+API_KEY = "test-key"
+
+
+@pytest.fixture(scope="session")
+def app_main(tmp_path_factory):
+    root = tmp_path_factory.mktemp("app")
+    environment = pytest.MonkeyPatch()
+    for name, value in {
+        "STATE_BACKEND": "memory",
+        "API_KEY": API_KEY,
+        "PREWARM": "false",
+        "LINXO_EMAIL": "test@example.com",
+        "LINXO_PASSWORD": "password",
+        "RUNS_DIR": str(root / "runs"),
+        "SNAPSHOTS_DIR": str(root / "snapshots"),
+        "ARTIFACTS_DIR": str(root / "artifacts"),
+        "EXPORT_RATE_LIMIT_PER_MINUTE": "0",
+    }.items():
+        environment.setenv(name, value)
+    import main
+    yield main
+    environment.undo()
@@ -0,0 +1,128 @@
+import asyncio
+import types
+
+import pytest
+from fastapi import HTTPException
+
+import admission
+from admission import AdmissionController, RateLimiter
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_full_queue_is_shed_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        running = await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 1
+
+        with pytest.raises(HTTPException) as shed:
+            await controller.acquire()
+        assert shed.value.status_code == 503
+        assert int(shed.value.headers["Retry-After"]) >= 1
+        assert controller.shed_count == 1
+
+        # The queued request gets the slot once it is released
+        controller.release(running)
+        controller.release(await queued)
+        assert controller.stats()["active"] == 0 and controller.stats()["waiting"] == 0
+
+    run(scenario())
+
+
+def test_queue_wait_times_out_with_503():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        running = await controller.acquire()
+        with pytest.raises(HTTPException) as shed:
+            await controller.acquire()
+        assert shed.value.status_code == 503
+        assert controller.waiting == 0
+        controller.release(running)
+        controller.release(await controller.acquire())
+
+    run(scenario())
+
+
+def test_slots_are_released_on_error_paths():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.1)
+        for error in (HTTPException(status_code=504), RuntimeError("browser crashed")):
+            with pytest.raises(type(error)):
+                async with controller.slot():
+                    raise error
+            assert controller.active == 0
+
+        # A waiter cancelled in the queue (client gone) gives its place back
+        async with controller.slot():
+            waiter = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert controller.waiting == 0
+        async with controller.slot():
+            assert controller.active == 1
+        assert controller.active == 0
+
+    run(scenario())
+
+
+def test_memory_pressure_sheds_new_exports(monkeypatch):
+    async def scenario():
+        controller = AdmissionController(max_concurrent=2, max_rss_mb=100)
+        monkeypatch.setattr(admission, "process_tree_rss_bytes", lambda: 200 * 1024 * 1024)
+        with pytest.raises(HTTPException) as shed:
+            await controller.acquire()
+        assert shed.value.status_code == 503 and controller.active == 0
+        monkeypatch.setattr(admission, "process_tree_rss_bytes", lambda: 50 * 1024 * 1024)
+        controller.release(await controller.acquire())
+
+    run(scenario())
+
+
+def test_token_bucket_refills_and_reports_retry_after(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    limiter = RateLimiter(per_minute=6, burst=2)
+
+    limiter.check("key-a")
+    limiter.check("key-a")
+    with pytest.raises(HTTPException) as limited:
+        limiter.check("key-a")
+    assert limited.value.status_code == 429
+    # One token every 10 seconds
+    assert limited.value.headers["Retry-After"] == "10"
+    # Other keys have their own bucket
+    limiter.check("key-b")
+
+    clock.now += 4
+    with pytest.raises(HTTPException) as limited:
+        limiter.check("key-a")
+    assert limited.value.headers["Retry-After"] == "6"
+
+    clock.now += 6
+    limiter.check("key-a")
+    # The bucket never holds more than the burst
+    clock.now += 3600
+    limiter.check("key-a")
+    limiter.check("key-a")
+    with pytest.raises(HTTPException):
+        limiter.check("key-a")
+
+
+def test_rate_limit_can_be_disabled():
+    limiter = RateLimiter(per_minute=0, burst=1)
+    for _ in range(10):
+        limiter.check("key")
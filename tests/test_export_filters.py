@@ -0,0 +1,29 @@
+from datetime import date
+
+from export_filters import ExportFilters
+
+CSV = (
+    "Date;Libellé;Montant;Id du compte;Nom du compte\n"
+    "01/01/2024;Rent;-800,00;12345;Compte courant\n"
+    "02/01/2024;Savings;100,00;67890;Livret A\n"
+)
+
+
+def test_numeric_account_id_is_sent_to_linxo():
+    filters = ExportFilters(date(2024, 1, 1), date(2024, 1, 31), " 12345 ")
+    assert filters.server_side == ["date_from", "date_to", "account_id"]
+    assert filters.history_fragment(2) == (
+        "Search;pageNumber=2;excludeDuplicates=false;startDate=2024-01-01;endDate=2024-01-31;accountId=12345"
+    )
+
+
+def test_account_name_is_only_matched_locally():
+    filters = ExportFilters(account_id="Livret A; #2")
+    assert filters.server_side == []
+    assert filters.history_fragment() == "Search;pageNumber=0;excludeDuplicates=false"
+
+    text, counts = ExportFilters(account_id="compte courant").apply(CSV)
+    assert counts == {"rows_before": 2, "rows_after": 1}
+    assert "Rent" in text and "Savings" not in text
+    _, counts = ExportFilters(account_id="67890").apply(CSV)
+    assert counts["rows_after"] == 1
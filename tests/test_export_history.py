@@ -0,0 +1,81 @@
+import asyncio
+
+import history_extractor
+from conftest import API_KEY
+
+
+class FakePage:
+    async def close(self):
+        pass
+
+
+class FakeSession:
+    page = FakePage()
+    context = None
+    expired = False
+    closed = False
+
+
+def patch_scrape(monkeypatch, main, teardowns):
+    async def setup_playwright(artifacts, storage_state=None):
+        return FakeSession()
+
+    async def teardown_playwright(session, artifacts):
+        # The real teardown awaits the browser; a cancelled cleanup would stop here
+        await asyncio.sleep(0.01)
+        teardowns.append(session)
+
+    async def login_to_linxo(*args):
+        return None
+
+    async def check_gmail_available():
+        return True
+
+    async def scrape_history_page(context, base_url, page_number, exclude_duplicates, selectors):
+        # A long history of slow pages, each a full CSV chunk
+        await asyncio.sleep(0.05)
+        return [{"Date": "01/01/2024", "Libellé": f"Row {page_number}.{i}", "Montant": "-1,00"} for i in range(200)]
+
+    monkeypatch.setattr(main, "setup_playwright", setup_playwright)
+    monkeypatch.setattr(main, "teardown_playwright", teardown_playwright)
+    monkeypatch.setattr(main, "login_to_linxo", login_to_linxo)
+    monkeypatch.setattr(main, "check_gmail_available", check_gmail_available)
+    monkeypatch.setattr(history_extractor, "scrape_history_page", scrape_history_page)
+
+
+def test_client_disconnect_mid_stream_still_cleans_up(app_main, monkeypatch):
+    main = app_main
+    teardowns = []
+    patch_scrape(monkeypatch, main, teardowns)
+
+    async def scenario():
+        messages = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+            if message["type"] == "http.response.body" and message.get("body"):
+                disconnected.set()
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/export-history", "raw_path": b"/export-history",
+            "query_string": b"max_pages=200", "root_path": "", "client": ("test", 1),
+            "server": ("testserver", 80), "headers": [(b"host", b"testserver"), (b"x-api-key", API_KEY.encode())],
+        }
+        await asyncio.wait_for(main.app(scope, receive, send), 10)
+
+        assert messages[0]["status"] == 200
+        job_id = dict(messages[0]["headers"])[b"x-job-id"].decode()
+        # Nothing was streamed after the disconnect, and every held resource was released
+        assert not any(message.get("more_body") is False for message in messages[1:])
+        assert len(teardowns) == 1
+        assert (await main.jobs.get(job_id))["status"] == "failed"
+        assert await main.state.keys("lock:linxo-scrape:") == []
+        assert main.export_admission.active == 0
+
+    asyncio.run(scenario())
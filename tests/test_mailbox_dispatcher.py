@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+import pytest
+
+import mailbox_dispatcher as dispatcher_module
+from gmail_quota import GmailRateLimited
+from mailbox_dispatcher import MailboxDispatcher
+from tracing import record_spans, stop_recording_spans
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class FakeMailbox:
+    """Stands in for the Gmail helpers: emails are listed newest first, like Gmail does"""
+
+    def __init__(self, monkeypatch):
+        self.emails = []
+        self.reads = []
+        self.list_calls = 0
+        self.rate_limit = None
+        monkeypatch.setattr(dispatcher_module, "list_verification_emails", self.list)
+        monkeypatch.setattr(dispatcher_module, "read_verification_email", self.read)
+
+    def deliver(self, code, sent_at):
+        self.emails.append({
+            "id": f"m{len(self.emails)}",
+            "code": code,
+            "internal_date_ms": int(sent_at * 1000),
+            "date": time.strftime("%H:%M:%S", time.localtime(sent_at)),
+        })
+
+    def list(self, after, deadline):
+        self.list_calls += 1
+        if self.rate_limit is not None:
+            raise self.rate_limit
+        matching = [email for email in self.emails if email["internal_date_ms"] >= after * 1000]
+        return [email["id"] for email in sorted(matching, key=lambda email: -email["internal_date_ms"])]
+
+    def read(self, message_id, deadline):
+        self.reads.append(message_id)
+        return dict(next(email for email in self.emails if email["id"] == message_id))
+
+
+def test_poller_spans_are_not_recorded_in_the_first_waiters_run(monkeypatch):
+    mailbox = FakeMailbox(monkeypatch)
+
+    async def scenario():
+        dispatcher = MailboxDispatcher(poll_interval=0.05, clock_skew_seconds=0)
+        now = time.time()
+        first, second = dispatcher.expect_code(now - 2), dispatcher.expect_code(now - 1)
+
+        async def recorded_wait():
+            spans, token = record_spans()
+            try:
+                return await first.wait(2), spans
+            finally:
+                stop_recording_spans(token)
+
+        # The first waiter starts the poller, which keeps polling for the second one
+        waiting = asyncio.create_task(recorded_wait())
+        await asyncio.sleep(0.1)
+        mailbox.deliver("111111", now - 1.5)
+        code, spans = await waiting
+        second_wait = asyncio.create_task(second.wait(2))
+        await asyncio.sleep(0.1)
+        mailbox.deliver("222222", now)
+        assert (code, await second_wait) == ("111111", "222222")
+        assert dispatcher.polls >= 3
+        assert [recorded["name"] for recorded in spans] == ["gmail.wait_verification_code"]
+
+    run(scenario())
+
+
+async def poll(dispatcher):
+    await dispatcher.poll_once()
+    dispatcher._dispatch()
+
+
+def waiting(dispatcher, requested_at):
+    ticket = dispatcher.expect_code(requested_at)
+    ticket.waiting = True
+    return ticket
+
+
+def code_of(ticket):
+    return ticket.future.result() if ticket.future.done() else None
+
+
+def test_oldest_email_goes_to_oldest_preceding_login(monkeypatch):
+    mailbox = FakeMailbox(monkeypatch)
+
+    async def scenario():
+        dispatcher = MailboxDispatcher(clock_skew_seconds=0)
+        now = time.time()
+        first, second = waiting(dispatcher, now - 60), waiting(dispatcher, now - 40)
+        # Sent after the first login only: it cannot be the second login's code
+        mailbox.deliver("111111", now - 50)
+        await poll(dispatcher)
+        assert (code_of(first), code_of(second)) == ("111111", None)
+
+        third = waiting(dispatcher, now - 30)
+        mailbox.deliver("333333", now - 10)
+        mailbox.deliver("222222", now - 20)
+        await poll(dispatcher)
+        assert (code_of(second), code_of(third)) == ("222222", "333333")
+        assert dispatcher.codes_dispatched == 3
+
+    run(scenario())
+
+
+def test_clock_skew_tolerance_and_stale_emails(monkeypatch):
+    mailbox = FakeMailbox(monkeypatch)
+
+    async def scenario():
+        dispatcher = MailboxDispatcher(clock_skew_seconds=5)
+        now = time.time()
+        earlier, login = waiting(dispatcher, now - 60), waiting(dispatcher, now - 30)
+        # Read for the earlier login, which gave up before it was dispatched; older than
+        # the remaining login by more than the skew, so it is a previous session's code
+        mailbox.deliver("999999", now - 36)
+        await dispatcher.poll_once()
+        earlier.close()
+        dispatcher._dispatch()
+        assert code_of(login) is None
+        assert dispatcher.stale_dropped == 1 and dispatcher._unclaimed == []
+
+        # Older than the login, but within the skew between Linxo's and our clocks
+        mailbox.deliver("123456", now - 33)
+        await poll(dispatcher)
+        assert code_of(login) == "123456"
+
+    run(scenario())
+
+
+def test_a_code_is_never_handed_out_twice(monkeypatch):
+    mailbox = FakeMailbox(monkeypatch)
+
+    async def scenario():
+        dispatcher = MailboxDispatcher(poll_interval=0.02, clock_skew_seconds=0)
+        now = time.time()
+        first, second = dispatcher.expect_code(now - 20), dispatcher.expect_code(now - 10)
+        mailbox.deliver("111111", now - 5)
+        results = await asyncio.gather(first.wait(0.3), second.wait(0.3))
+        assert sorted(results, key=str) == ["111111", None]
+        assert mailbox.reads == ["m0"] and dispatcher.polls > 1
+
+        # A later login preceding the email still does not get it: it was read and used
+        late = waiting(dispatcher, now - 15)
+        await poll(dispatcher)
+        assert code_of(late) is None and mailbox.reads == ["m0"]
+
+    run(scenario())
+
+
+def test_unawaited_tickets_expire(monkeypatch):
+    mailbox = FakeMailbox(monkeypatch)
+    monkeypatch.setattr(dispatcher_module, "UNAWAITED_TICKET_SECONDS", 0.05)
+
+    async def scenario():
+        dispatcher = MailboxDispatcher(clock_skew_seconds=0)
+        now = time.time()
+        # Logged in without being asked for a code, and never closed its ticket
+        forgotten = dispatcher.expect_code(now - 60)
+        await asyncio.sleep(0.1)
+        login = waiting(dispatcher, now - 30)
+        mailbox.deliver("222222", now - 10)
+        await poll(dispatcher)
+        assert code_of(forgotten) is None and code_of(login) == "222222"
+        assert forgotten not in dispatcher._tickets
+
+    run(scenario())
+
+
+def test_rate_limit_is_raised_to_waiters_that_time_out(monkeypatch):
+    mailbox = FakeMailbox(monkeypatch)
+    mailbox.rate_limit = GmailRateLimited(0.05)
+
+    async def scenario():
+        dispatcher = MailboxDispatcher(poll_interval=0.02, clock_skew_seconds=0)
+        now = time.time()
+        with pytest.raises(GmailRateLimited):
+            await dispatcher.expect_code(now - 10).wait(0.2)
+        assert dispatcher.stats()["rate_limited"] is True
+        assert dispatcher._tickets == []
+
+        # Once Gmail answers again, the poller resumes and the next login gets its code
+        mailbox.rate_limit = None
+        mailbox.deliver("123456", now - 5)
+        assert await dispatcher.expect_code(now - 8).wait(1) == "123456"
+        assert dispatcher.stats()["rate_limited"] is False
+
+    run(scenario())
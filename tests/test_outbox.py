@@ -0,0 +1,181 @@
+import asyncio
+
+from change_detection import ContentHashes, DeliveryState
+from outbox import DeliveryOutbox
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Webhook:
+    """Records sends; fails while `failing` is set"""
+
+    def __init__(self, failing: bool = False):
+        self.failing = failing
+        self.sent = []
+
+    async def send(self, payload: bytes):
+        if self.failing:
+            return False, "HTTP 502"
+        self.sent.append(payload)
+        return True, None
+
+
+def make_outbox(backend, webhook, delivered=None, **options):
+    async def on_delivered(metadata):
+        if delivered is not None:
+            delivered.append(metadata)
+
+    options = {"retry_seconds": 0, "max_attempts": 3, "lease_seconds": 60, **options}
+    return DeliveryOutbox(backend, webhook.send, on_delivered, **options)
+
+
+def test_failed_delivery_is_retried_until_delivered(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        webhook, delivered = Webhook(failing=True), []
+        outbox = make_outbox(backend, webhook, delivered)
+        await outbox.enqueue("all", b"csv", "HTTP 502", hashes={"overall": "h"})
+
+        assert await outbox.process_due() == 1
+        assert webhook.sent == []
+        [item] = await outbox.pending()
+        assert item["attempts"] == 2 and item["last_error"] == "HTTP 502"
+
+        webhook.failing = False
+        assert await outbox.process_due() == 1
+        assert webhook.sent == [b"csv"]
+        assert delivered == [{"hashes": {"overall": "h"}, "scope": "all"}]
+        assert await outbox.pending() == []
+        assert await outbox.process_due() == 0
+        await backend.close()
+
+    run(scenario())
+
+
+def test_newer_enqueue_supersedes_older_item(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        webhook = Webhook()
+        outbox = make_outbox(backend, webhook)
+        await outbox.enqueue("all", b"old", "timeout")
+        await outbox.enqueue("all", b"new", "timeout")
+        await outbox.enqueue("category=Food", b"food", "timeout")
+        assert await outbox.process_due() == 2
+        assert sorted(webhook.sent) == [b"food", b"new"]
+        assert outbox.superseded == 1
+        await backend.close()
+
+    run(scenario())
+
+
+def test_discard_drops_the_queued_item(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        webhook = Webhook()
+        outbox = make_outbox(backend, webhook)
+        await outbox.enqueue("all", b"old", "timeout")
+        async with outbox.lock("all"):
+            assert await outbox.discard("all") is True
+            assert await outbox.discard("all") is False
+        assert await outbox.process_due() == 0
+        assert webhook.sent == []
+        await backend.close()
+
+    run(scenario())
+
+
+def test_leased_item_is_left_to_its_holder_and_survives_a_dead_worker(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        webhook = Webhook()
+        outbox = make_outbox(backend, webhook)
+        await outbox.enqueue("all", b"csv", "timeout")
+
+        # Another worker took the lease and died without releasing it
+        assert await backend.acquire_lock("delivery:all", ttl=0.2) is not None
+        assert await outbox.process_due() == 0
+        assert len(await outbox.pending()) == 1
+
+        await asyncio.sleep(0.3)
+        assert await outbox.process_due() == 1
+        assert webhook.sent == [b"csv"]
+        await backend.close()
+
+    run(scenario())
+
+
+def test_item_is_kept_when_the_send_is_cancelled(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        started = asyncio.Event()
+
+        async def hanging_send(payload):
+            started.set()
+            await asyncio.sleep(60)
+
+        async def on_delivered(metadata):
+            pass
+
+        outbox = DeliveryOutbox(backend, hanging_send, on_delivered, retry_seconds=0, lease_seconds=0.2)
+        await outbox.enqueue("all", b"csv", "timeout")
+        worker = asyncio.create_task(outbox.process_due())
+        await started.wait()
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+        [item] = await outbox.pending()
+        assert item["attempts"] == 1
+        webhook = Webhook()
+        outbox.send = webhook.send
+        assert await outbox.process_due() == 1
+        assert webhook.sent == [b"csv"]
+        await backend.close()
+
+    run(scenario())
+
+
+def test_delivery_is_dropped_after_max_attempts(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        webhook = Webhook(failing=True)
+        outbox = make_outbox(backend, webhook, retry_seconds=0, max_retry_seconds=0, max_attempts=3)
+        await outbox.enqueue("all", b"csv", "timeout")
+        assert await outbox.process_due() == 1
+        assert await outbox.process_due() == 1
+        assert await outbox.pending() == []
+        assert outbox.dropped == 1
+        await backend.close()
+
+    run(scenario())
+
+
+def test_older_delivery_does_not_overwrite_newer_hash(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        state = DeliveryState(backend)
+        newer = ContentHashes(overall="new", accounts={}, row_count=2)
+        older = ContentHashes(overall="old", accounts={}, row_count=1)
+        assert await state.record("all", newer, produced_at=200) is True
+        assert await state.record("all", older, produced_at=100) is False
+        assert (await state.last("all"))["hash"] == "new"
+        assert not await state.is_changed("all", newer)
+        await backend.close()
+
+    run(scenario())
+
+
+def test_worker_purges_expired_entries():
+    async def scenario():
+        from state_backend import MemoryBackend
+
+        backend = MemoryBackend()
+        outbox = make_outbox(backend, Webhook(), purge_interval_seconds=60)
+        await backend.set("job:old", b"{}", ttl=0.1)
+        await backend.set("job:new", b"{}", ttl=60)
+        await asyncio.sleep(0.2)
+        await outbox.purge_if_due()
+        assert list(backend._values) == ["job:new"]
+
+    run(scenario())
@@ -0,0 +1,105 @@
+import pytest
+
+import rollups
+from rollups import RollupStore, aggregate
+from snapshots import SnapshotStore
+
+HEADER = "Date;Libellé;Catégorie;Montant;Nom du compte\n"
+
+EXPORTS = [
+    HEADER + (
+        "01/01/2024;Rent;Housing;-800,00;Checking\n"
+        "15/01/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "05/02/2024;Grocery;Food;-50,00;Checking\n"
+        "07/02/2024;Gym;Sport;-30,00;Card\n"
+        "25/02/2024;Salary;Income;2 500,00;Checking\n"
+    ),
+    # Adds: a third coffee and a March month; removes: the gym (its account and category
+    # disappear from February); modifies: grocery recategorized
+    HEADER + (
+        "01/01/2024;Rent;Housing;-800,00;Checking\n"
+        "15/01/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "05/02/2024;Grocery;Groceries;-50,00;Checking\n"
+        "25/02/2024;Salary;Income;2 500,00;Checking\n"
+        "01/03/2024;Refund;Food;12,00;Card\n"
+        "03/03/2024;Cinema;Leisure;-9,50;Card\n"
+    ),
+    # Removes: a coffee and the rent (January loses its Housing group); modifies: the refund
+    # turns into a charge; adds: an undated row
+    HEADER + (
+        "15/01/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "02/02/2024;Coffee;Food;-3,20;Checking\n"
+        "05/02/2024;Grocery;Groceries;-50,00;Checking\n"
+        "25/02/2024;Salary;Income;2 500,00;Checking\n"
+        "01/03/2024;Refund;Food;-12,00;Card\n"
+        "03/03/2024;Cinema;Leisure;-9,50;Card\n"
+        ";Pending;Food;-1,00;Card\n"
+    ),
+]
+
+
+@pytest.fixture(params=["pyarrow", "python"])
+def aggregation(request, monkeypatch):
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+        monkeypatch.setattr(rollups, "PARQUET_AVAILABLE", True)
+    else:
+        monkeypatch.setattr(rollups, "PARQUET_AVAILABLE", False)
+    return request.param
+
+
+def full_aggregation(snapshots, manifest):
+    return aggregate(manifest["header"], snapshots.rows(manifest))
+
+
+def test_incremental_rollups_equal_full_aggregation(tmp_path, aggregation):
+    snapshots = SnapshotStore(str(tmp_path), max_age_days=0)
+    store = RollupStore(snapshots)
+
+    previous = None
+    modes = []
+    for i, csv_text in enumerate(EXPORTS):
+        manifest = snapshots.save(f"export{i}", "all", csv_text)
+        modes.append(store.update(previous, manifest)["mode"])
+        assert store.get("all")["tables"] == full_aggregation(snapshots, manifest)
+        previous = manifest
+    assert modes == ["rebuilt", "incremental", "incremental"]
+
+    # The same export again leaves the rollup untouched
+    manifest = snapshots.save("export3", "all", EXPORTS[-1])
+    assert store.update(previous, manifest)["mode"] == "unchanged"
+    assert store.get("all")["tables"] == full_aggregation(snapshots, manifest)
+
+
+def test_incremental_totals_and_summary(tmp_path, aggregation):
+    snapshots = SnapshotStore(str(tmp_path), max_age_days=0)
+    store = RollupStore(snapshots)
+    first = snapshots.save("export0", "all", EXPORTS[0])
+    store.update(None, first)
+    store.update(first, snapshots.save("export1", "all", EXPORTS[1]))
+
+    tables = store.get("all")["tables"]
+    assert tables["month"]['["2024-02"]'] == [5, 250000, -5960]
+    assert tables["month_category"]['["2024-02", "Groceries"]'] == [1, 0, -5000]
+    assert '["2024-02", "Sport"]' not in tables["month_category"]
+    assert '["2024-02", "Card"]' not in tables["month_account"]
+    assert tables["month_account"]['["2024-03", "Card"]'] == [2, 1200, -950]
+
+    summary = store.summary("all")
+    assert summary["export_id"] == "export1" and summary["row_count"] == 9
+    assert {"month": "2024-03", "transactions": 2, "income": 12.0, "spend": -9.5, "net": 2.5} in summary["by_month"]
+
+
+def test_pyarrow_and_python_aggregations_agree():
+    pytest.importorskip("pyarrow")
+    for csv_text in EXPORTS:
+        header, *lines = [line.split(";") for line in csv_text.splitlines()]
+        rows = [dict(zip(header, values)) for values in lines]
+        data = rollups._group_columns(header, rows)
+        assert rollups._aggregate_arrow(data) == rollups._aggregate_python(data)
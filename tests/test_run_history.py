@@ -0,0 +1,38 @@
+import time
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from admission import RateLimiter
+from conftest import API_KEY
+
+
+def recorded_runs(main, since):
+    return main.run_history.load(since, "export-csv")
+
+
+def test_rejected_requests_are_not_recorded_as_runs(app_main, monkeypatch):
+    main = app_main
+    since = time.time()
+    client = TestClient(main.app)
+
+    assert client.get("/export-csv").status_code == 403
+    assert client.get("/export-csv", headers={"X-API-Key": "wrong"}).status_code == 401
+
+    monkeypatch.setattr(main, "export_rate_limiter", RateLimiter(per_minute=1, burst=1))
+
+    async def scrape_linxo_csv(settings, filters, gmail_available, artifacts):
+        raise HTTPException(status_code=504, detail="Linxo timed out")
+
+    async def check_gmail_available():
+        return True
+
+    monkeypatch.setattr(main, "scrape_linxo_csv", scrape_linxo_csv)
+    monkeypatch.setattr(main, "check_gmail_available", check_gmail_available)
+    headers = {"X-API-Key": API_KEY}
+    assert client.get("/export-csv", headers=headers).status_code == 504
+    assert client.get("/export-csv", headers=headers).status_code == 429
+
+    # Only the admitted request is a run
+    [run] = recorded_runs(main, since)
+    assert run["outcome"] == "failed" and run["status"] == 504
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+import settings
+from settings import hash_api_key, reload_settings
+
+
+def authenticates(api_key):
+    try:
+        asyncio.run(auth.verify_api_key(api_key))
+        return True
+    except HTTPException as e:
+        assert e.status_code == 401
+        return False
+
+
+@pytest.fixture
+def dotenv_file(tmp_path, monkeypatch):
+    for name in ("API_KEY", "API_KEYS", "API_KEYS_FILE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("API_KEY", "process-key")
+    path = tmp_path / ".env"
+    path.write_text("")
+    monkeypatch.setattr(settings, "DOTENV_PATH", str(path))
+    monkeypatch.setattr(settings, "_process_environ", {"API_KEY": "process-key"})
+    monkeypatch.setattr(settings, "_dotenv_applied", {})
+    monkeypatch.setattr(settings, "_settings", None)
+    yield path
+    auth._clear_cache()
+
+
+def test_key_removed_from_dotenv_stops_authenticating_after_reload(dotenv_file):
+    dotenv_file.write_text(f"API_KEYS=n8n:{hash_api_key('n8n-key')}:export\n")
+    reload_settings()
+    assert authenticates("n8n-key") and authenticates("process-key")
+
+    dotenv_file.write_text("")
+    reload_settings()
+    assert not authenticates("n8n-key")
+    # Keys set in the process environment are not affected
+    assert authenticates("process-key")
+
+
+def test_dotenv_override_removed_falls_back_to_process_value(dotenv_file):
+    dotenv_file.write_text("API_KEY=rotated-key\n")
+    reload_settings()
+    assert authenticates("rotated-key") and not authenticates("process-key")
+
+    dotenv_file.write_text("")
+    reload_settings()
+    assert authenticates("process-key") and not authenticates("rotated-key")
@@ -0,0 +1,135 @@
+import json
+import os
+import time
+
+from snapshots import SnapshotStore, snapshot_rows
+
+HEADER = "Date;Libellé;Catégorie;Montant;Nom du compte\n"
+
+OLD_CSV = HEADER + (
+    "01/01/2024;Rent;Housing;-800,00;Checking\n"
+    "15/01/2024;Coffee;Food;-3,00;Checking\n"
+    "02/02/2024;Coffee;Food;-3,00;Checking\n"
+    "02/02/2024;Coffee;Food;-3,00;Checking\n"
+    "05/02/2024;Grocery;Food;-50,00;Checking\n"
+    "07/02/2024;Gym;Sport;-30,00;Checking\n"
+)
+
+# January unchanged, one more identical coffee, grocery recategorized, gym gone, a March salary
+NEW_CSV = HEADER + (
+    "01/01/2024;Rent;Housing;-800,00;Checking\n"
+    "15/01/2024;Coffee;Food;-3,00;Checking\n"
+    "02/02/2024;Coffee;Food;-3,00;Checking\n"
+    "02/02/2024;Coffee;Food;-3,00;Checking\n"
+    "02/02/2024;Coffee;Food;-3,00;Checking\n"
+    "05/02/2024;Grocery;Groceries;-50,00;Checking\n"
+    "01/03/2024;Salary;Income;2500,00;Checking\n"
+)
+
+
+def chunk_files(store):
+    return sorted(name.split(".", 1)[0] for name in os.listdir(store.chunk_dir))
+
+
+def test_identical_rows_get_distinct_keys_independent_of_order():
+    header, chunks = snapshot_rows(OLD_CSV)
+    assert header == ["Date", "Libellé", "Catégorie", "Montant", "Nom du compte"]
+    assert sorted(chunks) == ["Checking|2024-01", "Checking|2024-02"]
+    coffees = [row for row in chunks["Checking|2024-02"] if row.values[1] == "Coffee"]
+    assert len(coffees) == 2 and coffees[0].key != coffees[1].key
+    assert coffees[0].content_hash == coffees[1].content_hash
+
+    lines = OLD_CSV.splitlines(keepends=True)
+    _, shuffled = snapshot_rows(lines[0] + "".join(reversed(lines[1:])))
+    assert {name: [row.key for row in rows] for name, rows in shuffled.items()} == \
+        {name: [row.key for row in rows] for name, rows in chunks.items()}
+
+
+def test_save_and_read_back(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    manifest = store.save("old1", "all", OLD_CSV)
+    assert manifest["row_count"] == 6
+    assert len(manifest["chunks"]) == 2
+    assert store.get("old1") == manifest
+    assert store.get("../old1") is None
+    assert store.latest("all")["export_id"] == "old1"
+    rows = list(store.rows(manifest))
+    assert len(rows) == 6
+    assert {"Date": "07/02/2024", "Libellé": "Gym", "Catégorie": "Sport",
+            "Montant": "-30,00", "Nom du compte": "Checking"} in rows
+
+
+def test_diff_reports_added_removed_and_modified_rows(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    old = store.save("old1", "all", OLD_CSV)
+    new = store.save("new1", "all", NEW_CSV)
+    diff = store.diff(old, new)
+
+    assert diff["counts"] == {"added": 2, "removed": 1, "modified": 1}
+    assert sorted((row["Date"], row["Libellé"]) for row in diff["added"]) == \
+        [("01/03/2024", "Salary"), ("02/02/2024", "Coffee")]
+    assert [row["Libellé"] for row in diff["removed"]] == ["Gym"]
+    [modified] = diff["modified"]
+    assert modified["before"]["Catégorie"] == "Food"
+    assert modified["after"]["Catégorie"] == "Groceries"
+    # January is the same chunk in both snapshots and is not read
+    assert diff["chunks"] == {"unchanged": 1, "compared": 3}
+
+    assert store.diff(new, new)["counts"] == {"added": 0, "removed": 0, "modified": 0}
+
+
+def test_unchanged_months_reuse_chunks_across_snapshots(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    old = store.save("old1", "all", OLD_CSV)
+    new = store.save("new1", "all", NEW_CSV)
+    again = store.save("again1", "other", NEW_CSV)
+
+    assert old["chunks"][0] == new["chunks"][0]
+    assert again["chunks"] == new["chunks"]
+    # Old: Jan, Feb; new: Feb, Mar; the January chunk and the new months are stored once
+    assert chunk_files(store) == sorted(set(old["chunks"]) | set(new["chunks"]))
+    assert len(chunk_files(store)) == 4
+
+
+def backdate(store, manifest, created_at):
+    manifest["created_at"] = created_at
+    store._write_atomic(os.path.join(store.manifest_dir, f"{manifest['export_id']}.json"),
+                        json.dumps(manifest).encode("utf-8"))
+    for name in os.listdir(store.chunk_dir):
+        os.utime(os.path.join(store.chunk_dir, name), (created_at, created_at))
+
+
+def test_prune_keeps_latest_per_scope_and_referenced_chunks(tmp_path):
+    store = SnapshotStore(str(tmp_path), max_age_days=1)
+    old = store.save("old1", "all", OLD_CSV)
+    new = store.save("new1", "all", NEW_CSV)
+    other = store.save("other1", "other", OLD_CSV)
+    assert store.prune() == []
+
+    expired = time.time() - 3 * 86400
+    backdate(store, old, expired)
+    backdate(store, new, expired + 1)
+    backdate(store, other, expired)
+
+    # old1 expired and is not its scope's latest; new1 and other1 are
+    assert store.prune() == ["old1"]
+    assert [manifest["export_id"] for manifest in store.list()] == ["other1", "new1"]
+    # other1 has the same chunks as old1, so none is removed
+    assert chunk_files(store) == sorted(set(old["chunks"]) | set(new["chunks"]))
+
+    # Saving other2 prunes other1; its February chunk is no longer referenced, January still is
+    store.save("other2", "other", NEW_CSV)
+    assert [manifest["export_id"] for manifest in store.list()] == ["new1", "other2"]
+    assert chunk_files(store) == sorted(new["chunks"])
+
+
+def test_prune_spares_recent_unreferenced_chunks(tmp_path):
+    store = SnapshotStore(str(tmp_path), max_age_days=1)
+    old = store.save("old1", "all", OLD_CSV)
+    store.save("new1", "all", NEW_CSV)
+    old["created_at"] = time.time() - 3 * 86400
+    store._write_atomic(os.path.join(store.manifest_dir, "old1.json"), json.dumps(old).encode("utf-8"))
+
+    # A chunk written within CHUNK_GRACE_SECONDS may belong to a save in progress
+    assert store.prune() == ["old1"]
+    assert len(chunk_files(store)) == 4
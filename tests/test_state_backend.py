@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from state_backend import LockNotAcquired, StateBackend
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_get_set_delete(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        assert await backend.get("missing") is None
+        await backend.set("key", b"value")
+        assert await backend.get("key") == b"value"
+        await backend.set("key", b"other")
+        assert await backend.get("key") == b"other"
+        await backend.delete("key")
+        assert await backend.get("key") is None
+        await backend.set_json("json", {"rows": [1, 2]})
+        assert await backend.get_json("json") == {"rows": [1, 2]}
+        await backend.close()
+
+    run(scenario())
+
+
+def test_ttl_expiry(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        await backend.set("short", b"1", ttl=0.2)
+        await backend.set("long", b"2", ttl=60)
+        await backend.set("forever", b"3")
+        assert await backend.get("short") == b"1"
+        await asyncio.sleep(0.3)
+        assert await backend.get("short") is None
+        assert await backend.get("long") == b"2"
+        assert await backend.get("forever") == b"3"
+        await backend.close()
+
+    run(scenario())
+
+
+def test_keys_by_prefix(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        await backend.set("job:a", b"1")
+        await backend.set("job:b", b"2")
+        await backend.set("job:expired", b"3", ttl=0.1)
+        await backend.set("jobs", b"4")
+        await backend.set("cache:job:c", b"5")
+        await backend.set("odd*[key]", b"6")
+        await asyncio.sleep(0.2)
+        assert sorted(await backend.keys("job:")) == ["job:a", "job:b"]
+        assert await backend.keys("odd*[") == ["odd*[key]"]
+        assert await backend.keys("nothing:") == []
+        await backend.close()
+
+    run(scenario())
+
+
+def test_purge_expired(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        await backend.set("job:old", b"1", ttl=0.1)
+        await backend.set("job:new", b"2", ttl=60)
+        await asyncio.sleep(0.2)
+        # Redis expires keys natively and reports nothing to purge
+        assert await backend.purge_expired() == (0 if backend.name == "redis" else 1)
+        assert await backend.get("job:new") == b"2"
+        assert await backend.keys("job:") == ["job:new"]
+        assert await backend.purge_expired() == 0
+        await backend.close()
+
+    run(scenario())
+
+
+def test_lock_is_exclusive_and_released_by_holder_only(backend_factory):
+    async def scenario():
+        worker_a, worker_b = backend_factory(), backend_factory()
+        token = await worker_a.acquire_lock("scrape", ttl=60)
+        assert token is not None
+        assert await worker_b.acquire_lock("scrape", ttl=60) is None
+        assert await worker_b.release_lock("scrape", "not-the-token") is False
+        assert await worker_b.acquire_lock("scrape", ttl=60) is None
+        assert await worker_a.release_lock("scrape", token) is True
+        assert await worker_a.release_lock("scrape", token) is False
+        other = await worker_b.acquire_lock("scrape", ttl=60)
+        assert other is not None and other != token
+        # Locks are independent by name
+        assert await worker_a.acquire_lock("another", ttl=60) is not None
+        await worker_a.close()
+        await worker_b.close()
+
+    run(scenario())
+
+
+def test_lock_expires_after_ttl(backend_factory):
+    async def scenario():
+        worker_a, worker_b = backend_factory(), backend_factory()
+        stale = await worker_a.acquire_lock("scrape", ttl=0.2)
+        assert stale is not None
+        await asyncio.sleep(0.3)
+        token = await worker_b.acquire_lock("scrape", ttl=60)
+        assert token is not None
+        # The expired holder cannot release the new holder's lock
+        assert await worker_a.release_lock("scrape", stale) is False
+        assert await worker_b.acquire_lock("scrape", ttl=60) is None
+        await worker_a.close()
+        await worker_b.close()
+
+    run(scenario())
+
+
+def test_lock_context_manager(backend_factory):
+    async def scenario():
+        backend = backend_factory()
+        async with backend.lock("scrape", ttl=60):
+            with pytest.raises(LockNotAcquired):
+                async with backend.lock("scrape", ttl=60, wait=0):
+                    pass
+            with pytest.raises(LockNotAcquired):
+                async with backend.lock("scrape", ttl=60, wait=0.3, poll_interval=0.05):
+                    pass
+        # Released on exit
+        async with backend.lock("scrape", ttl=60):
+            pass
+
+        # A waiter gets the lock once the holder releases it
+        async def hold():
+            async with backend.lock("scrape", ttl=60):
+                await asyncio.sleep(0.2)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.05)
+        async with backend.lock("scrape", ttl=60, wait=2, poll_interval=0.05):
+            assert holder.done()
+        await backend.close()
+
+    run(scenario())
+
+
+def test_queue_is_fifo_and_hands_each_item_out_once(backend_factory):
+    async def scenario():
+        worker_a, worker_b = backend_factory(), backend_factory()
+        assert await worker_a.pop("outbox") is None
+        for value in (b"1", b"2", b"3"):
+            await worker_a.push("outbox", value)
+        await worker_a.push("other", b"x")
+        assert await worker_b.pop("outbox") == b"1"
+        assert await worker_a.pop("outbox") == b"2"
+        assert await worker_b.pop("outbox") == b"3"
+        assert await worker_a.pop("outbox") is None
+        assert await worker_b.pop("other") == b"x"
+        await worker_a.close()
+        await worker_b.close()
+
+    run(scenario())
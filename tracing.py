@@ -0,0 +1,269 @@
+"""
+OpenTelemetry tracing helpers
+
+Tracing is optional: if the opentelemetry packages are not installed or
+OTEL_TRACES_EXPORTER is unset/"none", every helper here is a cheap no-op.
+
+Supported exporters (OTEL_TRACES_EXPORTER):
+    otlp     - OTLP over HTTP (endpoint from OTEL_EXPORTER_OTLP_ENDPOINT)
+    console  - print spans to stdout
+    file     - append one JSON span per line to OTEL_TRACES_FILE (default: traces.jsonl)
+"""
+
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace, propagate
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+SERVICE_NAME = "linxo-scraper-api"
+
+_tracer = None
+
+# Optional per-task collector of (span name, duration in seconds), used by benchmarks
+_stage_recorder: ContextVar[Optional[list]] = ContextVar("stage_recorder", default=None)
+# Optional per-task collector of finished spans with their attributes, used by the run history
+_span_recorder: ContextVar[Optional[list]] = ContextVar("span_recorder", default=None)
+
+
+class _NoopSpan:
+    """Stand-in span used when tracing is disabled"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _RecordingSpan:
+    """Keeps a copy of the attributes set on a span while forwarding them"""
+
+    def __init__(self, inner, attributes: Dict[str, Any]):
+        self._inner = inner
+        self.attributes = attributes
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+        self._inner.set_attribute(key, value)
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+        self._inner.set_attributes(attributes)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def _clean_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop None values, OTel rejects them"""
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+def _build_exporter(exporter_name: str):
+    """Create the span exporter selected by OTEL_TRACES_EXPORTER"""
+    if exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    if exporter_name == "console":
+        return ConsoleSpanExporter()
+
+    if exporter_name == "file":
+        file_path = os.getenv("OTEL_TRACES_FILE", "traces.jsonl")
+        trace_file = open(file_path, "a", encoding="utf-8")
+        logger.info(f"Writing traces to {file_path}")
+        return ConsoleSpanExporter(
+            out=trace_file,
+            formatter=lambda span: json.dumps(json.loads(span.to_json())) + "\n"
+        )
+
+    raise ValueError(f"Unsupported OTEL_TRACES_EXPORTER: {exporter_name}")
+
+
+def setup_tracing() -> bool:
+    """
+    Configure the global tracer provider from environment variables.
+
+    Returns:
+        bool: True if tracing is enabled, False otherwise
+    """
+    global _tracer
+
+    exporter_name = os.getenv("OTEL_TRACES_EXPORTER", "none").lower()
+    if exporter_name == "none":
+        logger.info("Tracing disabled (OTEL_TRACES_EXPORTER not set)")
+        return False
+
+    if not OTEL_AVAILABLE:
+        logger.warning("OTEL_TRACES_EXPORTER is set but opentelemetry is not installed, tracing disabled")
+        return False
+
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        resource = Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", SERVICE_NAME)})
+        provider = TracerProvider(resource=resource)
+        provider.add_span_processor(BatchSpanProcessor(_build_exporter(exporter_name)))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer(SERVICE_NAME)
+        logger.info(f"Tracing enabled with '{exporter_name}' exporter")
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up tracing: {str(e)}")
+        return False
+
+
+def shutdown_tracing():
+    """Flush pending spans on shutdown"""
+    if _tracer is None:
+        return
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Start a child span of the current context.
+
+    Exceptions are recorded on the span and re-raised. The span duration is
+    also reported to the active stage recorder, and the span with its final
+    attributes to the active span recorder, if any.
+    """
+    recorder = _stage_recorder.get()
+    span_recorder = _span_recorder.get()
+    recorded_attributes = dict(attributes) if span_recorder is not None else None
+    start_time = time.perf_counter()
+    try:
+        if _tracer is None:
+            current = _NOOP_SPAN
+            yield current if recorded_attributes is None else _RecordingSpan(current, recorded_attributes)
+        else:
+            with _tracer.start_as_current_span(name, attributes=_clean_attributes(attributes)) as current:
+                yield current if recorded_attributes is None else _RecordingSpan(current, recorded_attributes)
+    finally:
+        duration = time.perf_counter() - start_time
+        if recorder is not None:
+            recorder.append((name, duration))
+        if span_recorder is not None:
+            span_recorder.append({"name": name, "seconds": duration, "attributes": recorded_attributes})
+
+
+@contextmanager
+def record_stages():
+    """
+    Collect the duration of every span opened in the current context.
+
+    Works whether or not tracing is enabled. Yields a list of
+    (span name, seconds) tuples that fills up as spans complete.
+    """
+    stages = []
+    token = _stage_recorder.set(stages)
+    try:
+        yield stages
+    finally:
+        _stage_recorder.reset(token)
+
+
+def record_spans() -> Tuple[list, Token]:
+    """
+    Collect every span finished from now on in the current context, with its attributes.
+
+    Returns the list that fills up with {"name", "seconds", "attributes"}
+    dicts, and the token to pass to stop_recording_spans() when done.
+    """
+    spans = []
+    return spans, _span_recorder.set(spans)
+
+
+def stop_recording_spans(token: Token):
+    """Restore the span recorder that was active before record_spans()"""
+    try:
+        _span_recorder.reset(token)
+    except ValueError:
+        # Stopped from another context than the one that started recording
+        logger.debug("Span recorder stopped outside its context")
+
+
+def current_span():
+    """Return the active span (or a no-op span when tracing is disabled)"""
+    if _tracer is None:
+        return _NOOP_SPAN
+    return trace.get_current_span()
+
+
+def inject_trace_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Add W3C trace context headers (traceparent/tracestate) for outgoing calls"""
+    headers = dict(headers or {})
+    if _tracer is not None:
+        propagate.inject(headers)
+    return headers
+
+
+class _ServerSpanMiddleware:
+    """
+    Pure ASGI middleware starting a server span per HTTP request
+
+    The span ends once the response has been sent, streamed bodies included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        parent_context = propagate.extract(headers)
+        with _tracer.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context=parent_context,
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.method": scope["method"],
+                "http.route": scope["path"],
+            }
+        ) as server_span:
+
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    server_span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        server_span.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
+
+
+def instrument_app(app):
+    """Start a server span per request, continuing any incoming trace context; call after setup_tracing()"""
+    if _tracer is None:
+        return
+    app.add_middleware(_ServerSpanMiddleware)
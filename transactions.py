@@ -0,0 +1,131 @@
+"""
+Linxo CSV decoding and parsing helpers
+
+Linxo exports are usually UTF-16 LE, tab-separated, with French headers
+("Date", "Libellé", "Catégorie", "Montant", "Nom du compte", ...).
+"""
+
+import codecs
+import csv
+import io
+import logging
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Known header names for the columns we interpret, in order of preference
+COLUMN_ALIASES = {
+    "date": ["Date", "Date opération", "Date d'opération"],
+    "label": ["Libellé", "Libelle", "Label", "Description"],
+    "category": ["Catégorie", "Categorie", "Category"],
+    "amount": ["Montant", "Amount"],
+    "account": ["Nom du compte", "Compte", "Account", "Account name"],
+    "account_id": ["Id du compte", "Account id", "Account ID"],
+}
+
+
+def detect_encoding(csv_content: bytes) -> str:
+    """
+    Guess the encoding of a CSV export: byte order mark first, then NUL byte
+    positions (UTF-16 text of a mostly Latin CSV has a NUL in every ASCII
+    character), then UTF-8, falling back to Latin-1 for other 8-bit exports.
+    """
+    if csv_content.startswith(codecs.BOM_UTF8):
+        return 'utf-8'
+    if csv_content.startswith(codecs.BOM_UTF16_LE):
+        return 'utf-16-le'
+    if csv_content.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16-be'
+    sample = csv_content[:4096]
+    if b"\x00" in sample:
+        even_nuls = sample[0::2].count(0)
+        odd_nuls = sample[1::2].count(0)
+        return 'utf-16-be' if even_nuls > odd_nuls else 'utf-16-le'
+    try:
+        csv_content.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def decode_csv(csv_content: bytes) -> Tuple[str, str]:
+    """
+    Decode a Linxo CSV export.
+
+    A byte order mark is kept in the text (as U+FEFF) so that encoding the
+    text again gives back the original bytes.
+
+    Returns:
+        (text, encoding) - the encoding is needed to write the data back unchanged
+    """
+    encoding = detect_encoding(csv_content)
+    text = csv_content.decode(encoding)
+    logger.info(f"Decoded CSV as {encoding}")
+    return text, encoding
+
+
+def detect_delimiter(header_line: str) -> str:
+    """Pick the most frequent of tab, semicolon and comma in the header line"""
+    return max(["\t", ";", ","], key=header_line.count)
+
+
+def resolve_columns(header: List[str]) -> Dict[str, Optional[str]]:
+    """Map logical column names (date, amount, ...) to the actual header names"""
+    normalized = {name.strip().lstrip("\ufeff").lower(): name for name in header}
+    resolved = {}
+    for logical, aliases in COLUMN_ALIASES.items():
+        resolved[logical] = next((normalized[a.lower()] for a in aliases if a.lower() in normalized), None)
+    return resolved
+
+
+def parse_csv(text: str) -> Tuple[List[str], List[Dict[str, str]], str]:
+    """
+    Parse decoded CSV text.
+
+    Returns:
+        (header, rows, delimiter) where rows are dicts keyed by header name
+    """
+    first_line = text.split("\n", 1)[0]
+    delimiter = detect_delimiter(first_line)
+    reader = csv.reader(io.StringIO(text, newline=""), delimiter=delimiter)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return [], [], delimiter
+    rows = [dict(zip(header, values)) for values in reader if any(value.strip() for value in values)]
+    return header, rows, delimiter
+
+
+def serialize_csv(header: List[str], rows: List[Dict[str, str]], delimiter: str) -> str:
+    """Write rows back in the same layout as Linxo's export"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=header, delimiter=delimiter,
+                            lineterminator="\r\n", extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def parse_date(value: str) -> Optional[date]:
+    """Parse Linxo dates (dd/mm/yyyy), also accepting ISO dates"""
+    value = (value or "").strip()
+    for date_format in ("%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(value: str) -> Optional[Decimal]:
+    """Parse French-formatted amounts such as '-1 234,56' or '12,30 €'"""
+    cleaned = (value or "").replace("\u00a0", "").replace("\u202f", "").replace(" ", "").replace("€", "")
+    if "," in cleaned and "." in cleaned:
+        cleaned = cleaned.replace(".", "")
+    cleaned = cleaned.replace(",", ".")
+    try:
+        return Decimal(cleaned)
+    except InvalidOperation:
+        return None